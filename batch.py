@@ -0,0 +1,329 @@
+"""
+一括検索（バッチ）
+
+多数の自社商品URLについて、商品取得 → 競合検索 をまとめて実行し、
+結果を1つのCSV（商品URLで重複除外）に書き出す。
+
+- 同時に処理する商品数は concurrency で制限（API呼び出し自体はレートリミッターが調整）
+- 1商品終わるごとに状態ファイル（JSONL）へ追記するので、途中で落ちても
+  同じ状態ファイルを指定して再実行すれば完了済みの商品は飛ばして続きから再開する
+- sheet_sync（sheet_sync.py のキュー）を渡すと、1商品終わるごとにJANのある競合を
+  スプレッドシートへの送信キューに入れる（書き込みはキュー側がまとめて行う）
+- shared（state.py の共有状態）を渡すと、実行権をリースで取り、進捗を共有する
+  → 複数ワーカーのどこで再開・進捗確認されても、同じジョブが二重に走らない
+    （状態ファイルは全ワーカーから見える場所に置くこと）
+  共有先とのやりとりは通信を伴うので、run() の中ではスレッドで行う
+
+使い方（CLI）:
+    python batch.py seeds.csv -o result.csv
+    python batch.py seeds.txt -o result.csv --concurrency 5 --price-mode none --pages 3
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import time
+from typing import Callable
+
+from dotenv import load_dotenv
+
+from rakuten import AsyncRakutenAPI, extract_ids_from_url, decide_price_band
+from rate_limiter import current_requester
+from sheet_sync import SheetSyncQueue
+from state import INSTANCE_ID, SharedState, SharedStateError
+from log import setup_logging
+
+URL_PATTERN = re.compile(r"https?://item\.rakuten\.co\.jp/[^\s,\"'<>]+")
+CSV_HEADERS = ["JANコード", "商品名", "ショップ", "価格", "URL", "検索元URL"]
+# 実行権（リース）の有効秒数。実行中は LEASE_TTL / 3 ごとに延長する
+LEASE_TTL = 60
+
+logger = logging.getLogger(__name__)
+
+
+def read_seeds(text: str) -> list[str]:
+    """テキスト・CSVから楽天商品URLを取り出す（出現順・重複なし）"""
+    seeds = []
+    seen = set()
+    for url in URL_PATTERN.findall(text):
+        if url not in seen and extract_ids_from_url(url):
+            seen.add(url)
+            seeds.append(url)
+    return seeds
+
+
+class BatchJob:
+    def __init__(self, seeds: list[str], state_path: str, output_path: str,
+                 api: AsyncRakutenAPI, concurrency: int = 3, price_mode: str = "auto",
+                 price_min: int | None = None, price_max: int | None = None,
+                 pages: int = 1, job_id: str = "cli", shared: SharedState | None = None,
+                 sheet_sync: SheetSyncQueue | None = None):
+        self.seeds = seeds
+        self.state_path = state_path
+        self.output_path = output_path
+        self.api = api
+        self.concurrency = concurrency
+        self.price_mode = price_mode
+        self.price_min = price_min
+        self.price_max = price_max
+        self.pages = pages
+        self.job_id = job_id
+        self.shared = shared
+        self.sheet_sync = sheet_sync
+
+        self.done: set[str] = set()
+        # 最後の実行がエラーで終わった（再実行対象の）商品
+        self.failed: set[str] = set()
+        self.running = False
+        self.finished = False
+        self.started_at: float | None = None
+        self.task: asyncio.Task | None = None
+        self._load_state()
+
+    def _load_state(self):
+        """状態ファイルから完了済みの商品を読み込む（エラーだったものは再実行対象）"""
+        if not os.path.exists(self.state_path):
+            return
+        line = ""
+        with open(self.state_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で落ちた最終行
+                    continue
+                if record.get("status") == "done":
+                    self.done.add(record["seed"])
+                    self.failed.discard(record["seed"])
+                elif record.get("status") == "error":
+                    self.failed.add(record["seed"])
+        if line and not line.endswith("\n"):
+            # 途中で切れた行に次の記録がつながらないよう改行しておく
+            with open(self.state_path, "a", encoding="utf-8") as f:
+                f.write("\n")
+        self.failed -= self.done
+        if self.done or self.failed:
+            logger.info(f"[バッチ] 再開: {len(self.done)}件は完了済み、{len(self.failed)}件はエラー（再実行します）")
+        self.finished = self.done >= set(self.seeds)
+
+    def _append_state(self, record: dict):
+        with open(self.state_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _lease_key(self) -> str:
+        return f"batch:{self.job_id}:lease"
+
+    def running_elsewhere(self) -> bool:
+        """他のワーカー・インスタンスが実行中か"""
+        if self.shared is None or self.running:
+            return False
+        try:
+            owner = self.shared.get(self._lease_key())
+        except SharedStateError:
+            return False
+        return owner is not None and owner != INSTANCE_ID
+
+    def _publish(self, progress: dict):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set_json(f"batch:{self.job_id}:progress", progress, ttl=7 * 24 * 3600)
+        except SharedStateError as e:
+            logger.debug(f"[バッチ] 進捗を共有できませんでした: {e}")
+
+    async def _publish_async(self, progress: dict | None = None):
+        if self.shared is not None:
+            await asyncio.to_thread(self._publish, progress or self.progress())
+
+    def progress(self) -> dict:
+        """進捗（他のワーカーが実行中なら共有先の進捗。shared があればスレッドで呼ぶ）"""
+        if self.running_elsewhere():
+            try:
+                remote = self.shared.get_json(f"batch:{self.job_id}:progress")
+            except SharedStateError:
+                remote = None
+            if remote:
+                return remote
+        return {
+            "job_id": self.job_id,
+            "total": len(self.seeds),
+            "done": len(self.done),
+            "errors": len(self.failed),
+            "running": self.running,
+            "finished": self.finished,
+            "elapsed_seconds": time.time() - self.started_at if self.started_at else 0.0,
+        }
+
+    async def _process(self, seed: str):
+        """1商品分の検索を実行して状態ファイルに記録"""
+        shop_code, item_id = extract_ids_from_url(seed)
+        product = await self.api.get_item(shop_code, item_id)
+        if not product:
+            self.failed.add(seed)
+            self._append_state({"seed": seed, "status": "error", "message": "商品が見つかりません"})
+            return
+
+        price_min, price_max, _ = decide_price_band(
+            product["price"], self.price_mode, self.price_min, self.price_max)
+        competitors = await self.api.search_competitors(
+            category_id=product["categoryId"],
+            price_min=price_min,
+            price_max=price_max,
+            exclude_shop=product["shopId"],
+            pages=self.pages,
+            jan=product["jan"],
+            # APIエラーで欠けた結果を完了として記録しない（エラーとして記録し、再開時に再実行する）
+            strict=True
+        )
+        self._append_state({"seed": seed, "status": "done", "product": product,
+                            "competitors": [c.to_dict() for c in competitors]})
+        self.done.add(seed)
+        self.failed.discard(seed)
+        if self.sheet_sync is not None:
+            await asyncio.to_thread(self.sheet_sync.push, competitors)
+
+    async def _keep_lease(self):
+        while True:
+            await asyncio.sleep(LEASE_TTL / 3)
+            try:
+                if not await asyncio.to_thread(self.shared.acquire_lease, self._lease_key(), LEASE_TTL):
+                    logger.warning(f"[バッチ] 実行権を失いました: {self.job_id}")
+            except SharedStateError as e:
+                logger.warning(f"[バッチ] 実行権を延長できませんでした: {e}")
+
+    async def run(self, on_progress: Callable[[dict], None] | None = None):
+        """未完了の商品をすべて処理し、結果ファイルを書き出す"""
+        keeper = None
+        if self.shared is not None:
+            if not await asyncio.to_thread(self.shared.acquire_lease, self._lease_key(), LEASE_TTL):
+                logger.info(f"[バッチ] 他のワーカーが実行中のため開始しません: {self.job_id}")
+                return
+            # 他のワーカーが進めた分を状態ファイルから読み直す
+            self._load_state()
+            keeper = asyncio.create_task(self._keep_lease())
+        # バッチのAPI呼び出しは画面からの検索と別枠で順番待ちさせる
+        current_requester.set(f"batch:{self.job_id}")
+        self.running = True
+        self.started_at = time.time()
+        await self._publish_async()
+
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for seed in self.seeds:
+            if seed not in self.done:
+                queue.put_nowait(seed)
+
+        async def worker():
+            while True:
+                try:
+                    seed = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await self._process(seed)
+                except Exception as e:
+                    self.failed.add(seed)
+                    self._append_state({"seed": seed, "status": "error", "message": str(e)})
+                    logger.warning(f"[バッチ] エラー {seed}: {e}")
+                progress = self.progress()
+                logger.info(f"[バッチ] {progress['done']}/{progress['total']} 完了（エラー {progress['errors']}）")
+                await self._publish_async(progress)
+                if on_progress:
+                    on_progress(progress)
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(max(1, self.concurrency))))
+            await asyncio.to_thread(self.write_output)
+            self.finished = True
+        finally:
+            self.running = False
+            if keeper is not None:
+                keeper.cancel()
+                await self._publish_async()
+                try:
+                    await asyncio.to_thread(self.shared.release_lease, self._lease_key())
+                except SharedStateError as e:
+                    logger.warning(f"[バッチ] 実行権を返せませんでした: {e}")
+
+    def iter_rows(self):
+        """状態ファイルから結果行を重複除外しながら読み出す（商品URL単位）"""
+        if not os.path.exists(self.state_path):
+            return
+        seen = set()
+        with open(self.state_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("status") != "done":
+                    continue
+                for c in record["competitors"]:
+                    if c["url"] in seen:
+                        continue
+                    seen.add(c["url"])
+                    yield [c["jan"], c["name"], c["shop"], c["price"], c["url"], record["seed"]]
+
+    def write_output(self) -> int:
+        """結果CSVを書き出し、行数を返す"""
+        count = 0
+        # BOM付きUTF-8でExcelでも文字化けしない
+        with open(self.output_path, "w", encoding="utf-8-sig", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(CSV_HEADERS)
+            for row in self.iter_rows():
+                writer.writerow(row)
+                count += 1
+        logger.info(f"[バッチ] 結果を書き出しました: {self.output_path}（{count}件）")
+        return count
+
+
+async def _main(args):
+    with open(args.seeds, encoding="utf-8-sig", errors="replace") as f:
+        seeds = read_seeds(f.read())
+    if not seeds:
+        logger.error("楽天の商品URLが見つかりませんでした")
+        return
+
+    state_path = args.state or f"{args.output}.state.jsonl"
+    sheet_sync = SheetSyncQueue()
+    async with AsyncRakutenAPI() as api:
+        job = BatchJob(
+            seeds=seeds,
+            state_path=state_path,
+            output_path=args.output,
+            api=api,
+            concurrency=args.concurrency,
+            price_mode=args.price_mode,
+            price_min=args.price_min,
+            price_max=args.price_max,
+            pages=args.pages,
+            sheet_sync=sheet_sync,
+        )
+        logger.info(f"[バッチ] {len(seeds)}件の商品を処理します（状態ファイル: {state_path}）")
+        await job.run()
+    # CLIは常駐しないので最後にまとめて送る（送れなかった行はキューに残り、次回・サーバー側で送る）
+    if sheet_sync.enabled:
+        await sheet_sync.flush()
+
+
+def main():
+    load_dotenv()
+    setup_logging()
+    parser = argparse.ArgumentParser(description="楽天商品URLの一括競合検索")
+    parser.add_argument("seeds", help="商品URLを含むテキスト/CSVファイル")
+    parser.add_argument("-o", "--output", default="batch_result.csv", help="結果CSVのパス")
+    parser.add_argument("--state", help="状態ファイルのパス（デフォルト: <output>.state.jsonl）")
+    parser.add_argument("--concurrency", type=int, default=3, help="同時に処理する商品数")
+    parser.add_argument("--price-mode", choices=["auto", "custom", "none"], default="auto")
+    parser.add_argument("--price-min", type=int)
+    parser.add_argument("--price-max", type=int)
+    parser.add_argument("--pages", type=int, default=1, help="競合検索のページ数（1ページ30件）")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+JANコード抽出のベンチマーク
+
+保存済みの商品ページHTMLに対して、従来方式（BeautifulSoupで全文解析）と
+高速方式（JanScannerでラベル付きJANを探し、見つかれば打ち切り）を比較する。
+
+使い方:
+    python bench/bench_jan_extract.py
+    python bench/bench_jan_extract.py --fixtures path/to/pages --repeat 50
+
+フィクスチャディレクトリには *.html と、期待値の expected.json
+（{"ファイル名": "JANコード or 空文字"}）を置く。
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from jan_extract import JanScanner, find_jan_in_html  # noqa: E402
+
+DEFAULT_FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "pages")
+
+
+def detect_charset(data: bytes) -> str:
+    match = re.search(rb'charset="?([A-Za-z0-9_\-]+)', data[:2048])
+    return match.group(1).decode() if match else "utf-8"
+
+
+def extract_soup(data: bytes, charset: str) -> tuple[str, int]:
+    return find_jan_in_html(data.decode(charset, errors="replace")), len(data)
+
+
+def make_extract_fast(chunk_size: int):
+    def extract_fast(data: bytes, charset: str) -> tuple[str, int]:
+        scanner = JanScanner()
+        for i in range(0, len(data), chunk_size):
+            if scanner.feed(data[i:i + chunk_size]):
+                break
+        return scanner.result(charset), scanner.bytes_read
+    return extract_fast
+
+
+def run(name: str, extract, pages: list, expected: dict, repeat: int) -> dict:
+    correct = 0
+    bytes_read = 0
+    results = {}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for filename, data, charset in pages:
+            jan, read = extract(data, charset)
+            results[filename] = jan
+            bytes_read += read
+    elapsed = time.perf_counter() - start
+
+    for filename, _, _ in pages:
+        if filename in expected and results[filename] == expected[filename]:
+            correct += 1
+
+    total = len(pages) * repeat
+    return {
+        "name": name,
+        "pages_per_sec": total / elapsed,
+        "accuracy": correct / len(pages) if pages else 0.0,
+        "avg_kb_read": bytes_read / total / 1024,
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JANコード抽出ベンチマーク")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES, help="HTMLフィクスチャのディレクトリ")
+    parser.add_argument("--repeat", type=int, default=20, help="各ページの繰り返し回数")
+    parser.add_argument("--chunk-size", type=int, default=16 * 1024, help="受信チャンクの大きさ（バイト）")
+    args = parser.parse_args()
+
+    expected_path = os.path.join(args.fixtures, "expected.json")
+    expected = {}
+    if os.path.exists(expected_path):
+        with open(expected_path, encoding="utf-8") as f:
+            expected = json.load(f)
+
+    pages = []
+    for filename in sorted(os.listdir(args.fixtures)):
+        if filename.endswith(".html"):
+            with open(os.path.join(args.fixtures, filename), "rb") as f:
+                data = f.read()
+            pages.append((filename, data, detect_charset(data)))
+
+    if not pages:
+        print(f"フィクスチャがありません: {args.fixtures}")
+        return
+
+    print(f"フィクスチャ: {len(pages)}ページ × {args.repeat}回\n")
+    soup = run("BeautifulSoup（従来）", extract_soup, pages, expected, args.repeat)
+    fast = run("JanScanner（高速）", make_extract_fast(args.chunk_size), pages, expected, args.repeat)
+
+    for r in (soup, fast):
+        print(f"{r['name']:<24} {r['pages_per_sec']:>9.1f} pages/sec  "
+              f"正解率 {r['accuracy']:.0%}  平均読込 {r['avg_kb_read']:.1f}KB")
+    print(f"\n速度比: {fast['pages_per_sec'] / soup['pages_per_sec']:.1f}倍")
+
+    diffs = [f for f, _, _ in pages if soup["results"][f] != fast["results"][f]]
+    print(f"従来方式との一致: {len(pages) - len(diffs)}/{len(pages)}")
+    for filename in diffs:
+        print(f"  不一致 {filename}: 従来={soup['results'][filename] or '-'} "
+              f"高速={fast['results'][filename] or '-'} 期待={expected.get(filename, '?') or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+競合レコードとJANチェックディジット検証のマイクロベンチマーク
+
+- JAN検証: ページ本文・説明文の13桁の数字列を、従来方式（1桁ずつ int() して合計）と
+  valid_jans（候補をまとめてバイト列にし、スライスの合計で検証）で比較する
+- レコード: API検索結果から競合一覧を作るときの、辞書のコピーと Competitor（__slots__）の
+  生成時間とメモリ使用量を比較する
+
+使い方:
+    python bench/bench_records.py
+    python bench/bench_records.py --records 20000 --candidates 200 --repeat 50
+"""
+
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from competitor import Competitor  # noqa: E402
+from fake_rakuten import load_fixtures  # noqa: E402
+from jan_extract import valid_jans  # noqa: E402
+from rakuten import _RakutenBase  # noqa: E402
+
+
+def legacy_is_valid_jan(code: str) -> bool:
+    """変更前の is_valid_jan（比較用）"""
+    if not code or len(code) != 13 or not code.isdigit():
+        return False
+    if code.startswith('10'):
+        return False
+    odd_sum = sum(int(code[i]) for i in range(0, 12, 2))
+    even_sum = sum(int(code[i]) for i in range(1, 12, 2))
+    total = odd_sum + even_sum * 3
+    check_digit = (10 - (total % 10)) % 10
+    return int(code[12]) == check_digit
+
+
+def legacy_valid_jans(text: str) -> list[str]:
+    return [code for code in re.findall(r'[0-9]{13}', text) if legacy_is_valid_jan(code)]
+
+
+def make_texts(pages: list, captions: list[str], candidates: int, rng: random.Random) -> list[str]:
+    """フィクスチャの本文・説明文に、型番・在庫コードなど13桁の数字列の多い仕様表を足したもの"""
+    texts = []
+    for data, content_type in pages:
+        charset = content_type.split("charset=")[-1]
+        texts.append(BeautifulSoup(data.decode(charset, errors="replace"), "html.parser").get_text())
+    texts.extend(captions)
+    spec = " ".join(
+        f"品番{i}: {rng.randrange(10 ** 12, 10 ** 13)}" for i in range(candidates)
+    )
+    return [text + spec for text in texts]
+
+
+def bench_jan(texts: list[str], repeat: int) -> list[tuple[str, float]]:
+    for text in texts:
+        assert valid_jans(text) == legacy_valid_jans(text)
+    results = []
+    for name, func in (("1桁ずつ int()（従来）", legacy_valid_jans), ("valid_jans（一括）", valid_jans)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for text in texts:
+                func(text)
+        results.append((name, len(texts) * repeat / (time.perf_counter() - start)))
+    return results
+
+
+def build_dicts(records: list[dict]) -> list:
+    # 変更前の _build_competitors と同じコピー
+    return [{key: value for key, value in record.items() if key != "shopCode"} for record in records]
+
+
+def build_competitors(records: list[dict]) -> list:
+    return [Competitor.from_record(record) for record in records]
+
+
+def bench_records(records: list[dict]) -> list[tuple[str, float, float]]:
+    results = []
+    for name, func in (("辞書のコピー（従来）", build_dicts), ("Competitor（__slots__）", build_competitors)):
+        start = time.perf_counter()
+        func(records)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        built = func(records)
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del built
+        results.append((name, elapsed, size))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="競合レコード・JAN検証のマイクロベンチマーク")
+    parser.add_argument("--records", type=int, default=10000, help="作る競合レコードの件数")
+    parser.add_argument("--candidates", type=int, default=100, help="1ページに足す13桁の数字列の数")
+    parser.add_argument("--repeat", type=int, default=20, help="JAN検証の繰り返し回数")
+    args = parser.parse_args()
+    rng = random.Random(0)
+
+    items, pages = load_fixtures()
+    base = _RakutenBase.__new__(_RakutenBase)
+    templates = [base._listing_record(item) for item in items]
+    records = [dict(templates[i % len(templates)], url=f"https://item.rakuten.co.jp/shop/{i}/")
+               for i in range(args.records)]
+
+    texts = make_texts(pages, [item.get("itemCaption", "") for item in items], args.candidates, rng)
+    print(f"JAN検証: {len(texts)}件の本文 × {args.repeat}回（1件あたり約{args.candidates}個の候補）")
+    jan_results = bench_jan(texts, args.repeat)
+    for name, per_sec in jan_results:
+        print(f"  {name:<24} {per_sec:>10.1f} texts/sec")
+    print(f"  速度比: {jan_results[1][1] / jan_results[0][1]:.1f}倍\n")
+
+    print(f"競合レコード: {args.records}件")
+    record_results = bench_records(records)
+    for name, elapsed, size in record_results:
+        print(f"  {name:<24} {elapsed * 1000:>8.1f}ms  {size / args.records:>6.0f} bytes/件")
+    (_, old_time, old_size), (_, new_time, new_size) = record_results
+    print(f"  速度比: {old_time / new_time:.1f}倍  メモリ: {new_size / old_size:.0%}")
+
+
+if __name__ == "__main__":
+    main()
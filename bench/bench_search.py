@@ -0,0 +1,266 @@
+"""
+競合検索のベンチマーク（オフライン）
+
+偽サーバー（fake_rakuten.py）を同じプロセス内で起動し、
+商品取得 → 競合検索 → スクレイピング の一連の処理を
+単発・同時実行・バッチの3パターンで計測する。
+recrawl は同じ商品群を2回バッチ処理し（2回目はJANキャッシュ切れを想定して空にする）、
+2回目の所要時間と、条件付きリクエスト（304）で受信せずに済んだバイト数を見る。
+
+使い方:
+    python bench/bench_search.py
+    python bench/bench_search.py --searches 40 --concurrency 8 --page-latency-ms 200
+    python bench/bench_search.py --save bench/baseline.json
+    python bench/bench_search.py --baseline bench/baseline.json   # 劣化していれば終了コード1
+
+レートリミッターは --api-rate で指定した値に差し替える（本番の1秒1回では待ち時間が支配的になるため）。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import uvicorn  # noqa: E402
+
+from fake_rakuten import FakeConfig, add_config_arguments, config_from_args, create_app  # noqa: E402
+
+SCENARIOS = ("single", "concurrent", "batch", "recrawl")
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(config: FakeConfig) -> tuple[uvicorn.Server, str]:
+    """偽サーバーを別スレッドで起動し、(サーバー, ベースURL) を返す"""
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host="127.0.0.1", port=port,
+                                           log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name: str, latencies: list[float], elapsed: float, searches: int) -> dict:
+    return {
+        "scenario": name,
+        "searches": searches,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else 0.0,
+        "searches_per_sec": searches / elapsed if elapsed else 0.0,
+    }
+
+
+def make_api(args, page_store=None):
+    """キャッシュを空にした状態のクライアントを作る（page_store を渡せば保存済みのページは使い回す）"""
+    from cache import JanCache
+    from page_store import PageStore
+    from product_index import ProductIndex
+    from rakuten import AsyncRakutenAPI
+    from rate_limiter import RateLimiter
+
+    suffix = time.monotonic_ns()
+    jan_cache = JanCache(path=os.path.join(args.workdir, f"jan_cache_{suffix}.sqlite3"))
+    product_index = ProductIndex(path=os.path.join(args.workdir, f"product_index_{suffix}.sqlite3"))
+    if page_store is None:
+        page_store = PageStore(path=os.path.join(args.workdir, f"page_store_{suffix}.sqlite3"))
+    limiter = RateLimiter(rate=args.api_rate, burst=max(1, int(args.api_rate)))
+    return AsyncRakutenAPI(jan_cache=jan_cache, rate_limiter=limiter, product_index=product_index,
+                           page_store=page_store)
+
+
+async def run_search(api, seed: str, pages: int) -> dict:
+    """画面からの検索1回分（SSEでの配信完了まで）"""
+    from rakuten import decide_price_band, extract_ids_from_url
+
+    shop_code, item_id = extract_ids_from_url(seed)
+    product = await api.get_item(shop_code, item_id)
+    if not product:
+        raise RuntimeError(f"商品が見つかりません: {seed}")
+    price_min, price_max, _ = decide_price_band(product["price"])
+    competitors, items_to_scrape = await api.find_competitors(
+        product["categoryId"], price_min, price_max, product["shopId"], pages=pages,
+        jan=product["jan"])
+    async for _ in api.iter_scraped_jans(items_to_scrape):
+        pass
+    return {"competitors": len(competitors), "jan": sum(1 for c in competitors if c["jan"])}
+
+
+def seeds_for(scenario: str, count: int) -> list[str]:
+    # シナリオごとに別の商品にして、前のシナリオのキャッシュが効かないようにする
+    return [f"https://item.rakuten.co.jp/bench-shop/{scenario}-{i}/" for i in range(count)]
+
+
+async def bench_single(args) -> dict:
+    async with make_api(args) as api:
+        latencies = []
+        start = time.perf_counter()
+        for seed in seeds_for("single", args.searches):
+            t0 = time.perf_counter()
+            await run_search(api, seed, args.pages)
+            latencies.append(time.perf_counter() - t0)
+        return summarize("single", latencies, time.perf_counter() - start, args.searches)
+
+
+async def bench_concurrent(args) -> dict:
+    async with make_api(args) as api:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one(seed: str):
+            async with semaphore:
+                t0 = time.perf_counter()
+                await run_search(api, seed, args.pages)
+                latencies.append(time.perf_counter() - t0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(seed) for seed in seeds_for("concurrent", args.searches)))
+        return summarize("concurrent", latencies, time.perf_counter() - start, args.searches)
+
+
+async def bench_batch(args, scenario: str = "batch", page_store=None) -> dict:
+    from batch import BatchJob
+
+    async with make_api(args, page_store) as api:
+        seeds = seeds_for(scenario, args.searches)
+        job = BatchJob(
+            seeds=seeds,
+            state_path=os.path.join(args.workdir, f"batch_state_{time.monotonic_ns()}.jsonl"),
+            output_path=os.path.join(args.workdir, "batch_result.csv"),
+            api=api,
+            concurrency=args.concurrency,
+            pages=args.pages,
+            job_id="bench",
+        )
+        # 1商品ごとの処理時間を測るため _process を包む
+        latencies = []
+        process = job._process
+
+        async def timed_process(seed: str):
+            t0 = time.perf_counter()
+            await process(seed)
+            latencies.append(time.perf_counter() - t0)
+
+        job._process = timed_process
+        start = time.perf_counter()
+        await job.run()
+        return summarize(scenario, latencies, time.perf_counter() - start, len(seeds))
+
+
+async def bench_recrawl(args) -> dict:
+    from page_store import PageStore
+
+    page_store = PageStore(path=os.path.join(args.workdir, f"page_store_recrawl_{time.monotonic_ns()}.sqlite3"))
+    await bench_batch(args, "recrawl", page_store)
+    first = page_store.stats()
+    result = await bench_batch(args, "recrawl", page_store)
+    second = page_store.stats()
+    result["page_bytes_downloaded"] = second["bytes_downloaded"] - first["bytes_downloaded"]
+    result["page_bytes_saved"] = second["bytes_saved"] - first["bytes_saved"]
+    return result
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """ベースラインより searches/sec が tolerance 以上落ちた、または p99 が伸びたシナリオを返す"""
+    regressions = []
+    for r in results:
+        base = baseline.get(r["scenario"])
+        if not base:
+            continue
+        if r["searches_per_sec"] < base["searches_per_sec"] * (1 - tolerance):
+            regressions.append(f"{r['scenario']}: searches/sec {base['searches_per_sec']:.2f} → "
+                               f"{r['searches_per_sec']:.2f}")
+        if r["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{r['scenario']}: p99 {base['p99_ms']:.0f}ms → {r['p99_ms']:.0f}ms")
+    return regressions
+
+
+async def _main(args) -> int:
+    runners = {"single": bench_single, "concurrent": bench_concurrent, "batch": bench_batch,
+               "recrawl": bench_recrawl}
+    results = []
+    for scenario in args.scenarios:
+        results.append(await runners[scenario](args))
+
+    print(f"{'シナリオ':<12} {'件数':>5} {'p50':>9} {'p99':>9} {'平均':>9} {'searches/sec':>13}")
+    for r in results:
+        print(f"{r['scenario']:<12} {r['searches']:>6} {r['p50_ms']:>7.0f}ms {r['p99_ms']:>7.0f}ms "
+              f"{r['mean_ms']:>7.0f}ms {r['searches_per_sec']:>13.2f}")
+    for r in results:
+        if "page_bytes_saved" in r:
+            print(f"\n{r['scenario']}（2回目）: 商品ページ受信 {r['page_bytes_downloaded']:,} bytes、"
+                  f"304で省いた分 {r['page_bytes_saved']:,} bytes")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({r["scenario"]: r for r in results}, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\n性能が劣化しています:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nベースラインとの比較: OK")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="競合検索のオフラインベンチマーク")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--searches", type=int, default=20, help="シナリオごとの検索回数")
+    parser.add_argument("--concurrency", type=int, default=5, help="同時実行・バッチの同時処理数")
+    parser.add_argument("--pages", type=int, default=1, help="競合検索のページ数（1ページ30件）")
+    parser.add_argument("--api-rate", type=float, default=50.0, help="APIレートリミッターの秒間回数")
+    parser.add_argument("--save", help="結果をJSONで保存するパス")
+    parser.add_argument("--baseline", help="比較するベースラインJSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="劣化とみなす割合")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    # 進捗ログは抑えて結果の表だけ出す
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from log import setup_logging
+    setup_logging()
+
+    server, base_url = start_fake_server(config_from_args(args))
+    os.environ["RAKUTEN_API_BASE_URL"] = f"{base_url}/services/api"
+    os.environ["RAKUTEN_ITEM_BASE_URL"] = base_url
+    os.environ.setdefault("RAKUTEN_APP_ID", "bench")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        try:
+            code = asyncio.run(_main(args))
+        finally:
+            server.should_exit = True
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
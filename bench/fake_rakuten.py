@@ -0,0 +1,220 @@
+"""
+楽天API・商品ページの偽サーバー（オフラインのベンチマーク・負荷試験用）
+
+記録済みの商品検索APIレスポンス（fixtures/api/*.json）と商品ページHTML
+（fixtures/pages/*.html）をひな形にして、任意のジャンル・商品に応答する。
+応答の遅延とエラー率は起動オプションで変えられる。
+商品ページは ETag を返し、If-None-Match が一致すれば 304（本文なし）で応答する。
+
+使い方:
+    python bench/fake_rakuten.py --port 8900 --api-latency-ms 80 --page-latency-ms 150
+
+アプリ側は環境変数で接続先をこのサーバーに向ける:
+    RAKUTEN_API_BASE_URL=http://127.0.0.1:8900/services/api
+    RAKUTEN_ITEM_BASE_URL=http://127.0.0.1:8900
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import zlib
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@dataclass
+class FakeConfig:
+    api_latency_ms: float = 50.0
+    page_latency_ms: float = 100.0
+    jitter_ms: float = 20.0
+    # APIが 429/503 を返す割合
+    api_error_rate: float = 0.0
+    # 商品ページが 500 を返す割合
+    page_error_rate: float = 0.0
+    # 1ジャンル・価格帯あたりの商品数
+    listing_size: int = 150
+    seed: int = 0
+
+
+def _stable_hash(text: str) -> int:
+    return zlib.crc32(text.encode("utf-8"))
+
+
+def load_fixtures(fixtures_dir: str = FIXTURES_DIR) -> tuple[list[dict], list[tuple[bytes, str]]]:
+    """ひな形の商品（APIのItem）と商品ページ（本文, Content-Type）を読み込む"""
+    items = []
+    api_dir = os.path.join(fixtures_dir, "api")
+    for filename in sorted(os.listdir(api_dir)):
+        if filename.endswith(".json"):
+            with open(os.path.join(api_dir, filename), encoding="utf-8") as f:
+                items.extend(entry["Item"] for entry in json.load(f).get("Items", []))
+
+    pages = []
+    pages_dir = os.path.join(fixtures_dir, "pages")
+    for filename in sorted(os.listdir(pages_dir)):
+        if filename.endswith(".html"):
+            with open(os.path.join(pages_dir, filename), "rb") as f:
+                data = f.read()
+            charset = "Shift_JIS" if b"Shift_JIS" in data[:1024] else (
+                "EUC-JP" if b"EUC-JP" in data[:1024] else "utf-8")
+            pages.append((data, f"text/html; charset={charset}"))
+    return items, pages
+
+
+def create_app(config: FakeConfig | None = None, fixtures_dir: str = FIXTURES_DIR) -> FastAPI:
+    config = config or FakeConfig()
+    templates, pages = load_fixtures(fixtures_dir)
+    rng = random.Random(config.seed)
+    app = FastAPI(title="fake rakuten")
+    app.state.config = config
+    app.state.requests = {"api": 0, "page": 0, "not_modified": 0, "page_bytes": 0, "errors": 0}
+
+    async def delay(base_ms: float):
+        wait = base_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)
+        await asyncio.sleep(max(wait, 0) / 1000)
+
+    def make_item(index: int, genre_id: str, price: int, shop_code: str | None = None,
+                  item_id: str | None = None) -> dict:
+        """ひな形を元に、ジャンル内 index 番目の商品を作る"""
+        item = dict(templates[index % len(templates)])
+        shop_code = shop_code or f"{item['shopCode']}-{index % 13}"
+        item_id = item_id or f"{genre_id}-{index}"
+        item.update({
+            "itemCode": f"{shop_code}:{item_id}",
+            "itemUrl": f"https://item.rakuten.co.jp/{shop_code}/{item_id}/",
+            "shopCode": shop_code,
+            "genreId": genre_id,
+            "itemPrice": price,
+        })
+        return item
+
+    def listing(genre_id: str, price_min: int, price_max: int) -> list[dict]:
+        """ジャンル・価格帯の全商品（同じ条件なら毎回同じ結果）"""
+        span = max(price_max - price_min, 1)
+        base = _stable_hash(genre_id)
+        return [
+            make_item(i, genre_id, price_min + (base + i * 37) % (span + 1))
+            for i in range(config.listing_size)
+        ]
+
+    def page_response(items: list[dict], page: int, hits: int) -> dict:
+        start = (page - 1) * hits
+        chunk = items[start:start + hits]
+        return {
+            "count": len(items),
+            "page": page,
+            "first": start + 1 if chunk else 0,
+            "last": start + len(chunk),
+            "hits": len(chunk),
+            "carrier": 0,
+            "pageCount": (len(items) + hits - 1) // hits,
+            "Items": [{"Item": item} for item in chunk],
+            "GenreInformation": [],
+            "TagInformation": [],
+        }
+
+    @app.get("/services/api/IchibaItem/Search/20220601")
+    async def search(request: Request):
+        app.state.requests["api"] += 1
+        await delay(config.api_latency_ms)
+        if rng.random() < config.api_error_rate:
+            app.state.requests["errors"] += 1
+            status = rng.choice((429, 503))
+            return JSONResponse({"error": "too_many_requests" if status == 429 else "service_unavailable"},
+                                status_code=status)
+
+        params = request.query_params
+        page = int(params.get("page", 1))
+        hits = int(params.get("hits", 30))
+        keyword = params.get("keyword", "")
+        shop_code = params.get("shopCode")
+
+        if "genreId" in params:
+            items = listing(params["genreId"], int(params.get("minPrice", 0)),
+                            int(params.get("maxPrice", 100000)))
+            return page_response(items, page, hits)
+
+        if shop_code and keyword:
+            # 自社商品の検索: キーワード（商品ID）を含むURLの商品を1件返す
+            # ジャンルは商品ごとに変えて、競合一覧のキャッシュが効きすぎないようにする
+            genre_id = str(100000 + _stable_hash(f"{shop_code}/{keyword}") % 900000)
+            price = 1000 + _stable_hash(keyword) % 9000
+            item = make_item(_stable_hash(keyword), genre_id, price, shop_code=shop_code, item_id=keyword)
+            return page_response([item], 1, hits)
+
+        if keyword:
+            # JAN等のキーワード検索: 複数ショップの同一商品を返す
+            genre_id = str(100000 + _stable_hash(keyword) % 900000)
+            price = 1000 + _stable_hash(keyword) % 9000
+            items = [make_item(i, genre_id, price + i * 10, item_id=f"kw-{_stable_hash(keyword)}-{i}")
+                     for i in range(5)]
+            for item in items:
+                item["itemCaption"] = f"JANコード：{keyword}" if keyword.isdigit() else item["itemCaption"]
+            return page_response(items, page, hits)
+
+        return page_response([], page, hits)
+
+    @app.get("/{shop_code}/{item_id}/")
+    async def item_page(shop_code: str, item_id: str, request: Request):
+        app.state.requests["page"] += 1
+        await delay(config.page_latency_ms)
+        if rng.random() < config.page_error_rate:
+            app.state.requests["errors"] += 1
+            return Response("internal error", status_code=500)
+        index = _stable_hash(f"{shop_code}/{item_id}") % len(pages)
+        data, content_type = pages[index]
+        etag = f'"{index}-{_stable_hash(data.decode("latin-1")):x}"'
+        if request.headers.get("if-none-match") == etag:
+            app.state.requests["not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        app.state.requests["page_bytes"] += len(data)
+        return Response(data, headers={"Content-Type": content_type, "ETag": etag})
+
+    @app.get("/_stats")
+    async def stats():
+        return app.state.requests
+
+    return app
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--api-latency-ms", type=float, default=50.0, help="APIの応答遅延（ミリ秒）")
+    parser.add_argument("--page-latency-ms", type=float, default=100.0, help="商品ページの応答遅延（ミリ秒）")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="遅延のばらつき（±ミリ秒）")
+    parser.add_argument("--api-error-rate", type=float, default=0.0, help="APIが429/503を返す割合")
+    parser.add_argument("--page-error-rate", type=float, default=0.0, help="商品ページが500を返す割合")
+    parser.add_argument("--listing-size", type=int, default=150, help="1ジャンル・価格帯あたりの商品数")
+
+
+def config_from_args(args) -> FakeConfig:
+    return FakeConfig(
+        api_latency_ms=args.api_latency_ms,
+        page_latency_ms=args.page_latency_ms,
+        jitter_ms=args.jitter_ms,
+        api_error_rate=args.api_error_rate,
+        page_error_rate=args.page_error_rate,
+        listing_size=args.listing_size,
+    )
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="楽天API・商品ページの偽サーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--fixtures", default=FIXTURES_DIR, help="api/ と pages/ を含むディレクトリ")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args), args.fixtures), host=args.host, port=args.port,
+                log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""
+Redisの代わりになる小さなサーバー（確認用）
+
+SHARED_STATE=redis://... の動作を、Redisをインストールせずに手元で確かめるためのもの。
+state.RedisState が使うコマンドだけを実装している（1プロセス・メモリ上のみ）。
+
+    PING / AUTH / SELECT / GET / MGET / SET（NX・EX・PX）/ DEL / INCR /
+    RPUSH / LRANGE / PEXPIRE / DBSIZE / FLUSHALL
+
+使い方:
+    python bench/fake_redis.py --port 6390
+    SHARED_STATE=redis://127.0.0.1:6390/0 uvicorn main:app --workers 2
+"""
+
+import argparse
+import asyncio
+import time
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data: dict[bytes, bytes | list[bytes]] = {}
+        self.expires: dict[bytes, float] = {}
+        self.commands = 0
+
+    def _alive(self, key: bytes) -> bool:
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _expire_in(self, key: bytes, ms: int):
+        self.expires[key] = time.monotonic() + ms / 1000
+
+    def execute(self, args: list[bytes]):
+        """1コマンドを実行して応答（str は +OK などの単純文字列、Exception はエラー）"""
+        self.commands += 1
+        name = args[0].upper().decode()
+        rest = args[1:]
+        if name in ("PING",):
+            return "PONG"
+        if name in ("AUTH", "SELECT"):
+            return "OK"
+        if name == "GET":
+            return self.data.get(rest[0]) if self._alive(rest[0]) else None
+        if name == "MGET":
+            return [self.data.get(key) if self._alive(key) else None for key in rest]
+        if name == "SET":
+            key, value, options = rest[0], rest[1], [o.upper() for o in rest[2:]]
+            if b"NX" in options and self._alive(key):
+                return None
+            self.data[key] = value
+            self.expires.pop(key, None)
+            for unit, scale in ((b"PX", 1), (b"EX", 1000)):
+                if unit in options:
+                    self._expire_in(key, int(rest[2 + options.index(unit) + 1]) * scale)
+            return "OK"
+        if name == "DEL":
+            count = 0
+            for key in rest:
+                if self._alive(key):
+                    del self.data[key]
+                    self.expires.pop(key, None)
+                    count += 1
+            return count
+        if name == "INCR":
+            key = rest[0]
+            value = int(self.data[key]) + 1 if self._alive(key) else 1
+            self.data[key] = str(value).encode()
+            return value
+        if name == "RPUSH":
+            key = rest[0]
+            items = self.data[key] if self._alive(key) else []
+            if not isinstance(items, list):
+                return ValueError("WRONGTYPE Operation against a key holding the wrong kind of value")
+            items.extend(rest[1:])
+            self.data[key] = items
+            return len(items)
+        if name == "LRANGE":
+            key, start, stop = rest[0], int(rest[1]), int(rest[2])
+            items = self.data[key] if self._alive(key) else []
+            stop = len(items) if stop == -1 else stop + 1
+            return items[start:stop]
+        if name == "PEXPIRE":
+            if not self._alive(rest[0]):
+                return 0
+            self._expire_in(rest[0], int(rest[1]))
+            return 1
+        if name == "DBSIZE":
+            return sum(1 for key in list(self.data) if self._alive(key))
+        if name == "FLUSHALL":
+            self.data.clear()
+            self.expires.clear()
+            return "OK"
+        return ValueError(f"ERR unknown command '{name}'")
+
+
+def encode(reply) -> bytes:
+    if isinstance(reply, Exception):
+        return f"-{reply}\r\n".encode()
+    if isinstance(reply, str):
+        return f"+{reply}\r\n".encode()
+    if isinstance(reply, int):
+        return f":{reply}\r\n".encode()
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(encode(item) for item in reply)
+    return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+
+async def read_command(reader: asyncio.StreamReader) -> list[bytes] | None:
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # インラインコマンド（redis-cli の PING など）
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:])):
+        length = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(length + 2))[:-2])
+    return args
+
+
+async def serve(host: str, port: int, store: FakeRedis | None = None) -> asyncio.AbstractServer:
+    store = store or FakeRedis()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                args = await read_command(reader)
+                if args is None:
+                    break
+                if args:
+                    writer.write(encode(store.execute(args)))
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="確認用のRedis互換サーバー（メモリ上のみ）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    async def run():
+        server = await serve(args.host, args.port)
+        print(f"fake redis: redis://{args.host}:{args.port}/0")
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
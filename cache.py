@@ -0,0 +1,500 @@
+"""
+キャッシュモジュール
+
+JanCache: 商品URL → JANコードの解決結果をSQLiteに保存する
+- 見つかったJAN（正キャッシュ）は長めのTTL
+- 見つからなかった結果（負キャッシュ）は短めのTTL
+- 件数が上限を超えたら最終参照日時の古い順に削除（LRU）
+
+TTLCache: プロセス内のTTL付きLRUキャッシュ（自社商品の取得結果など）
+
+ListingCache: ジャンル・価格帯ごとの競合検索結果（API検索分）
+- 同じ価格帯ならそのまま再利用
+- より広い価格帯の結果が「全件取得済み」なら、絞り込むだけでAPIを呼ばない
+
+いずれも shared（state.py の共有状態）を渡すと、プロセス内で見つからなかったときに
+共有先を引き、書き込みは共有先にも反映する（複数ワーカー・インスタンスで結果を使い回す）。
+イベントループからは *_async を使う（共有先とのやりとりだけスレッドで行う）。
+
+環境変数:
+- JAN_CACHE_PATH: SQLiteファイルのパス（デフォルト: data/jan_cache.sqlite3）
+- JAN_CACHE_TTL: 正キャッシュの有効秒数（デフォルト: 7日）
+- JAN_CACHE_NEGATIVE_TTL: 負キャッシュの有効秒数（デフォルト: 1日）
+- JAN_CACHE_MAX_ENTRIES: 最大件数（デフォルト: 50000）
+- JAN_CACHE_TOUCH_INTERVAL: 最終参照日時を更新する間隔（秒、デフォルト: 3600）
+  参照のたびには書き込まず、前回の更新からこれだけ経った行だけ更新する
+- ITEM_CACHE_TTL: 自社商品（get_item）キャッシュの有効秒数（デフォルト: 600）
+- LISTING_CACHE_TTL: 競合検索結果キャッシュの有効秒数（デフォルト: 900）
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from state import SharedState, SharedStateError
+
+logger = logging.getLogger(__name__)
+
+
+class JanCache:
+    def __init__(self, path: str | None = None, ttl: int | None = None,
+                 negative_ttl: int | None = None, max_entries: int | None = None,
+                 touch_interval: float | None = None, shared: SharedState | None = None):
+        self.path = path or os.environ.get("JAN_CACHE_PATH", "data/jan_cache.sqlite3")
+        self.ttl = ttl if ttl is not None else int(os.environ.get("JAN_CACHE_TTL", 7 * 24 * 3600))
+        self.negative_ttl = negative_ttl if negative_ttl is not None else int(
+            os.environ.get("JAN_CACHE_NEGATIVE_TTL", 24 * 3600))
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.environ.get("JAN_CACHE_MAX_ENTRIES", 50000))
+        self.touch_interval = touch_interval if touch_interval is not None else float(
+            os.environ.get("JAN_CACHE_TOUCH_INTERVAL", 3600))
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jan_cache (
+                url TEXT PRIMARY KEY,
+                jan TEXT NOT NULL,
+                jan_source TEXT NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jan_cache_accessed ON jan_cache(accessed_at)")
+        self._conn.commit()
+
+    def _is_fresh(self, jan: str, fetched_at: float, now: float) -> bool:
+        ttl = self.ttl if jan else self.negative_ttl
+        return now - fetched_at < ttl
+
+    def get_many(self, urls: list[str]) -> dict[str, tuple[str, str]]:
+        """有効なキャッシュを {url: (jan, jan_source)} で返す（負キャッシュは jan が空）"""
+        if not urls:
+            return {}
+        now = time.time()
+        found = self._get_local(urls, now)
+        missing = [url for url in dict.fromkeys(urls) if url not in found]
+        if self.shared is not None and missing:
+            found.update(self._get_shared(missing, now))
+        self._count(urls, found)
+        return found
+
+    async def get_many_async(self, urls: list[str]) -> dict[str, tuple[str, str]]:
+        """get_many の非同期版（共有先を引くときはスレッドで行う）"""
+        if not urls:
+            return {}
+        now = time.time()
+        found = self._get_local(urls, now)
+        missing = [url for url in dict.fromkeys(urls) if url not in found]
+        if self.shared is not None and missing:
+            found.update(await asyncio.to_thread(self._get_shared, missing, now))
+        self._count(urls, found)
+        return found
+
+    def _count(self, urls: list[str], found: dict):
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(set(urls)) - len(found)
+
+    def _get_local(self, urls: list[str], now: float) -> dict[str, tuple[str, str]]:
+        found = {}
+        touched = []
+        with self._lock:
+            # SQLiteの変数上限を避けるため分割して問い合わせ
+            for i in range(0, len(urls), 500):
+                chunk = urls[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    "SELECT url, jan, jan_source, fetched_at, accessed_at FROM jan_cache "
+                    f"WHERE url IN ({placeholders})",
+                    chunk
+                ).fetchall()
+                for url, jan, jan_source, fetched_at, accessed_at in rows:
+                    if self._is_fresh(jan, fetched_at, now):
+                        found[url] = (jan, jan_source)
+                        # LRUの順序は粗くてよいので、最近更新した行には書き込まない
+                        if now - accessed_at >= self.touch_interval:
+                            touched.append((now, url))
+            if touched:
+                self._conn.executemany("UPDATE jan_cache SET accessed_at = ? WHERE url = ?", touched)
+                self._conn.commit()
+        return found
+
+    def _get_shared(self, urls: list[str], now: float) -> dict[str, tuple[str, str]]:
+        """共有先のキャッシュを引き、見つかったものはローカルにも保存する"""
+        try:
+            values = self.shared.get_many([f"jan:{url}" for url in urls])
+        except SharedStateError as e:
+            logger.debug(f"[キャッシュ] 共有状態エラー: {e}")
+            return {}
+        found = {}
+        rows = []
+        for url, value in zip(urls, values):
+            if value is None:
+                continue
+            jan, jan_source, fetched_at = json.loads(value)
+            if self._is_fresh(jan, fetched_at, now):
+                found[url] = (jan, jan_source)
+                rows.append((url, jan, jan_source, fetched_at, now))
+        if rows:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO jan_cache (url, jan, jan_source, fetched_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.commit()
+                self.shared_hits += len(rows)
+        return found
+
+    def get(self, url: str) -> tuple[str, str] | None:
+        """有効なキャッシュがあれば (jan, jan_source) を返す"""
+        return self.get_many([url]).get(url)
+
+    async def get_async(self, url: str) -> tuple[str, str] | None:
+        return (await self.get_many_async([url])).get(url)
+
+    def set(self, url: str, jan: str, jan_source: str = ""):
+        """解決結果を保存（jan が空なら負キャッシュ）"""
+        now = self._set_local(url, jan, jan_source)
+        if self.shared is not None:
+            self._set_shared(url, jan, jan_source, now)
+
+    async def set_async(self, url: str, jan: str, jan_source: str = ""):
+        """set の非同期版（共有先への書き込みはスレッドで行う）"""
+        now = self._set_local(url, jan, jan_source)
+        if self.shared is not None:
+            await asyncio.to_thread(self._set_shared, url, jan, jan_source, now)
+
+    def _set_local(self, url: str, jan: str, jan_source: str) -> float:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jan_cache (url, jan, jan_source, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (url, jan, jan_source, now, now)
+            )
+            self._conn.commit()
+            # 件数の確認は書き込み100回ごと
+            self._writes += 1
+            if self._writes % 100 == 1:
+                self._evict()
+        return now
+
+    def _set_shared(self, url: str, jan: str, jan_source: str, now: float):
+        try:
+            self.shared.set(f"jan:{url}", json.dumps([jan, jan_source, now], ensure_ascii=False),
+                            ttl=self.ttl if jan else self.negative_ttl)
+        except SharedStateError as e:
+            logger.debug(f"[キャッシュ] 共有状態エラー: {e}")
+
+    def _evict(self):
+        """上限を超えたら古いものから1割まとめて削除（ロック取得済みで呼ぶ）"""
+        count = self._conn.execute("SELECT COUNT(*) FROM jan_cache").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        remove = count - self.max_entries + max(1, self.max_entries // 10)
+        self._conn.execute(
+            "DELETE FROM jan_cache WHERE url IN "
+            "(SELECT url FROM jan_cache ORDER BY accessed_at LIMIT ?)",
+            (remove,)
+        )
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM jan_cache").fetchone()[0]
+        return {"size": size, "hits": self.hits, "misses": self.misses, "shared_hits": self.shared_hits}
+
+
+class TTLCache:
+    """TTL付きLRU。shared を渡す場合、値はJSONにできるもの（namespace は共有先のキーの接頭辞）"""
+
+    def __init__(self, ttl: float, max_entries: int = 1000, shared: SharedState | None = None,
+                 namespace: str = "ttl"):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self.shared_hits = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _shared_key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{'/'.join(map(str, key)) if isinstance(key, tuple) else key}"
+
+    def get(self, key: Hashable) -> Any | None:
+        """有効な値があれば返す（なければ None）"""
+        value = self._get_local(key)
+        if value is not None:
+            return value
+        return self._get_remote(key)
+
+    async def get_async(self, key: Hashable) -> Any | None:
+        """get の非同期版（共有先を引くときはスレッドで行う）"""
+        value = self._get_local(key)
+        if value is not None:
+            return value
+        if self.shared is None:
+            return self._get_remote(key)
+        return await asyncio.to_thread(self._get_remote, key)
+
+    def _get_local(self, key: Hashable) -> Any | None:
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+        return None
+
+    def _get_remote(self, key: Hashable) -> Any | None:
+        """プロセス内になかった値を共有先から引く（ヒット・ミスもここで数える）"""
+        value = None
+        if self.shared is not None:
+            try:
+                stored = self.shared.get(self._shared_key(key))
+            except SharedStateError as e:
+                logger.debug(f"[キャッシュ] 共有状態エラー: {e}")
+                stored = None
+            if stored is not None:
+                stored_at, value = json.loads(stored)
+                self._put(key, value, stored_at)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.shared_hits += 1
+        return value
+
+    def _put(self, key: Hashable, value: Any, stored_at: float):
+        with self._lock:
+            self._data[key] = (stored_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any):
+        now = time.time()
+        self._put(key, value, now)
+        if self.shared is not None:
+            self._set_shared(key, value, now)
+
+    async def set_async(self, key: Hashable, value: Any):
+        """set の非同期版（共有先への書き込みはスレッドで行う）"""
+        now = time.time()
+        self._put(key, value, now)
+        if self.shared is not None:
+            await asyncio.to_thread(self._set_shared, key, value, now)
+
+    def _set_shared(self, key: Hashable, value: Any, now: float):
+        try:
+            self.shared.set(self._shared_key(key), json.dumps([now, value], ensure_ascii=False),
+                            ttl=self.ttl)
+        except SharedStateError as e:
+            logger.debug(f"[キャッシュ] 共有状態エラー: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                    "shared_hits": self.shared_hits}
+
+
+class _Listing:
+    __slots__ = ("price_min", "price_max", "pages", "complete", "records", "fetched_at")
+
+    def __init__(self, price_min: int, price_max: int, pages: int, complete: bool, records: list,
+                 fetched_at: float | None = None):
+        self.price_min = price_min
+        self.price_max = price_max
+        self.pages = pages
+        self.complete = complete
+        self.records = records
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    def to_json(self) -> list:
+        return [self.price_min, self.price_max, self.pages, self.complete, self.records, self.fetched_at]
+
+
+class ListingCache:
+    """競合検索（API）結果のキャッシュ
+
+    records は価格（"price"）を持つ辞書のリスト。
+    complete は「その価格帯の商品を全件取得できた」（APIの count 以下しかない）ことを表す。
+    全件取得済みの広い価格帯に含まれる狭い価格帯は、ローカルで絞り込めば同じ結果になる。
+    共有先にはジャンルごとに、取得済みの価格帯の一覧を1つの値として置く。
+    """
+
+    def __init__(self, ttl: float | None = None, max_entries: int = 500, hits_per_page: int = 30,
+                 shared: SharedState | None = None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get("LISTING_CACHE_TTL", 900))
+        self.max_entries = max_entries
+        self.hits_per_page = hits_per_page
+        self.shared = shared
+        self.shared_loads = 0
+        self.exact_hits = 0
+        self.band_hits = 0
+        self.misses = 0
+        self.saved_api_calls = 0
+        self._genres: dict[str, list[_Listing]] = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        for genre in list(self._genres):
+            listings = [l for l in self._genres[genre] if now - l.fetched_at < self.ttl]
+            self._count -= len(self._genres[genre]) - len(listings)
+            if listings:
+                self._genres[genre] = listings
+            else:
+                del self._genres[genre]
+
+    def _lookup(self, genre: str, price_min: int, price_max: int, pages: int) -> list | None:
+        """ロック取得済みで呼ぶ"""
+        limit = pages * self.hits_per_page
+        self._expire(time.time())
+        listings = self._genres.get(genre, [])
+
+        # 同じ価格帯で、同じかそれ以上のページ数を取得済み
+        for listing in listings:
+            if (listing.price_min == price_min and listing.price_max == price_max
+                    and (listing.complete or listing.pages >= pages)):
+                self.exact_hits += 1
+                self.saved_api_calls += min(pages, listing.pages)
+                return listing.records[:limit]
+
+        # 全件取得済みの広い価格帯に含まれる
+        for listing in listings:
+            if listing.complete and listing.price_min <= price_min and price_max <= listing.price_max:
+                records = [r for r in listing.records if price_min <= r["price"] <= price_max][:limit]
+                self.band_hits += 1
+                self.saved_api_calls += max(1, min(pages, math.ceil(len(records) / self.hits_per_page)))
+                return records
+        return None
+
+    def get(self, genre: str, price_min: int, price_max: int, pages: int) -> list | None:
+        """再利用できる結果があればレコードのリストを返す"""
+        with self._lock:
+            records = self._lookup(genre, price_min, price_max, pages)
+        if records is None and self.shared is not None:
+            records = self._merge_shared(genre, self._load_shared(genre), price_min, price_max, pages)
+        if records is None:
+            with self._lock:
+                self.misses += 1
+        return records
+
+    async def get_async(self, genre: str, price_min: int, price_max: int, pages: int) -> list | None:
+        """get の非同期版（共有先を引くときはスレッドで行う）"""
+        with self._lock:
+            records = self._lookup(genre, price_min, price_max, pages)
+        if records is None and self.shared is not None:
+            remote = await asyncio.to_thread(self._load_shared, genre)
+            records = self._merge_shared(genre, remote, price_min, price_max, pages)
+        if records is None:
+            with self._lock:
+                self.misses += 1
+        return records
+
+    def _merge_shared(self, genre: str, remote: list[_Listing], price_min: int, price_max: int,
+                      pages: int) -> list | None:
+        """他のワーカーが取得した価格帯を取り込んでもう一度探す"""
+        with self._lock:
+            known = {(l.price_min, l.price_max): l.fetched_at for l in self._genres.get(genre, [])}
+            for listing in remote:
+                if known.get((listing.price_min, listing.price_max), 0) < listing.fetched_at:
+                    self._add(genre, listing)
+            if not remote:
+                return None
+            self.shared_loads += 1
+            return self._lookup(genre, price_min, price_max, pages)
+
+    def _load_shared(self, genre: str) -> list[_Listing]:
+        try:
+            stored = self.shared.get_json(f"listing:{genre}") or []
+        except SharedStateError as e:
+            logger.debug(f"[キャッシュ] 共有状態エラー: {e}")
+            return []
+        now = time.time()
+        return [listing for listing in (_Listing(*values) for values in stored)
+                if now - listing.fetched_at < self.ttl]
+
+    def set(self, genre: str, price_min: int, price_max: int, pages: int,
+            complete: bool, records: list):
+        listing = _Listing(price_min, price_max, pages, complete, records)
+        with self._lock:
+            self._add(genre, listing)
+        if self.shared is not None:
+            self._set_shared(genre, listing)
+
+    async def set_async(self, genre: str, price_min: int, price_max: int, pages: int,
+                        complete: bool, records: list):
+        """set の非同期版（共有先への書き込みはスレッドで行う）"""
+        listing = _Listing(price_min, price_max, pages, complete, records)
+        with self._lock:
+            self._add(genre, listing)
+        if self.shared is not None:
+            await asyncio.to_thread(self._set_shared, genre, listing)
+
+    def _set_shared(self, genre: str, listing: _Listing):
+        # 他のワーカーの価格帯と合わせて置き直す（同時に書いた分が消えても、次の検索で入り直すだけ）
+        listings = [l for l in self._load_shared(genre)
+                    if not (l.price_min == listing.price_min and l.price_max == listing.price_max)]
+        listings.append(listing)
+        try:
+            self.shared.set_json(f"listing:{genre}", [l.to_json() for l in listings], ttl=self.ttl)
+        except SharedStateError as e:
+            logger.debug(f"[キャッシュ] 共有状態エラー: {e}")
+
+    def _add(self, genre: str, listing: _Listing):
+        """ロック取得済みで呼ぶ"""
+        listings = self._genres.setdefault(genre, [])
+        # 同じ価格帯の古い結果は置き換える
+        before = len(listings)
+        listings[:] = [l for l in listings
+                       if not (l.price_min == listing.price_min and l.price_max == listing.price_max)]
+        listings.append(listing)
+        self._count += len(listings) - before
+
+        # 上限を超えたら最も古いものから削除
+        while self._count > self.max_entries:
+            genre_key, oldest = min(
+                ((g, l) for g, ls in self._genres.items() for l in ls),
+                key=lambda x: x[1].fetched_at)
+            self._genres[genre_key].remove(oldest)
+            if not self._genres[genre_key]:
+                del self._genres[genre_key]
+            self._count -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.exact_hits + self.band_hits + self.misses
+            return {
+                "size": self._count,
+                "exact_hits": self.exact_hits,
+                "band_hits": self.band_hits,
+                "misses": self.misses,
+                "hit_rate": (self.exact_hits + self.band_hits) / lookups if lookups else 0.0,
+                "saved_api_calls": self.saved_api_calls,
+                "shared_loads": self.shared_loads,
+            }
@@ -0,0 +1,62 @@
+"""
+競合商品のレコード
+
+検索のたびに数十〜数百件、バッチでは数千件作られるので、辞書ではなく
+__slots__ のクラスにしてメモリと生成コストを抑える。
+
+rakuten.py（競合一覧の組み立て）・main.py（画面・エクスポート）・spreadsheet.py（シートへの追記）で共通。
+既存の呼び出し側やテンプレートのために item["jan"] / item.get("janSource") の形でも読み書きできる。
+"""
+
+# 辞書形式のキー → 属性名（それ以外は同じ名前）
+_ATTRS = {"janSource": "jan_source"}
+_KEYS = ("name", "price", "image", "jan", "janSource", "url", "shop")
+
+
+class Competitor:
+    __slots__ = ("name", "price", "image", "jan", "jan_source", "url", "shop")
+
+    def __init__(self, name: str = "", price: int = 0, image: str = "", jan: str = "",
+                 jan_source: str = "", url: str = "", shop: str = ""):
+        self.name = name
+        self.price = price
+        self.image = image
+        self.jan = jan
+        self.jan_source = jan_source
+        self.url = url
+        self.shop = shop
+
+    @classmethod
+    def from_record(cls, record: dict) -> "Competitor":
+        """競合一覧用のレコード（辞書）から作る"""
+        return cls(record.get("name", ""), record.get("price", 0), record.get("image", ""),
+                   record.get("jan", ""), record.get("janSource", ""), record.get("url", ""),
+                   record.get("shop", ""))
+
+    def as_row(self) -> list:
+        """エクスポート・シート用の行（JANコード, 商品名, ショップ, 価格, URL）"""
+        return [self.jan, self.name, self.shop, self.price, self.url]
+
+    def to_dict(self) -> dict:
+        """JSON保存用の辞書"""
+        return {key: getattr(self, _ATTRS.get(key, key)) for key in _KEYS}
+
+    # --- 辞書と同じ書き方での読み書き ---
+
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, _ATTRS.get(key, key))
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: str, value):
+        setattr(self, _ATTRS.get(key, key), value)
+
+    def get(self, key: str, default=None):
+        return getattr(self, _ATTRS.get(key, key), default)
+
+    def keys(self) -> tuple:
+        return _KEYS
+
+    def __repr__(self) -> str:
+        return f"Competitor(jan={self.jan!r}, name={self.name!r}, shop={self.shop!r}, price={self.price!r})"
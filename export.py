@@ -0,0 +1,152 @@
+"""
+エクスポート（ストリーミング）
+
+行のイテレーターを受け取り、一定行数ごとにバイト列を返すジェネレーターにする。
+ファイル全体をメモリに作らないので、数千行以上のバッチ結果でもそのまま流せる。
+
+形式:
+- csv: BOM付きUTF-8（Excelで文字化けしない）
+- csv.gz: 上記をgzip圧縮
+- parquet: pyarrow がインストールされている場合のみ（行グループ単位で書き出す）
+"""
+
+import csv
+import io
+import zlib
+from typing import Iterable, Iterator
+
+EXPORT_HEADERS = ["JANコード", "商品名", "ショップ", "価格", "URL"]
+# 何行ごとに書き出すか
+CHUNK_ROWS = 500
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "csv.gz": ("application/gzip", "csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def available_formats() -> list[str]:
+    return [fmt for fmt in FORMATS if fmt != "parquet" or parquet_available()]
+
+
+def parse_selected(value: str) -> list | None:
+    """旧形式のチェックボックス値 "jan|name|shop|price|url" を行にする
+
+    商品名やショップ名に "|" が含まれていてもよいように、JANは先頭、
+    URL・価格は末尾から取り、残りを商品名とショップ名に分ける（ショップ名は "|" を含まない前提）
+    """
+    parts = value.split("|")
+    if len(parts) < 5:
+        return None
+    jan, url, price, shop = parts[0], parts[-1], parts[-2], parts[-3]
+    name = "|".join(parts[1:-3])
+    return [jan, name, shop, price, url]
+
+
+def iter_csv(rows: Iterable[list], headers: list[str]) -> Iterator[bytes]:
+    """BOM付きUTF-8のCSVを CHUNK_ROWS 行ずつ返す"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(headers)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count % CHUNK_ROWS == 0:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_csv_gz(rows: Iterable[list], headers: list[str]) -> Iterator[bytes]:
+    """gzip圧縮したCSVを少しずつ返す"""
+    # wbits=31 でgzip形式（ヘッダー・CRC付き）
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in iter_csv(rows, headers):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _ChunkSink(io.RawIOBase):
+    """書き込まれたバイト列を溜めておき、取り出すと空にする書き込み先"""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_parquet(rows: Iterable[list], headers: list[str]) -> Iterator[bytes]:
+    """Parquetを行グループ（CHUNK_ROWS 行）ごとに返す（要 pyarrow）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # 価格だけ整数、ほかは文字列
+    price_index = headers.index("価格") if "価格" in headers else -1
+    schema = pa.schema([
+        (name, pa.int64() if i == price_index else pa.string()) for i, name in enumerate(headers)
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+    def write_batch(batch: list[list]):
+        columns = list(zip(*batch))
+        arrays = []
+        for i, values in enumerate(columns):
+            if i == price_index:
+                arrays.append(pa.array([int(v) if str(v).lstrip("-").isdigit() else None for v in values],
+                                       pa.int64()))
+            else:
+                arrays.append(pa.array([str(v) for v in values], pa.string()))
+        writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= CHUNK_ROWS:
+            write_batch(batch)
+            batch = []
+            yield sink.take()
+    if batch:
+        write_batch(batch)
+    writer.close()
+    yield sink.take()
+
+
+def stream_export(rows: Iterable[list], headers: list[str], fmt: str) -> Iterator[bytes]:
+    """指定形式のバイト列を少しずつ返すジェネレーター"""
+    if fmt == "csv.gz":
+        return iter_csv_gz(rows, headers)
+    if fmt == "parquet":
+        return iter_parquet(rows, headers)
+    return iter_csv(rows, headers)
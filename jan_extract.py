@@ -0,0 +1,138 @@
+"""
+商品ページからのJANコード抽出
+
+- find_jan_in_html: BeautifulSoupで全文テキスト化して探す（従来方式・確実だが重い）
+- JanScanner: 受信途中のバイト列から「JAN/EAN」ラベル付近の13桁を探す高速版
+  ラベル付きのJANが見つかった時点で受信を打ち切れる。
+  見つからなければ受信済みの本文全体を find_jan_in_html に回す。
+
+高速版はバイト列のまま正規表現をかけるので文字コード（UTF-8/EUC-JP/Shift_JIS）の
+デコードが要らない。これらの文字コードでは、マルチバイト文字の途中に
+ASCIIの数字（0x30〜0x39）が現れることはない。
+"""
+
+import re
+from bs4 import BeautifulSoup
+
+# ラベルは単語として現れるものだけ（"ocean" などの一部は除く。"JANコード"・"JAN code" は可）
+# ラベルと13桁の間は数字以外の文字（タグ・空白・全角コロン等）を最大64バイトまで許す
+_LABELED_JAN = re.compile(
+    rb'(?<![A-Za-z])(?:JAN|EAN)(?:[ _-]?code)?(?![A-Za-z])[^0-9]{0,64}?(?<![0-9])([0-9]{13})(?![0-9])',
+    re.IGNORECASE)
+# チャンク境界をまたぐマッチのために前回分の末尾を残す長さ（ラベル＋間＋13桁が収まる長さ）
+_OVERLAP = 96
+# 13桁の数字列（ページ本文・説明文・URL中の候補）
+_DIGITS13 = re.compile(r'[0-9]{13}')
+# ASCIIの "0" のバイト値。各桁の重み（1,3,1,3,…,1 とチェックディジットの1）の合計は 6+18+1 = 25
+_ZERO_OFFSET = ord('0') * 25
+
+
+def _checksum_ok(data: bytes, start: int = 0) -> bool:
+    """data[start:start+13] のチェックディジットを検証（ASCII数字であること前提）
+
+    文字ごとに int() せず、バイト値をスライスごとに合計してから "0" の分を引く。
+    重み付き合計 + チェックディジット が10の倍数なら正しい。
+    """
+    end = start + 12
+    total = sum(data[start:end:2]) + 3 * sum(data[start + 1:end:2]) + data[end]
+    return (total - _ZERO_OFFSET) % 10 == 0
+
+
+def is_valid_jan(code: str) -> bool:
+    """JANコード（EAN-13）のチェックディジットを検証"""
+    if not code or len(code) != 13 or not code.isascii() or not code.isdigit():
+        return False
+    if code.startswith('10'):
+        return False
+    return _checksum_ok(code.encode('ascii'))
+
+
+def valid_jans(text: str) -> list[str]:
+    """文字列中の13桁の数字列のうち、有効なJANコードを出現順に返す
+
+    候補をまとめて1つのバイト列にし、1回のループでチェックディジットを検証する
+    """
+    candidates = _DIGITS13.findall(text)
+    if not candidates:
+        return []
+    data = "".join(candidates).encode('ascii')
+    return [
+        code for i, code in enumerate(candidates)
+        if not code.startswith('10') and _checksum_ok(data, i * 13)
+    ]
+
+
+def find_jan_in_html(html: str) -> str:
+    """商品ページのHTMLからJANコードを探す（BeautifulSoup版）"""
+    soup = BeautifulSoup(html, 'html.parser')
+    page_text = soup.get_text()
+
+    jan_patterns = [
+        r'JAN[コード：:\s]*([0-9]{13})',
+        r'JANコード[：:\s]*([0-9]{13})',
+        r'EAN[：:\s]*([0-9]{13})',
+    ]
+    for pattern in jan_patterns:
+        match = re.search(pattern, page_text, re.IGNORECASE)
+        if match and is_valid_jan(match.group(1)):
+            return match.group(1)
+
+    jans = valid_jans(page_text)
+    for jan in jans:
+        if jan.startswith('45') or jan.startswith('49'):
+            return jan
+    return jans[0] if jans else ""
+
+
+def find_labeled_jan(data: bytes, partial: bool = False) -> str:
+    """バイト列から「JAN/EAN」ラベル付きの有効なJANコードを探す
+
+    partial=True のときは続きがある前提で、末尾ちょうどで終わる数字列は採用しない
+    （次のチャンクに数字が続いて14桁以上になる可能性があるため）
+    """
+    for match in _LABELED_JAN.finditer(data):
+        if partial and match.end() == len(data):
+            continue
+        jan = match.group(1).decode('ascii')
+        if is_valid_jan(jan):
+            return jan
+    return ""
+
+
+class JanScanner:
+    """受信中のページ本文を少しずつ受け取り、ラベル付きJANを探す
+
+    使い方:
+        scanner = JanScanner()
+        for chunk in response_chunks:
+            if scanner.feed(chunk):
+                break   # 見つかったので残りは受信しない
+        jan = scanner.result(encoding)
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+        self._tail = b""
+        self.found = ""
+        self.bytes_read = 0
+
+    def feed(self, chunk: bytes) -> bool:
+        """チャンクを追加し、ラベル付きJANが見つかったら True を返す"""
+        if self.found:
+            return True
+        self._chunks.append(chunk)
+        self.bytes_read += len(chunk)
+        window = self._tail + chunk
+        self.found = find_labeled_jan(window, partial=True)
+        self._tail = window[-_OVERLAP:]
+        return bool(self.found)
+
+    def result(self, encoding: str | None = None) -> str:
+        """見つかったJANを返す。なければ受信済み本文をBeautifulSoupで解析する"""
+        if not self.found:
+            # 最後のチャンクの末尾で終わっていた数字列を確認
+            self.found = find_labeled_jan(self._tail)
+        if self.found:
+            return self.found
+        html = b"".join(self._chunks).decode(encoding or "utf-8", errors="replace")
+        return find_jan_in_html(html)
@@ -0,0 +1,63 @@
+"""
+ログ設定
+
+環境変数:
+- LOG_LEVEL: DEBUG / INFO / WARNING / ERROR（デフォルト: INFO）
+- LOG_FORMAT: text / json（デフォルト: text）
+  json は1行1オブジェクトで出力し、Cloud Logging が severity を解釈できる
+
+logger.info("メッセージ", extra={"stage": "get_item", "duration_ms": 12.3})
+のように extra で渡した項目は、json ではフィールドとして、text では末尾に key=value で出力する。
+"""
+
+import json
+import logging
+import os
+import sys
+
+# LogRecord が標準で持つ属性（これ以外を extra として扱う）
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "taskName"}
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            "time": self.formatTime(record),
+        }
+        entry.update(_extra_fields(record))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(name)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            text += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return text
+
+
+def setup_logging():
+    """ルートロガーを環境変数に従って設定する（複数回呼んでもよい）"""
+    level = os.environ.get("LOG_LEVEL", "INFO").upper()
+    handler = logging.StreamHandler(sys.stdout)
+    if os.environ.get("LOG_FORMAT", "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(TextFormatter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
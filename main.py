@@ -1,19 +1,81 @@
-from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi import FastAPI, Request, Form, HTTPException, UploadFile, File, Query
+from fastapi.responses import HTMLResponse, StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
 from typing import Optional
+import asyncio
+import json
+import logging
+import os
 import re
-import csv
-import io
-from rakuten import RakutenAPI
+import time
+import uuid
+import metrics
+from rakuten import AsyncRakutenAPI, extract_ids_from_url, decide_price_band, competitor_order
+from jan_extract import is_valid_jan
+from search_store import SearchStore, SearchSession
+from batch import BatchJob, CSV_HEADERS, read_seeds
+from export import (EXPORT_HEADERS, FORMATS, available_formats, parquet_available, parse_selected,
+                    stream_export)
+from watch import WatchStore, WatchScheduler, parse_target
+from prefetch import Prefetcher
+from sheet_sync import SheetSyncQueue
+from rate_limiter import current_requester, all_rate_limiter_stats
+from state import INSTANCE_ID, get_shared_state
+from log import setup_logging
+from metrics import span, Gauge, SEARCHES, STAGE_SECONDS
 
 # .envファイルから環境変数を読み込み
 load_dotenv()
+setup_logging()
+logger = logging.getLogger(__name__)
 
-app = FastAPI(title="競合JANコード検索ツール")
+# 複数ワーカー・インスタンスで共有する状態（SHARED_STATE 未設定なら None）
+shared_state = get_shared_state()
+rakuten = AsyncRakutenAPI()
+# 画面から指定できる最大ページ数（1ページ30件）
+MAX_SEARCH_PAGES = 10
+# バッチの状態・結果ファイルの置き場所
+BATCH_DIR = os.environ.get("BATCH_DIR", "data/batch")
+batch_jobs: dict[str, BatchJob] = {}
+search_store = SearchStore(shared=shared_state)
+prefetcher = Prefetcher(rakuten)
+watch_store = WatchStore()
+watch_scheduler = WatchScheduler(rakuten, watch_store, shared=shared_state)
+# 見つかった競合をJANマスタのシートへ送るキュー（SHEET_SYNC_SHEET 未設定なら何もしない）
+sheet_sync = SheetSyncQueue(shared=shared_state)
+# 価格ウォッチの巡回間隔の下限（分）
+WATCH_MIN_INTERVAL = int(os.environ.get("WATCH_MIN_INTERVAL", 15))
+
+Gauge("jancode_rate_limit_queue_depth", "API呼び出しの待ち行列の長さ",
+      lambda: {(app_id,): s["queue_depth"] for app_id, s in all_rate_limiter_stats().items()}, ("app_id",))
+Gauge("jancode_cache_entries", "キャッシュの件数",
+      lambda: {(name,): cache.stats()["size"] for name, cache in (
+          ("jan", rakuten.jan_cache), ("item", rakuten.item_cache), ("listing", rakuten.listing_cache),
+          ("page", rakuten.page_store))},
+      ("cache",))
+Gauge("jancode_scrape_concurrency_limit", "スクレイピングの同時実行数の上限（自動調整）",
+      lambda: rakuten.scrape_pool.stats()["limit"])
+Gauge("jancode_scrape_in_flight", "実行中のスクレイピング数", lambda: rakuten.scrape_pool.stats()["in_flight"])
+Gauge("jancode_search_sessions", "保持中の検索セッション数", lambda: len(search_store))
+Gauge("jancode_sheet_sync_queued", "スプレッドシートへの送信待ちの行数", lambda: sheet_sync.queued())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    watch_scheduler.start()
+    sheet_sync.start()
+    yield
+    await watch_scheduler.stop()
+    await sheet_sync.stop()
+    await prefetcher.aclose()
+    # 終了時にHTTPコネクションプールを閉じる
+    await rakuten.aclose()
+
+
+app = FastAPI(title="競合JANコード検索ツール", lifespan=lifespan)
 templates = Jinja2Templates(directory="templates")
-rakuten = RakutenAPI()
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -22,18 +84,33 @@ async def index(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
+@app.post("/prefetch", status_code=202)
+async def prefetch(request: Request, url: str = Form(...)):
+    """URLが貼り付けられた時点で、商品取得と自動の価格帯の競合検索を先に始める"""
+    current_requester.set(request.client.host if request.client else "anonymous")
+    return {"status": prefetcher.start(url)}
+
+
 @app.post("/search", response_class=HTMLResponse)
 async def search(
     request: Request, 
     url: str = Form(...),
     price_mode: str = Form(default="auto"),
     price_min: Optional[int] = Form(default=None),
-    price_max: Optional[int] = Form(default=None)
+    price_max: Optional[int] = Form(default=None),
+    pages: int = Form(default=1),
+    stream: bool = Form(default=True)
 ):
     """楽天URLから競合商品を検索"""
+    # API呼び出しの待ち行列はアクセス元ごとに公平に扱う
+    current_requester.set(request.client.host if request.client else "anonymous")
+    started = time.perf_counter()
+
     # 1. URLからショップIDと商品IDを抽出
-    parsed = extract_ids_from_url(url)
+    with span("extract_ids"):
+        parsed = extract_ids_from_url(url)
     if not parsed:
+        SEARCHES.inc(result="invalid_url")
         return templates.TemplateResponse("error.html", {
             "request": request,
             "message": "URLが不正です。楽天の商品URLを入力してください。"
@@ -42,81 +119,384 @@ async def search(
     shop_code, item_id = parsed
     
     # 2. 商品詳細取得（API使用）
-    product = rakuten.get_item(shop_code, item_id)
+    with span("get_item", shop=shop_code, item=item_id):
+        # 貼り付け時の先読みが実行中ならその結果を待って使う
+        product = await prefetcher.get_item(shop_code, item_id)
     if not product:
+        SEARCHES.inc(result="not_found")
         return templates.TemplateResponse("error.html", {
             "request": request,
             "message": "商品が見つかりません。URLを確認してください。"
         })
     
     # 3. 価格帯の決定
-    if price_mode == "custom" and price_min is not None and price_max is not None:
-        # カスタム指定
-        search_price_min = price_min
-        search_price_max = price_max
-        price_mode_label = "カスタム"
-    elif price_mode == "none":
-        # 価格制限なし
-        search_price_min = 0
-        search_price_max = 999999999
-        price_mode_label = "制限なし"
-    else:
-        # 自動（±30%）
-        search_price_min = int(product["price"] * 0.7)
-        search_price_max = int(product["price"] * 1.3)
-        price_mode_label = "自動（±30%）"
+    search_price_min, search_price_max, price_mode_label = decide_price_band(
+        product["price"], price_mode, price_min, price_max)
+    
+    logger.info(f"[価格帯] {price_mode_label}: ¥{search_price_min:,} 〜 ¥{search_price_max:,}")
     
-    print(f"[価格帯] {price_mode_label}: ¥{search_price_min:,} 〜 ¥{search_price_max:,}")
+    # 同じJANを扱う他ショップ（過去の検索で蓄積した分）
+    same_jan_offers = [
+        offer for offer in await asyncio.to_thread(rakuten.product_index.by_jan, product["jan"])
+        if offer["shopCode"] != product["shopId"]
+    ] if product["jan"] else []
     
-    # 4. 同カテゴリ商品検索
-    competitors = rakuten.search_competitors(
-        category_id=product["categoryId"],
+    # 4. 同カテゴリ商品検索（API・キャッシュ分）
+    search_pages = max(1, min(pages, MAX_SEARCH_PAGES))
+    with span("competitor_api", category=product["categoryId"]):
+        await prefetcher.wait_listing(shop_code, item_id, search_price_min, search_price_max, search_pages)
+        competitors, items_to_scrape = await rakuten.find_competitors(
+            category_id=product["categoryId"],
+            price_min=search_price_min,
+            price_max=search_price_max,
+            exclude_shop=product["shopId"],
+            pages=search_pages,
+            jan=product["jan"]
+        )
+    
+    session = await search_store.create(
+        product=product,
+        competitors=competitors,
         price_min=search_price_min,
         price_max=search_price_max,
-        exclude_shop=product["shopId"]
+        price_mode_label=price_mode_label
     )
     
-    return templates.TemplateResponse("results.html", {
-        "request": request,
-        "product": product,
-        "competitors": competitors,
-        "price_min": search_price_min,
-        "price_max": search_price_max,
-        "price_mode_label": price_mode_label
+    # 5. 残りはスクレイピング（ストリーミング時は結果表示後にSSEで送る）
+    if items_to_scrape:
+        logger.info(f"[スクレイピング] {len(items_to_scrape)}件のページをスキャン中...")
+        session.task = asyncio.create_task(scrape_into_session(session, items_to_scrape))
+        if not stream:
+            await session.task
+            competitors.sort(key=competitor_order(product["jan"]))
+            # 並べ替えた行番号で他のワーカーからもエクスポートできるように置き直す
+            await search_store.save(session)
+    else:
+        await asyncio.to_thread(sheet_sync.push, competitors)
+        await session.finish()
+    
+    with span("render"):
+        response = templates.TemplateResponse("results.html", {
+            "request": request,
+            "search_id": session.id,
+            "pending": 0 if session.done else len(items_to_scrape),
+            "product": product,
+            "same_jan_offers": same_jan_offers,
+            "competitors": competitors,
+            "price_min": search_price_min,
+            "price_max": search_price_max,
+            "price_mode_label": price_mode_label,
+            "export_formats": available_formats()
+        })
+    
+    elapsed = time.perf_counter() - started
+    STAGE_SECONDS.observe(elapsed, stage="search_total")
+    SEARCHES.inc(result="ok")
+    logger.info("検索完了", extra={
+        "search_id": session.id, "duration_ms": round(elapsed * 1000, 1),
+        "competitors": len(competitors), "pending": len(items_to_scrape),
     })
+    return response
 
 
-def extract_ids_from_url(url: str) -> tuple[str, str] | None:
-    """楽天URLからショップIDと商品IDを抽出"""
-    # パターン: item.rakuten.co.jp/shop/item-id/
-    pattern = r"item\.rakuten\.co\.jp/([^/]+)/([^/?]+)"
-    match = re.search(pattern, url)
-    if match:
-        return (match.group(1), match.group(2))
-    return None
+async def scrape_into_session(session: SearchSession, items_to_scrape: list):
+    """スクレイピングで見つかったJANを検索セッションに流す"""
+    try:
+        with span("competitor_scrape", search_id=session.id, pages=len(items_to_scrape)):
+            async for item in rakuten.iter_scraped_jans(items_to_scrape):
+                if item.jan:
+                    await session.publish("jan", {
+                        "index": session.index_of(item),
+                        "jan": item.jan,
+                        "janSource": item.jan_source,
+                    })
+                else:
+                    # JANがなかった・取得に失敗したページも、確認済みの件数に数えられるよう通知する
+                    await session.publish("miss", {"index": session.index_of(item)})
+        await asyncio.to_thread(sheet_sync.push, session.competitors)
+    finally:
+        await session.finish()
 
 
-@app.post("/export", response_class=StreamingResponse)
-async def export_csv(selected: list[str] = Form(default=[])):
-    """選択した商品をCSVエクスポート"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["JANコード", "商品名", "ショップ", "価格", "URL"])
+@app.get("/search/{search_id}/events")
+async def search_events(search_id: str):
+    """スクレイピング結果をServer-Sent Eventsで配信"""
+    session = await search_store.get(search_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="検索結果が見つかりません")
     
-    # selectedの形式: "jan|name|shop|price|url"
-    for item in selected:
-        parts = item.split("|")
-        if len(parts) == 5:
-            writer.writerow(parts)
+    async def event_stream():
+        async for event, data in session.subscribe():
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
     
-    output.seek(0)
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/stats")
+async def stats():
+    """キャッシュ・API待ち行列の状態"""
+    return {
+        "rate_limiter": all_rate_limiter_stats(),
+        "jan_cache": rakuten.jan_cache.stats(),
+        "item_cache": rakuten.item_cache.stats(),
+        "listing_cache": rakuten.listing_cache.stats(),
+        "scrape_pool": rakuten.scrape_pool.stats(),
+        "product_index": rakuten.product_index.stats(),
+        "page_store": rakuten.page_store.stats(),
+        "watch": watch_scheduler.stats(),
+        "prefetch": prefetcher.stats(),
+        "sheet_sync": sheet_sync.stats(),
+        "shared_state": dict(shared_state.stats(), instance=INSTANCE_ID) if shared_state else None,
+    }
+
+
+@app.get("/jan/{jan}")
+async def jan_offers(jan: str):
+    """JANコードを扱うショップと価格（APIを呼ばず、蓄積済みの商品から答える）"""
+    if not is_valid_jan(jan):
+        raise HTTPException(status_code=400, detail="JANコードが不正です")
+    offers = await asyncio.to_thread(rakuten.product_index.by_jan, jan)
+    return {
+        "jan": jan,
+        "count": len(offers),
+        "shops": len({offer["shopCode"] for offer in offers}),
+        "min_price": offers[0]["price"] if offers else None,
+        "offers": offers,
+    }
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus形式のメトリクス"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def _batch_paths(job_id: str) -> dict:
+    job_dir = os.path.join(BATCH_DIR, job_id)
+    return {
+        "dir": job_dir,
+        "config": os.path.join(job_dir, "job.json"),
+        "state": os.path.join(job_dir, "state.jsonl"),
+        "output": os.path.join(job_dir, "result.csv"),
+    }
+
+
+def _load_batch_job(job_id: str) -> BatchJob | None:
+    """メモリ上になければ保存済みの設定から復元（再起動後の再開用）"""
+    if job_id in batch_jobs:
+        return batch_jobs[job_id]
+    if not re.fullmatch(r"[0-9a-f]{12}", job_id):
+        return None
+    paths = _batch_paths(job_id)
+    if not os.path.exists(paths["config"]):
+        return None
+    with open(paths["config"], encoding="utf-8") as f:
+        config = json.load(f)
+    job = BatchJob(state_path=paths["state"], output_path=paths["output"], api=rakuten,
+                   job_id=job_id, shared=shared_state, sheet_sync=sheet_sync, **config)
+    batch_jobs[job_id] = job
+    return job
+
+
+def _start_batch_job(job: BatchJob):
+    job.task = asyncio.create_task(job.run())
+
+
+@app.post("/batch")
+async def create_batch(
+    urls: str = Form(default=""),
+    file: Optional[UploadFile] = File(default=None),
+    concurrency: int = Form(default=3),
+    price_mode: str = Form(default="auto"),
+    price_min: Optional[int] = Form(default=None),
+    price_max: Optional[int] = Form(default=None),
+    pages: int = Form(default=1)
+):
+    """複数の商品URL（テキスト or CSVファイル）で一括検索を開始"""
+    text = urls
+    if file is not None:
+        text += "\n" + (await file.read()).decode("utf-8-sig", errors="replace")
+    seeds = read_seeds(text)
+    if not seeds:
+        raise HTTPException(status_code=400, detail="楽天の商品URLが見つかりません")
     
-    # BOM付きUTF-8でExcelでも文字化けしない
-    bom = '\ufeff'
-    content = bom + output.getvalue()
+    job_id = uuid.uuid4().hex[:12]
+    paths = _batch_paths(job_id)
+    os.makedirs(paths["dir"], exist_ok=True)
+    config = {
+        "seeds": seeds,
+        "concurrency": max(1, min(concurrency, 10)),
+        "price_mode": price_mode,
+        "price_min": price_min,
+        "price_max": price_max,
+        "pages": max(1, min(pages, MAX_SEARCH_PAGES)),
+    }
+    with open(paths["config"], "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False)
     
+    job = _load_batch_job(job_id)
+    _start_batch_job(job)
+    return await asyncio.to_thread(job.progress)
+
+
+@app.get("/batch/{job_id}")
+async def batch_status(job_id: str):
+    """バッチの進捗"""
+    job = _load_batch_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="バッチが見つかりません")
+    return await asyncio.to_thread(job.progress)
+
+
+@app.post("/batch/{job_id}/resume")
+async def resume_batch(job_id: str):
+    """中断したバッチを完了済みの続きから再開"""
+    job = _load_batch_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="バッチが見つかりません")
+    if not job.running and not await asyncio.to_thread(job.running_elsewhere):
+        _start_batch_job(job)
+    return await asyncio.to_thread(job.progress)
+
+
+@app.get("/batch/{job_id}/download")
+async def download_batch(job_id: str, format: str = "csv"):
+    """バッチの結果（実行中ならその時点までの結果）
+
+    状態ファイルから1行ずつ読みながら返すので、数千行あってもメモリに載せない
+    """
+    job = _load_batch_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="バッチが見つかりません")
+    return _export_response(job.iter_rows(), CSV_HEADERS, format, f"batch_{job_id}")
+
+
+# --- 価格ウォッチ ---
+
+@app.post("/watch")
+async def create_watch(
+    target: str = Form(...),
+    interval_minutes: int = Form(default=60),
+    pages: int = Form(default=1)
+):
+    """自社商品URLまたはJANコードを監視リストに登録"""
+    parsed = parse_target(target)
+    if not parsed:
+        raise HTTPException(status_code=400, detail="楽天の商品URLまたはJANコードを指定してください")
+    kind, value = parsed
+    watch = await asyncio.to_thread(
+        watch_store.add, kind, value,
+        interval_seconds=max(interval_minutes, WATCH_MIN_INTERVAL) * 60,
+        pages=max(1, min(pages, MAX_SEARCH_PAGES))
+    )
+    watch_scheduler.wake()
+    return watch
+
+
+@app.get("/watch")
+async def list_watches():
+    """監視リスト"""
+    return {"watches": await asyncio.to_thread(watch_store.watches), "scheduler": watch_scheduler.stats()}
+
+
+@app.get("/watch/changes")
+async def watch_changes(since_id: int = 0, watch_id: Optional[int] = None, limit: int = 500):
+    """since_id より後の価格変化（続きは next_since_id を渡して取得）"""
+    changes = await asyncio.to_thread(watch_store.changes, watch_id, since_id, max(1, min(limit, 5000)))
+    return {
+        "changes": changes,
+        "next_since_id": changes[-1]["id"] if changes else since_id,
+    }
+
+
+@app.get("/watch/{watch_id}")
+async def watch_detail(watch_id: int):
+    """監視対象と、追跡中の商品の最新価格"""
+    watch = await asyncio.to_thread(watch_store.get, watch_id)
+    if not watch:
+        raise HTTPException(status_code=404, detail="監視対象が見つかりません")
+    return {"watch": watch, "latest": await asyncio.to_thread(watch_store.latest, watch_id)}
+
+
+@app.get("/watch/{watch_id}/history")
+async def watch_history(watch_id: int, url: str):
+    """1商品の価格の推移"""
+    if not await asyncio.to_thread(watch_store.get, watch_id):
+        raise HTTPException(status_code=404, detail="監視対象が見つかりません")
+    return {"url": url, "history": await asyncio.to_thread(watch_store.history, watch_id, url)}
+
+
+@app.post("/watch/{watch_id}/run")
+async def run_watch(watch_id: int):
+    """次の巡回を待たずに実行する"""
+    if not await asyncio.to_thread(watch_store.get, watch_id):
+        raise HTTPException(status_code=404, detail="監視対象が見つかりません")
+    await asyncio.to_thread(watch_store.schedule, watch_id, next_run_at=0)
+    watch_scheduler.wake()
+    return {"scheduled": True}
+
+
+@app.delete("/watch/{watch_id}")
+async def delete_watch(watch_id: int):
+    """監視をやめる（記録済みの履歴は残る）"""
+    if not await asyncio.to_thread(watch_store.remove, watch_id):
+        raise HTTPException(status_code=404, detail="監視対象が見つかりません")
+    return {"deleted": True}
+
+
+def _export_response(rows, headers: list[str], fmt: str, filename: str) -> StreamingResponse:
+    """行のイテレーターを指定形式で少しずつ返すレスポンス"""
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"未対応の形式です: {fmt}")
+    if fmt == "parquet" and not parquet_available():
+        raise HTTPException(status_code=400, detail="Parquet形式には pyarrow のインストールが必要です")
+    media_type, extension = FORMATS[fmt]
     return StreamingResponse(
-        iter([content.encode('utf-8')]),
-        media_type="text/csv; charset=utf-8",
-        headers={"Content-Disposition": "attachment; filename=competitors.csv"}
+        stream_export(rows, headers, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}.{extension}"}
     )
+
+
+def _session_rows(session: SearchSession, selected: list[str]):
+    """検索結果のうち選択した行（行番号）。未指定なら全件"""
+    competitors = session.competitors
+    if not selected:
+        return (item.as_row() for item in competitors)
+    indexes = [int(i) for i in selected if i.isdigit() and int(i) < len(competitors)]
+    return (competitors[i].as_row() for i in indexes)
+
+
+@app.get("/search/{search_id}/export")
+async def export_search(search_id: str, format: str = "csv", selected: list[str] = Query(default=[])):
+    """検索結果（サーバー側に保持中）をエクスポート"""
+    session = await search_store.get(search_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="検索結果の有効期限が切れました。もう一度検索してください")
+    return _export_response(_session_rows(session, selected), EXPORT_HEADERS, format, "competitors")
+
+
+@app.post("/export", response_class=StreamingResponse)
+async def export_csv(
+    search_id: str = Form(default=""),
+    selected: list[str] = Form(default=[]),
+    format: str = Form(default="csv")
+):
+    """選択した商品をエクスポート
+
+    search_id があれば selected は検索結果の行番号。
+    なければ旧形式（"jan|name|shop|price|url"）として読む
+    """
+    if search_id:
+        session = await search_store.get(search_id)
+        if not session:
+            raise HTTPException(status_code=404, detail="検索結果の有効期限が切れました。もう一度検索してください")
+        # 何も選択されていなければヘッダーだけ
+        rows = _session_rows(session, selected) if selected else iter(())
+    else:
+        rows = (row for row in map(parse_selected, selected) if row)
+    return _export_response(rows, EXPORT_HEADERS, format, "competitors")
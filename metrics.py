@@ -0,0 +1,163 @@
+"""
+メトリクス（Prometheus形式）
+
+外部ライブラリを使わない最小限の Counter / Histogram / Gauge と、
+処理段階ごとの所要時間を測る span() を提供する。
+/metrics で render() の結果を返す。
+"""
+
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: list = []
+
+
+def _format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # ラベルごとに [各バケットの件数..., 合計, 件数]
+        self._values: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            data = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, data in sorted(self._values.items()):
+                for bound, count in zip(self.buckets, data):
+                    labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {data[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {data[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {data[-1]}")
+        return lines
+
+
+class Gauge:
+    """値を取得時に関数で計算するゲージ
+
+    func は数値、または {ラベル値のタプル: 数値} を返す
+    """
+
+    def __init__(self, name: str, help: str, func: Callable, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = labelnames
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.func()
+        except Exception as e:
+            logger.warning("ゲージの取得に失敗しました", extra={"metric": self.name, "error": str(e)})
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+def render() -> str:
+    """登録済みメトリクスをPrometheusのテキスト形式で出力"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- アプリ共通のメトリクス ---
+
+STAGE_SECONDS = Histogram("jancode_stage_seconds", "処理段階ごとの所要時間（秒）", ("stage",))
+SEARCHES = Counter("jancode_searches_total", "/search の実行回数", ("result",))
+API_REQUESTS = Counter("jancode_api_requests_total", "楽天API呼び出し回数", ("status",))
+API_SECONDS = Histogram("jancode_api_seconds", "楽天API呼び出しの所要時間（秒）")
+SCRAPES = Counter("jancode_scrapes_total", "商品ページのスクレイピング回数",
+                  ("result",))  # found / not_found / error / timeout
+SCRAPE_SECONDS = Histogram("jancode_scrape_seconds", "商品ページ1件のスクレイピング時間（秒）")
+COMPETITORS = Counter("jancode_competitors_total", "競合一覧に載せた商品数")
+JAN_SEARCHES = Counter("jancode_jan_searches_total", "自社商品のJANでの全ショップ検索",
+                       ("result",))  # api / cache / late / error
+JAN_SOURCES = Counter("jancode_jan_source_total", "JANコードの取得元ごとの件数",
+                      ("source",))  # api / url / caption / scrape
+RATE_LIMIT_WAIT = Histogram("jancode_rate_limit_wait_seconds", "レートリミッターの待ち時間（秒）")
+
+# JANの取得元（画面表示用の名前 → ラベル）
+JAN_SOURCE_LABELS = {"API": "api", "URL": "url", "説明文": "caption", "スクレイピング": "scrape"}
+
+
+def count_jan_source(jan_source: str):
+    JAN_SOURCES.inc(source=JAN_SOURCE_LABELS.get(jan_source, jan_source or "none"))
+
+
+@contextmanager
+def span(stage: str, **fields):
+    """処理段階の所要時間を計測してヒストグラムとログに記録する"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        logger.debug("stage完了", extra={"stage": stage, "duration_ms": round(elapsed * 1000, 1), **fields})
@@ -0,0 +1,178 @@
+"""
+商品ページの保存（条件付きリクエスト用）
+
+スクレイピングで受信した商品ページの本文を、ETag / Last-Modified と一緒に
+圧縮してSQLiteに保存する。次に同じページを取得するときは
+If-None-Match / If-Modified-Since を付けて問い合わせ、304（変更なし）なら
+本文を受信せずに保存分を使う。
+
+- 保存するのは ETag か Last-Modified を返したページだけ（検証できないものは保存しない）
+- 本文は受信した分だけ保存する（JANが見つかって途中で受信を打ち切った場合は先頭部分のみ）
+  同じ内容を同じ順に読み直すので、打ち切った位置までで得た結果は変わらない
+- 1ページの受信は PAGE_MAX_BYTES まで（それ以上は読まずに、受信済みの分で判定する）
+- 保存分の合計が上限を超えたら最終参照日時の古い順に削除
+
+環境変数:
+- PAGE_STORE_PATH: SQLiteファイルのパス（デフォルト: data/page_store.sqlite3、空文字で保存しない）
+- PAGE_STORE_MAX_MB: 保存する本文（圧縮後）の合計の上限（デフォルト: 200）
+- PAGE_MAX_BYTES: 1ページあたりの受信の上限バイト数（デフォルト: 512KB）
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from metrics import Counter
+
+PAGE_FETCHES = Counter("jancode_page_fetches_total", "商品ページの取得（条件付きリクエストの結果）", ("result",))
+PAGE_BYTES = Counter("jancode_page_bytes_total", "商品ページの本文のバイト数", ("kind",))
+
+
+class StoredPage:
+    __slots__ = ("body", "encoding")
+
+    def __init__(self, body: bytes, encoding: str | None):
+        self.body = body
+        self.encoding = encoding
+
+    def chunks(self, size: int):
+        for i in range(0, len(self.body), size):
+            yield self.body[i:i + size]
+
+
+class PageStore:
+    def __init__(self, path: str | None = None, max_bytes: int | None = None,
+                 max_page_bytes: int | None = None):
+        self.path = path if path is not None else os.environ.get("PAGE_STORE_PATH", "data/page_store.sqlite3")
+        self.max_bytes = max_bytes if max_bytes is not None else int(
+            float(os.environ.get("PAGE_STORE_MAX_MB", 200)) * 1024 * 1024)
+        self.max_page_bytes = max_page_bytes if max_page_bytes is not None else int(
+            os.environ.get("PAGE_MAX_BYTES", 512 * 1024))
+        self.enabled = bool(self.path)
+        self.fetched = 0
+        self.not_modified = 0
+        self.truncated = 0
+        self.bytes_downloaded = 0
+        self.bytes_saved = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if not self.enabled:
+            return
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                encoding TEXT,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_pages_accessed ON pages(accessed_at)")
+        self._conn.commit()
+
+    def validators(self, url: str) -> dict:
+        """保存済みのページなら条件付きリクエストのヘッダーを返す"""
+        if not self.enabled:
+            return {}
+        with self._lock:
+            row = self._conn.execute("SELECT etag, last_modified FROM pages WHERE url = ?", (url,)).fetchone()
+        if row is None:
+            return {}
+        headers = {}
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def revalidated(self, url: str) -> StoredPage | None:
+        """304 を受けたページの保存分を返す（受信せずに済んだバイト数を数える）"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT encoding, body FROM pages WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), url))
+            self._conn.commit()
+            body = zlib.decompress(row[1])
+            self.not_modified += 1
+            self.bytes_saved += len(body)
+        PAGE_FETCHES.inc(result="not_modified")
+        PAGE_BYTES.inc(len(body), kind="saved")
+        return StoredPage(body, row[0])
+
+    def record(self, url: str, body: bytes, encoding: str | None, etag: str | None,
+               last_modified: str | None, truncated: bool = False):
+        """受信したページを記録し、検証用のヘッダーがあれば本文を保存する"""
+        with self._lock:
+            self.fetched += 1
+            self.bytes_downloaded += len(body)
+            self.truncated += truncated
+        PAGE_FETCHES.inc(result="fetched")
+        PAGE_BYTES.inc(len(body), kind="downloaded")
+        if not self.enabled:
+            return
+        if not (etag or last_modified):
+            # 検証できないページは保存しても使えないので、古い保存分も消す
+            with self._lock:
+                self._conn.execute("DELETE FROM pages WHERE url = ?", (url,))
+                self._conn.commit()
+            return
+        compressed = zlib.compress(body, 6)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (url, etag, last_modified, encoding, body, size, fetched_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, encoding, compressed, len(compressed), now, now)
+            )
+            self._conn.commit()
+            # 合計サイズの確認は書き込み100回ごと
+            self._writes += 1
+            if self._writes % 100 == 1:
+                self._evict()
+
+    def _evict(self):
+        """上限を超えたら古いものから削除（ロック取得済みで呼ぶ）"""
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # 上限の9割まで減らす
+        excess = total - self.max_bytes * 0.9
+        urls = []
+        for url, size in self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at"):
+            urls.append((url,))
+            excess -= size
+            if excess <= 0:
+                break
+        self._conn.executemany("DELETE FROM pages WHERE url = ?", urls)
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        size = stored_bytes = 0
+        if self.enabled:
+            with self._lock:
+                size, stored_bytes = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages").fetchone()
+        requests = self.fetched + self.not_modified
+        return {
+            "size": size,
+            "stored_bytes": stored_bytes,
+            "fetched": self.fetched,
+            "not_modified": self.not_modified,
+            "not_modified_rate": self.not_modified / requests if requests else 0.0,
+            "truncated": self.truncated,
+            "bytes_downloaded": self.bytes_downloaded,
+            "bytes_saved": self.bytes_saved,
+        }
@@ -0,0 +1,119 @@
+"""
+URL貼り付け時の先読み
+
+画面でURLが貼り付けられた時点で、検索ボタンを押す前に
+- 自社商品の取得（get_item）
+- 自動（±30%）の価格帯での競合検索（1ページ目）と、自社商品のJANでの全ショップ検索
+をバックグラウンドで始めておく。結果は item_cache / listing_cache に入るので、
+そのあとの /search はAPIを待たずに済む。
+
+/search が先読みの途中で来た場合は、同じAPI呼び出しをもう一度出さずに
+実行中の先読みの完了を待って使う（価格帯が違えば競合検索は待たない）。
+スクレイピングは先読みしない（画面で検索されなかった分のページ取得が無駄になるため）。
+
+環境変数:
+- PREFETCH_MAX_IN_FLIGHT: 同時に実行する先読みの上限（デフォルト: 20）
+"""
+
+import asyncio
+import logging
+import os
+import time
+
+from metrics import Counter
+from rakuten import AsyncRakutenAPI, decide_price_band, extract_ids_from_url
+
+logger = logging.getLogger(__name__)
+
+PREFETCHES = Counter("jancode_prefetches_total", "URL貼り付け時の先読み", ("result",))
+PREFETCH_USED = Counter("jancode_prefetch_used_total", "検索時に実行中の先読みを待って使った回数", ("stage",))
+
+
+class _Prefetch:
+    __slots__ = ("item", "listing", "band", "started_at")
+
+    def __init__(self):
+        self.item: asyncio.Task | None = None
+        self.listing: asyncio.Task | None = None
+        # 競合検索を先読みしている価格帯（商品の取得後に決まる）
+        self.band: tuple[int, int] | None = None
+        self.started_at = time.monotonic()
+
+
+class Prefetcher:
+    def __init__(self, api: AsyncRakutenAPI, max_in_flight: int | None = None):
+        self.api = api
+        self.max_in_flight = max_in_flight if max_in_flight is not None else int(
+            os.environ.get("PREFETCH_MAX_IN_FLIGHT", 20))
+        self._in_flight: dict[tuple[str, str], _Prefetch] = {}
+        self.started = 0
+        self.used = 0
+
+    def start(self, url: str) -> str:
+        """先読みを始めて状態（started / in_flight / busy / invalid）を返す"""
+        parsed = extract_ids_from_url(url)
+        if not parsed:
+            result = "invalid"
+        elif parsed in self._in_flight:
+            result = "in_flight"
+        elif len(self._in_flight) >= self.max_in_flight:
+            result = "busy"
+        else:
+            entry = _Prefetch()
+            entry.item = asyncio.ensure_future(self.api.get_item(*parsed))
+            entry.listing = asyncio.ensure_future(self._warm_listing(entry))
+            entry.listing.add_done_callback(lambda _: self._in_flight.pop(parsed, None))
+            self._in_flight[parsed] = entry
+            self.started += 1
+            result = "started"
+        PREFETCHES.inc(result=result)
+        return result
+
+    async def _warm_listing(self, entry: _Prefetch):
+        """商品の取得を待ち、自動の価格帯で競合検索（1ページ目）を済ませておく"""
+        try:
+            product = await entry.item
+            if not product:
+                return
+            price_min, price_max, _ = decide_price_band(product["price"])
+            entry.band = (price_min, price_max)
+            # JAN検索も終わるまで待ち、/search ではどちらもキャッシュから使えるようにする
+            # （競合一覧は作らないので、検索されなかった分を競合数のメトリクスに数えない）
+            await self.api.warm_competitors(product["categoryId"], price_min, price_max,
+                                            pages=1, jan=product["jan"])
+        except Exception as e:
+            logger.warning(f"[先読み] 失敗: {e}")
+
+    async def get_item(self, shop_code: str, item_id: str) -> dict | None:
+        """自社商品を取得する（先読み中なら、その結果を待って使う）"""
+        entry = self._in_flight.get((shop_code, item_id))
+        if entry and entry.item:
+            self.used += 1
+            PREFETCH_USED.inc(stage="item")
+            # 待っている検索が中断されても、先読み自体は止めない
+            product = await asyncio.shield(entry.item)
+            if product:
+                return product
+        return await self.api.get_item(shop_code, item_id)
+
+    async def wait_listing(self, shop_code: str, item_id: str, price_min: int, price_max: int,
+                           pages: int):
+        """同じ価格帯の競合検索を先読み中なら完了を待つ（結果はキャッシュから使われる）"""
+        entry = self._in_flight.get((shop_code, item_id))
+        if not entry or not entry.listing or entry.listing.done():
+            return
+        if pages != 1 or entry.band != (price_min, price_max):
+            return
+        PREFETCH_USED.inc(stage="listing")
+        await asyncio.shield(entry.listing)
+
+    async def aclose(self):
+        """実行中の先読みを止める（終了時）"""
+        for entry in list(self._in_flight.values()):
+            for task in (entry.item, entry.listing):
+                if task:
+                    task.cancel()
+        self._in_flight.clear()
+
+    def stats(self) -> dict:
+        return {"in_flight": len(self._in_flight), "started": self.started, "used": self.used}
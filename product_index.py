@@ -0,0 +1,209 @@
+"""
+商品インデックス
+
+競合検索で見つかった商品（JAN・ジャンル・価格・ショップ・URL・最終確認日時）を
+SQLiteに蓄積する。JAN と ジャンル+価格 で引ける。
+
+- by_jan: 同じJANの商品を扱うショップと価格（APIを呼ばずに答えられる）
+- covered_listing: 最近検索したジャンル・価格帯なら、蓄積済みの商品から競合一覧を返す
+  （ListingCache と同じく、同じ価格帯か、全件取得済みの広い価格帯に含まれる場合のみ）
+
+環境変数:
+- PRODUCT_INDEX_PATH: SQLiteファイルのパス（デフォルト: data/product_index.sqlite3）
+- PRODUCT_INDEX_REUSE_TTL: 検索済みの価格帯を競合一覧に使い回す秒数（0で無効）
+  デフォルトは LISTING_CACHE_TTL と同じ（900秒）。長くすると、その分古い価格を現在の結果として表示する
+- PRODUCT_INDEX_MAX_AGE: この秒数見かけなかった商品は削除（デフォルト: 30日）
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+# 1ページあたりの件数（楽天APIの hits）
+HITS_PER_PAGE = 30
+
+_COLUMNS = ("url", "jan", "jan_source", "name", "genre_id", "price", "shop", "shop_code", "image", "last_seen")
+
+
+class ProductIndex:
+    def __init__(self, path: str | None = None, reuse_ttl: float | None = None,
+                 max_age: float | None = None):
+        self.path = path or os.environ.get("PRODUCT_INDEX_PATH", "data/product_index.sqlite3")
+        self.reuse_ttl = reuse_ttl if reuse_ttl is not None else float(
+            os.environ.get("PRODUCT_INDEX_REUSE_TTL", os.environ.get("LISTING_CACHE_TTL", 900)))
+        self.max_age = max_age if max_age is not None else float(
+            os.environ.get("PRODUCT_INDEX_MAX_AGE", 30 * 24 * 3600))
+        self.coverage_hits = 0
+        self.coverage_misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS products (
+                url TEXT PRIMARY KEY,
+                jan TEXT NOT NULL,
+                jan_source TEXT NOT NULL,
+                name TEXT NOT NULL,
+                genre_id TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                shop TEXT NOT NULL,
+                shop_code TEXT NOT NULL,
+                image TEXT NOT NULL,
+                last_seen REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_products_jan ON products(jan) WHERE jan != '';
+            CREATE INDEX IF NOT EXISTS idx_products_genre_price ON products(genre_id, price);
+            CREATE INDEX IF NOT EXISTS idx_products_last_seen ON products(last_seen);
+
+            -- 検索済みのジャンル・価格帯（covered_at 時点でこの範囲を pages ページ取得した）
+            CREATE TABLE IF NOT EXISTS coverage (
+                genre_id TEXT NOT NULL,
+                price_min INTEGER NOT NULL,
+                price_max INTEGER NOT NULL,
+                pages INTEGER NOT NULL,
+                complete INTEGER NOT NULL,
+                covered_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_coverage_genre ON coverage(genre_id, covered_at);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _row(record: dict, genre_id: str, now: float) -> tuple:
+        return (record["url"], record.get("jan", ""), record.get("janSource", ""), record.get("name", ""),
+                str(genre_id), int(record.get("price", 0)), record.get("shop", ""),
+                record.get("shopCode", ""), record.get("image", ""), now)
+
+    @staticmethod
+    def _record(row: tuple) -> dict:
+        """DBの行を競合一覧のレコード形式にする"""
+        url, jan, jan_source, name, genre_id, price, shop, shop_code, image, last_seen = row
+        return {
+            "name": name,
+            "price": price,
+            "image": image,
+            "jan": jan,
+            "janSource": jan_source,
+            "url": url,
+            "shop": shop,
+            "shopCode": shop_code,
+        }
+
+    def _upsert(self, rows: list[tuple]):
+        """商品を追加・更新（ロック取得済みで呼ぶ）。新しい行にJAN・ジャンルがなければ既存の値を残す"""
+        self._conn.executemany(
+            f"INSERT INTO products ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))}) "
+            "ON CONFLICT(url) DO UPDATE SET "
+            "jan = CASE WHEN excluded.jan != '' THEN excluded.jan ELSE products.jan END, "
+            "jan_source = CASE WHEN excluded.jan != '' THEN excluded.jan_source ELSE products.jan_source END, "
+            "genre_id = CASE WHEN excluded.genre_id != '' THEN excluded.genre_id ELSE products.genre_id END, "
+            "name = excluded.name, price = excluded.price, "
+            "shop = excluded.shop, shop_code = excluded.shop_code, image = excluded.image, "
+            "last_seen = excluded.last_seen",
+            rows
+        )
+        self._writes += 1
+        if self._writes % 100 == 1:
+            self._prune(rows[0][-1] if rows else time.time())
+
+    def add_listing(self, genre_id: str, price_min: int, price_max: int, pages: int,
+                    records: list, complete: bool, covered: bool = True):
+        """競合検索（API）の結果を登録する
+
+        covered=False のとき（途中のページが欠けた等）は商品だけ登録し、検索済みの範囲には含めない
+        """
+        now = time.time()
+        with self._lock:
+            self._upsert([self._row(record, genre_id, now) for record in records if record.get("url")])
+            if covered:
+                self._conn.execute(
+                    "INSERT INTO coverage (genre_id, price_min, price_max, pages, complete, covered_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (str(genre_id), price_min, price_max, pages, int(complete), now)
+                )
+            self._conn.commit()
+
+    def add_product(self, product: dict):
+        """自社商品（get_item の結果）を登録する"""
+        record = {
+            "name": product["name"], "price": product["price"], "image": product.get("image", ""),
+            "jan": product.get("jan", ""), "janSource": product.get("janSource", ""),
+            "url": product["url"], "shop": product.get("shopName", ""), "shopCode": product.get("shopId", ""),
+        }
+        with self._lock:
+            self._upsert([self._row(record, product.get("categoryId", ""), time.time())])
+            self._conn.commit()
+
+    def set_jan(self, url: str, jan: str, jan_source: str):
+        """スクレイピング等で後から分かったJANを反映する"""
+        with self._lock:
+            self._conn.execute("UPDATE products SET jan = ?, jan_source = ? WHERE url = ?",
+                               (jan, jan_source, url))
+            self._conn.commit()
+
+    def by_jan(self, jan: str) -> list[dict]:
+        """同じJANの商品を価格の安い順に返す（最終確認日時つき）"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM products WHERE jan = ? ORDER BY price, last_seen DESC",
+                (jan,)
+            ).fetchall()
+        offers = []
+        for row in rows:
+            record = self._record(row)
+            record["genreId"] = row[4]
+            record["lastSeen"] = row[-1]
+            offers.append(record)
+        return offers
+
+    def covered_listing(self, genre_id: str, price_min: int, price_max: int, pages: int) -> list | None:
+        """最近検索済みの範囲なら、蓄積済みの商品から競合一覧のレコードを返す"""
+        if self.reuse_ttl <= 0:
+            return None
+        now = time.time()
+        with self._lock:
+            coverage = self._conn.execute(
+                "SELECT price_min, price_max, pages, complete, covered_at FROM coverage "
+                "WHERE genre_id = ? AND covered_at >= ? AND price_min <= ? AND price_max >= ? "
+                "ORDER BY covered_at DESC",
+                (str(genre_id), now - self.reuse_ttl, price_min, price_max)
+            ).fetchall()
+            for cov_min, cov_max, cov_pages, complete, covered_at in coverage:
+                same_band = cov_min == price_min and cov_max == price_max
+                if complete or (same_band and cov_pages >= pages):
+                    break
+            else:
+                self.coverage_misses += 1
+                return None
+            # その検索以降に確認できた商品だけを使う（古い価格・消えた商品を含めない）
+            rows = self._conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM products "
+                "WHERE genre_id = ? AND price BETWEEN ? AND ? AND last_seen >= ? "
+                "ORDER BY last_seen DESC LIMIT ?",
+                (str(genre_id), price_min, price_max, covered_at, pages * HITS_PER_PAGE)
+            ).fetchall()
+            self.coverage_hits += 1
+        return [self._record(row) for row in rows]
+
+    def _prune(self, now: float):
+        """長く見かけない商品と古い検索範囲を削除（ロック取得済みで呼ぶ）"""
+        self._conn.execute("DELETE FROM products WHERE last_seen < ?", (now - self.max_age,))
+        self._conn.execute("DELETE FROM coverage WHERE covered_at < ?", (now - max(self.reuse_ttl, 0),))
+
+    def stats(self) -> dict:
+        with self._lock:
+            size, jans = self._conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT NULLIF(jan, '')) FROM products").fetchone()
+            genres = self._conn.execute("SELECT COUNT(DISTINCT genre_id) FROM coverage").fetchone()[0]
+        return {
+            "size": size,
+            "jans": jans,
+            "covered_genres": genres,
+            "coverage_hits": self.coverage_hits,
+            "coverage_misses": self.coverage_misses,
+        }
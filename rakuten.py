@@ -1,172 +1,378 @@
 import os
 import re
+import time
+import asyncio
+import logging
 import requests
-from bs4 import BeautifulSoup
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import as_completed, TimeoutError as FuturesTimeoutError
+from typing import AsyncIterator
+from cache import JanCache, TTLCache, ListingCache
+from competitor import Competitor
+from product_index import ProductIndex
+from page_store import PageStore
+from jan_extract import JanScanner, is_valid_jan, valid_jans, find_jan_in_html
+from rate_limiter import RateLimiter, get_rate_limiter, RETRY_STATUS, MAX_RETRIES
+from scrape_pool import ScrapePool, get_scrape_pool
+from state import get_shared_state
+from metrics import (span, count_jan_source, API_REQUESTS, API_SECONDS, SCRAPES,
+                     SCRAPE_SECONDS, COMPETITORS, JAN_SEARCHES)
+
+logger = logging.getLogger(__name__)
+
+HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
+SEARCH_API_PATH = "/IchibaItem/Search/20220601"
+ITEM_PAGE_URL = "https://item.rakuten.co.jp/{shop_code}/{item_id}/"
+ITEM_HOST = "https://item.rakuten.co.jp"
+# ページ本文を走査する単位（バイト）
+SCAN_CHUNK_SIZE = 16 * 1024
+# 商品検索APIで取得できる最大ページ数
+MAX_PAGES = 100
+# 自社商品ページの <title> と文字コード指定（先頭付近にある）
+_TITLE = re.compile(rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+_META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_-]+)""", re.IGNORECASE)
+# <title> を探すのは先頭からこのバイト数まで
+TITLE_SCAN_BYTES = 64 * 1024
+
+
+def extract_ids_from_url(url: str) -> tuple[str, str] | None:
+    """楽天URLからショップIDと商品IDを抽出"""
+    # パターン: item.rakuten.co.jp/shop/item-id/
+    pattern = r"item\.rakuten\.co\.jp/([^/]+)/([^/?]+)"
+    match = re.search(pattern, url)
+    if match:
+        return (match.group(1), match.group(2))
+    return None
+
+
+class SeedPage:
+    """自社商品ページを1回取得して読み取った内容"""
+    __slots__ = ("name", "shop", "jan", "scanned")
+
+    def __init__(self, name: str = "", shop: str = "", jan: str = "", scanned: bool = False):
+        # 検索キーワード用の商品名（タイトルの先頭5語）
+        self.name = name
+        self.shop = shop
+        self.jan = jan
+        # JANを探し終えたか（ページを取得した・JANキャッシュにあった）
+        self.scanned = scanned
+
+
+class _PageBody:
+    """商品ページの本文（受信中、または保存済みのもの）
+
+    受信は limit バイトまで。受信した分は received に残し、あとで保存する。
+    """
+
+    def __init__(self, chunks, encoding: str | None, limit: int, stored: bool = False):
+        self._chunks = chunks
+        self.encoding = encoding
+        self.limit = limit
+        self.stored = stored
+        self.received: list[bytes] = []
+        self.size = 0
+        self.truncated = False
+
+    def _take(self, chunk: bytes) -> bytes:
+        if self.size + len(chunk) > self.limit:
+            chunk = chunk[:self.limit - self.size]
+            self.truncated = True
+        self.size += len(chunk)
+        if not self.stored:
+            self.received.append(chunk)
+        return chunk
+
+    def __iter__(self):
+        for chunk in self._chunks:
+            yield self._take(chunk)
+            if self.size >= self.limit:
+                return
+
+    async def __aiter__(self):
+        if self.stored:
+            for chunk in self:
+                yield chunk
+            return
+        async for chunk in self._chunks:
+            yield self._take(chunk)
+            if self.size >= self.limit:
+                return
+
+
+def _read_title(head: bytes, encoding: str | None) -> str | None:
+    """受信済みの先頭部分から <title> を読む（まだ届いていなければ None）"""
+    match = _TITLE.search(head)
+    if not match:
+        return None
+    if not encoding:
+        meta = _META_CHARSET.search(head)
+        encoding = meta.group(1).decode("ascii") if meta else "utf-8"
+    try:
+        return match.group(1).decode(encoding, errors="replace").strip()
+    except LookupError:
+        return match.group(1).decode("utf-8", errors="replace").strip()
+
+
+class _SeedScan:
+    """自社商品ページの受信内容から <title> とJANを読む"""
 
-class RakutenAPI:
     def __init__(self):
+        self.scanner = JanScanner()
+        self.head = b""
+        self.title: str | None = None
+
+    def feed(self, chunk: bytes, encoding: str | None) -> bool:
+        """タイトルとラベル付きJANがそろったら True（残りは受信しなくてよい）"""
+        found = self.scanner.feed(chunk)
+        if self.title is None and len(self.head) < TITLE_SCAN_BYTES:
+            self.head += chunk
+            self.title = _read_title(self.head, encoding)
+        return found and (self.title is not None or len(self.head) >= TITLE_SCAN_BYTES)
+
+    def page(self, encoding: str | None) -> SeedPage:
+        name, shop = parse_item_title(self.title or "")
+        return SeedPage(name, shop, self.scanner.result(encoding), scanned=True)
+
+
+def parse_item_title(title: str) -> tuple[str, str]:
+    """「【楽天市場】商品名:ショップ名」のタイトルから (検索用の商品名, ショップ名) を取り出す"""
+    if '【楽天市場】' not in title:
+        return ("", "")
+    name, _, shop = title.replace('【楽天市場】', '').partition(':')
+    # 最初の数単語を取得（検索キーワード用）
+    return (' '.join(name.strip().split()[:5]), shop.strip())
+
+
+def competitor_order(jan: str = ""):
+    """競合一覧の並べ替えキー: 自社商品と同じJAN → JANあり → JANなし（同順位は商品名順）"""
+    return lambda c: (not jan or c.jan != jan, c.jan == "", c.name)
+
+
+def decide_price_band(price: int, price_mode: str = "auto", price_min: int | None = None,
+                      price_max: int | None = None) -> tuple[int, int, str]:
+    """価格帯を決める
+
+    Returns:
+        (下限, 上限, 表示用ラベル)
+    """
+    if price_mode == "custom" and price_min is not None and price_max is not None:
+        # カスタム指定
+        return (price_min, price_max, "カスタム")
+    if price_mode == "none":
+        # 価格制限なし
+        return (0, 999999999, "制限なし")
+    # 自動（±30%）
+    return (int(price * 0.7), int(price * 1.3), "自動（±30%）")
+
+
+class _RakutenBase:
+    """同期版・非同期版で共通の処理（通信を伴わない部分）"""
+
+    def __init__(self, jan_cache: JanCache | None = None,
+                 rate_limiter: RateLimiter | None = None,
+                 scrape_pool: ScrapePool | None = None,
+                 product_index: ProductIndex | None = None,
+                 page_store: PageStore | None = None):
         self.app_id = os.environ.get("RAKUTEN_APP_ID")
-        self.base_url = "https://app.rakuten.co.jp/services/api"
-    
+        # 接続先（ベンチマーク等でローカルの偽サーバーに向けられる）
+        self.base_url = os.environ.get("RAKUTEN_API_BASE_URL", "https://app.rakuten.co.jp/services/api")
+        self.item_base_url = os.environ.get("RAKUTEN_ITEM_BASE_URL", ITEM_HOST).rstrip("/")
+        # SHARED_STATE があれば、各キャッシュの2段目として全ワーカーで共有する
+        shared = get_shared_state()
+        self.jan_cache = jan_cache if jan_cache is not None else JanCache(shared=shared)
+        # 自社商品の取得結果（価格帯だけ変えた再検索で商品取得を省く）
+        self.item_cache = TTLCache(ttl=float(os.environ.get("ITEM_CACHE_TTL", 600)),
+                                   shared=shared, namespace="item")
+        # 競合検索のAPI結果（同じ・内側の価格帯ならAPIを呼ばない）
+        self.listing_cache = ListingCache(shared=shared)
+        # 見つかった商品の蓄積（JAN別の出品一覧・検索済み価格帯の再利用）
+        self.product_index = product_index if product_index is not None else ProductIndex()
+        # 同じアプリIDのクライアントはすべて同じリミッターを共有する
+        self.rate_limiter = rate_limiter if rate_limiter is not None else get_rate_limiter(self.app_id)
+        # 商品ページのスクレイピングはプロセス全体で同時実行数を共有・自動調整する
+        self.scrape_pool = scrape_pool if scrape_pool is not None else get_scrape_pool()
+        # 取得した商品ページ（次回は条件付きリクエストで、変わっていなければ受信しない）
+        self.page_store = page_store if page_store is not None else PageStore()
+        # JAN検索がジャンル検索より遅れたときに待つ秒数（超えた分は次回のためにキャッシュだけする）
+        # 0 なら待たない（キャッシュ済み・すでに終わっていれば加え、それ以外は次回の検索で使う）
+        self.jan_search_wait = float(os.environ.get("JAN_SEARCH_WAIT", 0))
+
+    @property
+    def search_url(self) -> str:
+        return f"{self.base_url}{SEARCH_API_PATH}"
+
+    def _page_url(self, url: str) -> str:
+        """商品ページの取得先URL（item_base_url が変更されていれば差し替える）"""
+        if self.item_base_url != ITEM_HOST and url.startswith(ITEM_HOST):
+            return self.item_base_url + url[len(ITEM_HOST):]
+        return url
+
     def _is_valid_jan(self, code: str) -> bool:
         """JANコード（EAN-13）のチェックディジットを検証"""
-        if not code or len(code) != 13 or not code.isdigit():
-            return False
-        if code.startswith('10'):
-            return False
-        odd_sum = sum(int(code[i]) for i in range(0, 12, 2))
-        even_sum = sum(int(code[i]) for i in range(1, 12, 2))
-        total = odd_sum + even_sum * 3
-        check_digit = (10 - (total % 10)) % 10
-        return int(code[12]) == check_digit
-    
-    def _extract_jan_full(self, item: dict, scrape_if_missing: bool = False) -> tuple[str, str]:
-        """4つの方法でJANコードを探す"""
+        return is_valid_jan(code)
+
+    def _extract_jan_offline(self, item: dict) -> tuple[str, str]:
+        """API・URL・説明文の3つの方法でJANコードを探す（通信なし）"""
         item_url = item.get("itemUrl", "") or item.get("url", "")
         caption = item.get("itemCaption", "")
-        
+
         api_jan = item.get("jan", "")
         if api_jan and self._is_valid_jan(api_jan):
             return (api_jan, "API")
-        
-        jan_in_url = re.findall(r'[0-9]{13}', item_url)
-        for jan in jan_in_url:
-            if self._is_valid_jan(jan):
-                return (jan, "URL")
-        
-        jan_in_caption = re.findall(r'[0-9]{13}', caption)
-        for jan in jan_in_caption:
-            if self._is_valid_jan(jan):
-                return (jan, "説明文")
-        
-        if scrape_if_missing and item_url:
-            scraped_jan = self._scrape_jan_from_page(item_url)
-            if scraped_jan:
-                return (scraped_jan, "スクレイピング")
-        
+
+        jan_in_url = valid_jans(item_url)
+        if jan_in_url:
+            return (jan_in_url[0], "URL")
+
+        jan_in_caption = valid_jans(caption)
+        if jan_in_caption:
+            return (jan_in_caption[0], "説明文")
+
         return ("", "")
-    
-    def _scrape_jan_from_page(self, url: str) -> str:
-        """商品ページをスクレイピングしてJANコードを取得"""
-        try:
-            headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            page_text = soup.get_text()
-            
-            jan_patterns = [
-                r'JAN[コード：:\s]*([0-9]{13})',
-                r'JANコード[：:\s]*([0-9]{13})',
-                r'EAN[：:\s]*([0-9]{13})',
-            ]
-            for pattern in jan_patterns:
-                match = re.search(pattern, page_text, re.IGNORECASE)
-                if match and self._is_valid_jan(match.group(1)):
-                    return match.group(1)
-            
-            all_13_digits = re.findall(r'[0-9]{13}', page_text)
-            for jan in all_13_digits:
-                if self._is_valid_jan(jan) and (jan.startswith('45') or jan.startswith('49')):
-                    return jan
-            for jan in all_13_digits:
-                if self._is_valid_jan(jan):
-                    return jan
-        except:
-            pass
-        return ""
-    
-    def _get_product_name_from_page(self, shop_code: str, item_id: str) -> str:
-        """ページタイトルから商品名を取得"""
-        url = f"https://item.rakuten.co.jp/{shop_code}/{item_id}/"
-        try:
-            headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"}
-            response = requests.get(url, headers=headers, timeout=5)
-            response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            title_tag = soup.find('title')
-            if title_tag:
-                title = title_tag.text
-                # 【楽天市場】商品名:ショップ名 のパターン
-                if '【楽天市場】' in title:
-                    product_name = title.replace('【楽天市場】', '').split(':')[0].strip()
-                    # 最初の数単語を取得（検索キーワード用）
-                    words = product_name.split()[:5]
-                    return ' '.join(words)
-        except:
-            pass
-        return ""
-    
-    def get_item(self, shop_code: str, item_id: str) -> dict | None:
-        """ショップコードと商品IDで商品を検索"""
-        url = f"{self.base_url}/IchibaItem/Search/20220601"
-        
-        # 方法1: ショップ + 商品ID でキーワード検索
-        params = {
+
+    def _find_jan_in_html(self, html: str) -> str:
+        """商品ページのHTMLからJANコードを探す"""
+        return find_jan_in_html(html)
+
+    # --- 商品ページ（取得の仕方だけ同期版・非同期版で分ける） ---
+
+    def _stored_page(self, url: str) -> _PageBody | None:
+        """304 のときに使う保存済みの本文（保存されていなければ None）"""
+        stored = self.page_store.revalidated(url)
+        if stored is None:
+            return None
+        return _PageBody(stored.chunks(SCAN_CHUNK_SIZE), stored.encoding,
+                         self.page_store.max_page_bytes, stored=True)
+
+    def _record_page(self, url: str, body: _PageBody, headers):
+        """受信した本文を次回の条件付きリクエスト用に保存する"""
+        self.page_store.record(url, b"".join(body.received), body.encoding, headers.get("etag"),
+                               headers.get("last-modified"), body.truncated)
+
+    @staticmethod
+    def _page_failed(error: Exception) -> bool:
+        """商品ページの取得失敗を数え、相手の過負荷（タイムアウト・接続エラー・429/5xx）かを返す"""
+        if isinstance(error, (requests.Timeout, httpx.TimeoutException)):
+            SCRAPES.inc(result="timeout")
+            return True
+        SCRAPES.inc(result="error")
+        if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)):
+            return error.response is not None and error.response.status_code in RETRY_STATUS
+        return isinstance(error, (requests.ConnectionError, httpx.TransportError))
+
+    def _page_finished(self, start: float, overloaded: bool | None):
+        """商品ページ1件の所要時間を記録し、同時実行数の調整に使う（打ち切った分は None で渡す）"""
+        if overloaded is None:
+            return
+        elapsed = time.perf_counter() - start
+        SCRAPE_SECONDS.observe(elapsed)
+        self.scrape_pool.record(elapsed, overloaded)
+
+    def _apply_scraped_jan(self, item: Competitor, jan: str | None):
+        """スクレイピングで見つかったJANを競合に反映する"""
+        if jan:
+            item.jan = jan
+            item.jan_source = "スクレイピング"
+            count_jan_source("スクレイピング")
+            logger.debug(f"[JAN取得] {jan} ← スクレイピング")
+
+    @staticmethod
+    def _is_seed_item(item: dict, shop_code: str, item_id: str) -> bool:
+        """APIの商品が貼り付けられたURLの商品そのものか（商品IDの部分一致では判定しない）"""
+        return extract_ids_from_url(item.get("itemUrl", "")) == (shop_code, item_id)
+
+    def _pick_seed(self, shop_code: str, item_id: str, page: SeedPage,
+                   results: dict[str, list]) -> tuple[dict | None, bool]:
+        """キーごとの検索結果から自社商品を選ぶ
+
+        Returns:
+            (商品, 貼り付けられた商品そのものか)
+        """
+        for items in results.values():
+            for item_data in items:
+                if self._is_seed_item(item_data["Item"], shop_code, item_id):
+                    return item_data["Item"], True
+        # ページのJANと同じJANを持つ同ショップの商品
+        for item_data in results.get("jan", []):
+            if self._extract_jan_offline(item_data["Item"])[0] == page.jan:
+                return item_data["Item"], True
+        # 商品名で見つかった最初の商品（同ショップなので類似商品）
+        for key in ("name", "jan"):
+            if results.get(key):
+                return results[key][0]["Item"], False
+        return None, False
+
+    def _seed_product(self, item: dict, page: SeedPage, exact: bool) -> dict | None:
+        """ページから読んだJANで足りれば商品情報を組み立てる（足りなければ None）"""
+        jan, jan_source = self._extract_jan_offline(item)
+        if not jan:
+            if not (exact and page.scanned):
+                return None
+            jan, jan_source = (page.jan, "スクレイピング") if page.jan else ("", "")
+        return self._build_product(item, jan, jan_source)
+
+    @staticmethod
+    def _seed_keys(page: SeedPage) -> dict[str, str]:
+        """商品IDで見つからなかったときに検索し直すキー（ページのJAN・タイトルの商品名）"""
+        return {key: value for key, value in (("jan", page.jan), ("name", page.name)) if value}
+
+    def _pick_seed_fallback(self, shop_code: str, item_id: str, page: SeedPage, keys: dict[str, str],
+                            results: dict[str, list]) -> tuple[dict | None, bool]:
+        """JAN・商品名での検索結果から自社商品を選んでログに出す"""
+        for key, items in results.items():
+            logger.info(f"[API検索2] {key}:「{keys[key][:20]}」→ {len(items)}件")
+        item, exact = self._pick_seed(shop_code, item_id, page, results)
+        if item is None:
+            logger.warning(f"[結果] 商品が見つかりませんでした: {shop_code}/{item_id}")
+        else:
+            logger.info(f"[API] ✓ {'一致' if exact else '類似商品'}: {item.get('itemName', '')[:40]}...")
+        return item, exact
+
+    def _log_seed_stages(self, shop_code: str, item_id: str, stages: dict[str, float]):
+        summary = " ".join(f"{stage}:{ms:.0f}ms" for stage, ms in stages.items())
+        logger.info(f"[商品取得] {shop_code}/{item_id} {summary}",
+                    extra={"shop": shop_code, "item": item_id, "stages_ms": stages})
+
+    def _seed_params(self, shop_code: str, keyword: str) -> dict:
+        """ショップ内キーワード検索のパラメータ"""
+        return {
             "applicationId": self.app_id,
             "shopCode": shop_code,
-            "keyword": item_id,
+            "keyword": keyword,
             "hits": 10
         }
-        
-        try:
-            response = requests.get(url, params=params)
-            response.raise_for_status()
-            data = response.json()
-            items = data.get("Items", [])
-            
-            print(f"[API検索1] ショップ:{shop_code} キーワード:{item_id} → {len(items)}件")
-            
-            if items:
-                # URLに商品IDが含まれるものを探す
-                for item_data in items:
-                    item = item_data["Item"]
-                    item_url = item.get("itemUrl", "")
-                    if item_id in item_url:
-                        print(f"[API] ✓ URLマッチ: {item.get('itemName', '')[:40]}...")
-                        return self._parse_item(item, scrape_jan=True)
-        except requests.RequestException as e:
-            print(f"[API] エラー: {e}")
-        
-        # 方法2: ページタイトルから商品名を取得 → キーワード検索
-        print(f"[フォールバック] ページタイトルから商品名を取得...")
-        product_name = self._get_product_name_from_page(shop_code, item_id)
-        
-        if product_name:
-            print(f"[フォールバック] 商品名: {product_name}")
-            params = {
-                "applicationId": self.app_id,
-                "shopCode": shop_code,
-                "keyword": product_name,
-                "hits": 10
-            }
-            
-            try:
-                response = requests.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                items = data.get("Items", [])
-                
-                print(f"[API検索2] キーワード:「{product_name[:20]}...」→ {len(items)}件")
-                
-                if items:
-                    # 最初の商品を使用（同ショップなので類似商品）
-                    first_item = items[0]["Item"]
-                    print(f"[API] ✓ 類似商品: {first_item.get('itemName', '')[:40]}...")
-                    return self._parse_item(first_item, scrape_jan=True)
-            except requests.RequestException as e:
-                print(f"[API] エラー: {e}")
-        
-        print(f"[結果] 商品が見つかりませんでした")
-        return None
-    
-    def _parse_item(self, item: dict, scrape_jan: bool = False) -> dict:
-        """APIレスポンスから商品情報を抽出"""
-        jan, jan_source = self._extract_jan_full(item, scrape_if_missing=scrape_jan)
+
+    def _competitor_params(self, category_id: str, price_min: int, price_max: int,
+                           page: int = 1) -> dict:
+        """同カテゴリ・価格帯検索のパラメータ"""
+        params = {
+            "applicationId": self.app_id,
+            "genreId": category_id,
+            "minPrice": price_min,
+            "maxPrice": price_max,
+            "hits": 30
+        }
+        if page > 1:
+            params["page"] = page
+        return params
+
+    def _jan_params(self, jan: str, page: int = 1) -> dict:
+        """JANコードでのキーワード検索（全ショップ）のパラメータ"""
+        params = {
+            "applicationId": self.app_id,
+            "keyword": jan,
+            "hits": 30
+        }
+        if page > 1:
+            params["page"] = page
+        return params
+
+    def _build_product(self, item: dict, jan: str, jan_source: str) -> dict:
+        """APIレスポンスから商品情報を組み立てる"""
         if jan:
-            print(f"[JAN取得] {jan} ← {jan_source}")
-        
+            logger.debug(f"[JAN取得] {jan} ← {jan_source}")
+
         return {
             "name": item.get("itemName", ""),
             "price": item.get("itemPrice", 0),
@@ -179,79 +385,931 @@ class RakutenAPI:
             "url": item.get("itemUrl", ""),
             "categoryName": ""
         }
-    
-    def search_competitors(self, category_id: str, price_min: int, 
-                          price_max: int, exclude_shop: str) -> list:
-        """同カテゴリの競合商品を検索"""
-        url = f"{self.base_url}/IchibaItem/Search/20220601"
-        params = {
-            "applicationId": self.app_id,
-            "genreId": category_id,
-            "minPrice": price_min,
-            "maxPrice": price_max,
-            "hits": 30
+
+    def _listing_record(self, item: dict) -> dict:
+        """API検索結果の1件を競合一覧用のレコードにする（説明文などは持たない）"""
+        jan, jan_source = self._extract_jan_offline(item)
+        return {
+            "name": item.get("itemName", ""),
+            "price": item.get("itemPrice", 0),
+            "image": item.get("mediumImageUrls", [{}])[0].get("imageUrl", "") if item.get("mediumImageUrls") else "",
+            "jan": jan,
+            "janSource": jan_source,
+            "url": item.get("itemUrl", ""),
+            "shop": item.get("shopName", ""),
+            "shopCode": item.get("shopCode", "")
         }
-        
-        print(f"\n=== 競合検索 ===")
-        print(f"カテゴリID: {category_id}")
-        print(f"価格帯: ¥{price_min:,} 〜 ¥{price_max:,}")
-        print(f"除外ショップ: {exclude_shop}")
-        
+
+    def _listing_records(self, items: list, seen: set | None = None) -> list:
+        """API検索結果をレコードにする
+
+        seen を渡すと、そこに含まれる商品URLを除外して追加していく（ページ間の重複排除）
+        """
+        records = []
+        for item_data in items:
+            item = item_data["Item"]
+            if seen is not None:
+                item_url = item.get("itemUrl", "")
+                if item_url in seen:
+                    continue
+                seen.add(item_url)
+            records.append(self._listing_record(item))
+        return records
+
+    def _build_competitors(self, records: list, exclude_shop: str) -> tuple[list, list]:
+        """レコードから競合一覧とスクレイピング対象を組み立てる"""
+        competitors = []
+        items_to_scrape = []
+
+        for record in records:
+            if record["shopCode"] != exclude_shop:
+                if record["jan"]:
+                    count_jan_source(record["janSource"])
+                    logger.debug(f"[JAN取得] {record['jan']} ← {record['janSource']}")
+
+                # レコードはキャッシュと共有するので別のオブジェクトにして使う
+                competitor = Competitor.from_record(record)
+                competitors.append(competitor)
+                if not competitor.jan:
+                    items_to_scrape.append(competitor)
+
+        COMPETITORS.inc(len(competitors))
+        return competitors, items_to_scrape
+
+    def _apply_cached_jans(self, items_to_scrape: list) -> list:
+        """JANキャッシュを反映し、まだスクレイピングが必要なものだけ返す"""
+        cached = self.jan_cache.get_many([item.url for item in items_to_scrape])
+        remaining = []
+        for item in items_to_scrape:
+            if item.url not in cached:
+                remaining.append(item)
+                continue
+            jan, jan_source = cached[item.url]
+            if jan:
+                item.jan = jan
+                item.jan_source = jan_source
+                count_jan_source(jan_source)
+                logger.debug(f"[JAN取得] {jan} ← {jan_source}（キャッシュ）")
+        if len(remaining) < len(items_to_scrape):
+            logger.info(f"[キャッシュ] {len(items_to_scrape) - len(remaining)}件はスクレイピング不要")
+        return remaining
+
+    def _store_scraped_jan(self, url: str, jan: str | None):
+        """スクレイピング結果をキャッシュ（取得失敗の None は保存しない）"""
+        if jan is None:
+            return
+        self.jan_cache.set(url, jan, "スクレイピング" if jan else "")
+        if jan:
+            self.product_index.set_jan(url, jan, "スクレイピング")
+
+    def _known_listing(self, category_id: str, price_min: int, price_max: int,
+                       pages: int) -> tuple[list | None, str]:
+        """APIを呼ばずに使える競合検索結果を探す
+
+        Returns:
+            (レコードのリスト or None, 取得元の表示名)
+        """
+        records = self.listing_cache.get(category_id, price_min, price_max, pages)
+        if records is not None:
+            return records, "キャッシュ"
+        records = self.product_index.covered_listing(category_id, price_min, price_max, pages)
+        if records is not None:
+            return records, "インデックス"
+        return None, ""
+
+    def _remember_listing(self, category_id: str, price_min: int, price_max: int, pages: int,
+                          records: list, complete: bool, covered: bool = True):
+        """API検索結果をキャッシュと商品インデックスに保存"""
+        if covered:
+            self.listing_cache.set(category_id, price_min, price_max, pages,
+                                   complete=complete, records=records)
+        self.product_index.add_listing(category_id, price_min, price_max, pages, records,
+                                       complete=complete, covered=covered)
+
+    def _jan_matches(self, records: list, jan: str) -> list:
+        """JAN検索の結果から、同じJANの商品とJAN未確認の商品だけ残す（別のJANの商品は除く）"""
+        return [record for record in records if record["jan"] in (jan, "")]
+
+    def _remember_jan_listing(self, jan: str, pages: int, records: list, complete: bool,
+                              covered: bool):
+        """JAN検索の結果をキャッシュ（ジャンルの代わりに "jan:<JAN>" をキーにする）と商品インデックスに保存"""
+        if covered:
+            self.listing_cache.set(f"jan:{jan}", 0, 0, pages, complete=complete, records=records)
+        self.product_index.add_listing("", 0, 0, pages, records, complete=False, covered=False)
+
+    def _merge_listings(self, records: list, jan_records: list) -> list:
+        """ジャンル検索の結果にJAN検索の結果を商品URLで重複を除いて加える"""
+        seen = {record["url"] for record in records}
+        extra = [record for record in jan_records if record["url"] not in seen]
+        if extra:
+            logger.info(f"[JAN検索] ジャンル検索になかった{len(extra)}件を追加")
+        return records + extra
+
+    def _remember_product(self, shop_code: str, item_id: str, product: dict):
+        self.item_cache.set((shop_code, item_id), dict(product))
+        self.product_index.add_product(product)
+
+    def _finish_competitors(self, competitors: list, jan: str = "") -> list:
+        """自社商品と同じJAN・JANありを優先して並べ替える"""
+        jan_count = sum(1 for c in competitors if c.jan)
+        same_jan = sum(1 for c in competitors if jan and c.jan == jan)
+        logger.info(f"[結果] {jan_count}/{len(competitors)}件 でJAN取得成功（同じJAN {same_jan}件）",
+                    extra={"jan_count": jan_count, "same_jan": same_jan, "competitors": len(competitors)})
+
+        competitors.sort(key=competitor_order(jan))
+        return competitors
+
+    def _log_competitor_query(self, category_id: str, price_min: int,
+                                price_max: int, exclude_shop: str, pages: int = 1):
+        logger.info(f"[競合検索] カテゴリID:{category_id} 価格帯:¥{price_min:,}〜¥{price_max:,} "
+                    f"除外ショップ:{exclude_shop} ページ数:{pages}",
+                    extra={"category_id": category_id, "price_min": price_min, "price_max": price_max,
+                           "exclude_shop": exclude_shop, "pages": pages})
+
+
+class RakutenAPI(_RakutenBase):
+    """同期版クライアント（スクリプト用）"""
+
+    def _extract_jan_full(self, item: dict, scrape_if_missing: bool = False) -> tuple[str, str]:
+        """4つの方法でJANコードを探す"""
+        jan, jan_source = self._extract_jan_offline(item)
+        if jan:
+            return (jan, jan_source)
+
+        item_url = item.get("itemUrl", "") or item.get("url", "")
+        if scrape_if_missing and item_url:
+            cached = self.jan_cache.get(item_url)
+            if cached is not None:
+                return cached
+            scraped_jan = self._scrape_jan_from_page(item_url)
+            self._store_scraped_jan(item_url, scraped_jan)
+            if scraped_jan:
+                return (scraped_jan, "スクレイピング")
+
+        return ("", "")
+
+    @contextmanager
+    def _open_page(self, url: str, timeout: float):
+        """商品ページを開く（保存済みなら条件付きリクエストにし、304なら保存分を返す）"""
+        headers = dict(HEADERS, **self.page_store.validators(url))
+        with self.scrape_pool.session.get(self._page_url(url), headers=headers,
+                                          timeout=timeout, stream=True) as response:
+            if response.status_code == 304:
+                stored = self._stored_page(url)
+                if stored is None:
+                    raise requests.HTTPError("保存済みのページがありません", response=response)
+                yield stored
+                return
+            response.raise_for_status()
+            # charset の指定がなければ None（<meta> や UTF-8 として読む）
+            content_type = response.headers.get("content-type", "").lower()
+            body = _PageBody(response.iter_content(chunk_size=SCAN_CHUNK_SIZE),
+                             response.encoding if "charset" in content_type else None,
+                             self.page_store.max_page_bytes)
+            yield body
+        self._record_page(url, body, response.headers)
+
+    def _scrape_jan_from_page(self, url: str, timeout: float = 5) -> str | None:
+        """商品ページをスクレイピングしてJANコードを取得（取得失敗時は None）"""
+        start = time.perf_counter()
+        overloaded = False
         try:
-            response = requests.get(url, params=params)
+            with self._open_page(url, timeout) as body:
+                # ラベル付きJANが見つかった時点で受信を打ち切る
+                scanner = JanScanner()
+                for chunk in body:
+                    if scanner.feed(chunk):
+                        break
+                jan = scanner.result(body.encoding)
+            SCRAPES.inc(result="found" if jan else "not_found")
+            return jan
+        except Exception as e:
+            overloaded = self._page_failed(e)
+        finally:
+            self._page_finished(start, overloaded)
+        return None
+
+    def _scrape_in_pool(self, url: str, deadline: float) -> str | None:
+        """共有プールの枠を取ってからスクレイピング（期限までに枠が空かなければ None）"""
+        if time.monotonic() >= deadline:
+            return None
+        with self.scrape_pool.slot_sync(timeout=max(0.0, deadline - time.monotonic())):
+            return self._scrape_jan_from_page(url, timeout=self.scrape_pool.page_timeout(deadline))
+
+    def _fetch_seed_page(self, shop_code: str, item_id: str) -> SeedPage:
+        """自社商品ページを1回だけ取得し、タイトル（商品名・ショップ名）とJANを読み取る"""
+        url = ITEM_PAGE_URL.format(shop_code=shop_code, item_id=item_id)
+        page = SeedPage()
+        start = time.perf_counter()
+        overloaded = False
+        try:
+            with self._open_page(url, 5) as body:
+                scan = _SeedScan()
+                for chunk in body:
+                    if scan.feed(chunk, body.encoding):
+                        break
+                page = scan.page(body.encoding)
+            SCRAPES.inc(result="found" if page.jan else "not_found")
+            self._store_scraped_jan(url, page.jan)
+        except Exception as e:
+            overloaded = self._page_failed(e)
+        finally:
+            self._page_finished(start, overloaded)
+        return page
+
+    def _api_get(self, params: dict) -> dict:
+        """レートリミッター経由で商品検索APIを呼び出す（429/5xxはリトライ）"""
+        for attempt in range(MAX_RETRIES + 1):
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
+            try:
+                response = requests.get(self.search_url, params=params, timeout=10)
+            except requests.RequestException:
+                API_REQUESTS.inc(status="error")
+                raise
+            finally:
+                API_SECONDS.observe(time.perf_counter() - start)
+            API_REQUESTS.inc(status=response.status_code)
+            if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+                delay = self.rate_limiter.retry_delay(
+                    response.status_code, response.headers.get("Retry-After"), attempt)
+                logger.warning(f"[API] {response.status_code} → {delay:.1f}秒後にリトライ")
+                time.sleep(delay)
+                continue
             response.raise_for_status()
-            data = response.json()
-            items = data.get("Items", [])
-            
-            print(f"検索結果: {len(items)}件")
-            
-            competitors = []
-            items_to_scrape = []
-            
-            for item_data in items:
-                item = item_data["Item"]
-                if item.get("shopCode", "") != exclude_shop:
-                    jan, jan_source = self._extract_jan_full(item, scrape_if_missing=False)
-                    if jan:
-                        print(f"[JAN取得] {jan} ← {jan_source}")
-                    
-                    competitor = {
-                        "name": item.get("itemName", ""),
-                        "price": item.get("itemPrice", 0),
-                        "image": item.get("mediumImageUrls", [{}])[0].get("imageUrl", "") if item.get("mediumImageUrls") else "",
-                        "jan": jan,
-                        "janSource": jan_source,
-                        "url": item.get("itemUrl", ""),
-                        "shop": item.get("shopName", "")
-                    }
-                    competitors.append(competitor)
-                    if not jan:
-                        items_to_scrape.append(competitor)
-            
+            return response.json()
+
+    def get_item(self, shop_code: str, item_id: str) -> dict | None:
+        """ショップコードと商品IDで商品を検索（結果は一定時間キャッシュ）"""
+        cached = self.item_cache.get((shop_code, item_id))
+        if cached is not None:
+            logger.info(f"[キャッシュ] 商品情報: {cached['name'][:40]}")
+            return dict(cached)
+
+        product = self._lookup_item(shop_code, item_id)
+        if product:
+            self._remember_product(shop_code, item_id, product)
+        return product
+
+    def _lookup_item(self, shop_code: str, item_id: str) -> dict | None:
+        """APIと商品ページから商品を探す（商品ページの取得は1回まで）"""
+        stages: dict[str, float] = {}
+
+        def timed(stage: str, func, *args):
+            start = time.perf_counter()
+            try:
+                with span(stage, shop=shop_code, item=item_id):
+                    return func(*args)
+            finally:
+                stages[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+        def search(keyword: str) -> list:
+            try:
+                return self._api_get(self._seed_params(shop_code, keyword)).get("Items", [])
+            except requests.RequestException as e:
+                logger.warning(f"[API] エラー: {e}")
+                return []
+
+        page = SeedPage()
+        cached = self.jan_cache.get(ITEM_PAGE_URL.format(shop_code=shop_code, item_id=item_id))
+        if cached is not None:
+            page.jan, page.scanned = cached[0], True
+        fetched = False
+
+        try:
+            # 方法1: ショップ + 商品ID でキーワード検索
+            items = timed("item_api_search", search, item_id)
+            logger.info(f"[API検索1] ショップ:{shop_code} キーワード:{item_id} → {len(items)}件")
+            item, exact = self._pick_seed(shop_code, item_id, page, {"item_id": items})
+
+            if item is not None:
+                logger.info(f"[API] ✓ URLマッチ: {item.get('itemName', '')[:40]}...")
+            else:
+                # 方法2: ページのJAN・タイトルの商品名で検索
+                logger.info("[フォールバック] 商品ページのJAN・タイトルで再検索...")
+                page = timed("item_page_fetch", self._fetch_seed_page, shop_code, item_id)
+                fetched = True
+                keys = self._seed_keys(page)
+                results = {key: timed(f"item_api_search_{key}", search, value) for key, value in keys.items()}
+                item, exact = self._pick_seed_fallback(shop_code, item_id, page, keys, results)
+                if item is None:
+                    return None
+
+            product = self._seed_product(item, page, exact)
+            if product is None and exact:
+                if not fetched:
+                    page = timed("item_page_fetch", self._fetch_seed_page, shop_code, item_id)
+                # 取得に失敗していてもページは取り直さない
+                product = self._seed_product(item, page, exact) or self._build_product(item, "", "")
+            if product is None:
+                # 類似商品は別のページなので、その商品のJANを従来どおり探す
+                product = timed("item_similar_jan", self._parse_item, item, True)
+            return product
+        finally:
+            self._log_seed_stages(shop_code, item_id, stages)
+
+    def _parse_item(self, item: dict, scrape_jan: bool = False) -> dict:
+        """APIレスポンスから商品情報を抽出"""
+        with span("item_jan_extract"):
+            jan, jan_source = self._extract_jan_full(item, scrape_if_missing=scrape_jan)
+        return self._build_product(item, jan, jan_source)
+
+    def search_competitors(self, category_id: str, price_min: int,
+                          price_max: int, exclude_shop: str) -> list:
+        """同カテゴリの競合商品を検索"""
+        params = self._competitor_params(category_id, price_min, price_max)
+        self._log_competitor_query(category_id, price_min, price_max, exclude_shop)
+
+        try:
+            records, source = self._known_listing(category_id, price_min, price_max, 1)
+            if records is None:
+                data = self._api_get(params)
+                items = data.get("Items", [])
+                records = self._listing_records(items)
+                self._remember_listing(category_id, price_min, price_max, 1, records,
+                                       complete=data.get("count", 0) <= len(items))
+                logger.info(f"[競合検索] 検索結果: {len(items)}件")
+            else:
+                logger.info(f"[競合検索] 検索結果: {len(records)}件（{source}）")
+
+            competitors, items_to_scrape = self._build_competitors(records, exclude_shop)
+
+            items_to_scrape = self._apply_cached_jans(items_to_scrape)
+
             if items_to_scrape:
-                print(f"\n[スクレイピング] {len(items_to_scrape)}件のページをスキャン中...")
-                with ThreadPoolExecutor(max_workers=5) as executor:
-                    future_to_item = {
-                        executor.submit(self._scrape_jan_from_page, item["url"]): item 
-                        for item in items_to_scrape
-                    }
-                    for future in as_completed(future_to_item):
+                logger.info(f"[スクレイピング] {len(items_to_scrape)}件のページをスキャン中...")
+                deadline = self.scrape_pool.deadline()
+                future_to_item = {
+                    self.scrape_pool.executor.submit(self._scrape_in_pool, item.url, deadline): item
+                    for item in items_to_scrape
+                }
+                try:
+                    for future in as_completed(future_to_item, timeout=max(0.0, deadline - time.monotonic())):
                         item = future_to_item[future]
                         try:
                             jan = future.result()
-                            if jan:
-                                item["jan"] = jan
-                                item["janSource"] = "スクレイピング"
-                                print(f"[JAN取得] {jan} ← スクレイピング")
+                            self._store_scraped_jan(item.url, jan)
+                            self._apply_scraped_jan(item, jan)
                         except:
                             pass
-            
-            jan_count = sum(1 for c in competitors if c["jan"])
-            print(f"\n=== 結果: {jan_count}/{len(competitors)}件 でJAN取得成功 ===\n")
-            
-            competitors.sort(key=lambda x: (x["jan"] == "", x["name"]))
-            return competitors
-            
+                except FuturesTimeoutError:
+                    skipped = [f for f in future_to_item if not f.done()]
+                    for future in skipped:
+                        future.cancel()
+                    SCRAPES.inc(len(skipped), result="deadline")
+                    logger.warning(f"[スクレイピング] 期限切れ: {len(skipped)}件は打ち切り")
+
+            return self._finish_competitors(competitors)
+
         except requests.RequestException as e:
-            print(f"API Error: {e}")
+            logger.error(f"[競合検索] APIエラー: {e}")
+        return []
+
+
+class AsyncRakutenAPI(_RakutenBase):
+    """非同期版クライアント（FastAPI用）
+
+    httpx.AsyncClient を1つ使い回し、API呼び出しとスクレイピングの
+    コネクションをプールする。イベントループをブロックしない。
+    """
+
+    def __init__(self, jan_cache: JanCache | None = None,
+                 rate_limiter: RateLimiter | None = None,
+                 scrape_pool: ScrapePool | None = None,
+                 product_index: ProductIndex | None = None,
+                 page_store: PageStore | None = None,
+                 max_connections: int | None = None):
+        super().__init__(jan_cache, rate_limiter, scrape_pool, product_index, page_store)
+        # スクレイピングの上限いっぱいまで並べてもAPI呼び出し分の接続が残るようにする
+        self.max_connections = max_connections or self.scrape_pool.max_limit + 8
+        self._client: httpx.AsyncClient | None = None
+        # 検索の応答後も続けている処理（待ちきれなかったJAN検索）
+        self._background: set[asyncio.Task] = set()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """共有HTTPクライアント（初回アクセス時に生成）"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=HEADERS,
+                timeout=httpx.Timeout(10.0),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+                follow_redirects=True,
+            )
+        return self._client
+
+    async def aclose(self):
+        """HTTPクライアントを閉じる"""
+        for task in list(self._background):
+            task.cancel()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    # キャッシュ（共有先）・商品インデックスの読み書きは、イベントループを止めないようスレッドで行う
+
+    async def _apply_cached_jans(self, items_to_scrape: list) -> list:
+        return await asyncio.to_thread(super()._apply_cached_jans, items_to_scrape)
+
+    async def _store_scraped_jan(self, url: str, jan: str | None):
+        if jan is not None:
+            await asyncio.to_thread(super()._store_scraped_jan, url, jan)
+
+    async def _stored_page(self, url: str) -> _PageBody | None:
+        return await asyncio.to_thread(super()._stored_page, url)
+
+    async def _record_page(self, url: str, body: _PageBody, headers):
+        await asyncio.to_thread(super()._record_page, url, body, headers)
+
+    async def _known_listing(self, category_id: str, price_min: int, price_max: int,
+                             pages: int) -> tuple[list | None, str]:
+        return await asyncio.to_thread(super()._known_listing, category_id, price_min, price_max, pages)
+
+    async def _remember_listing(self, category_id: str, price_min: int, price_max: int, pages: int,
+                                records: list, complete: bool, covered: bool = True):
+        await asyncio.to_thread(super()._remember_listing, category_id, price_min, price_max, pages,
+                                records, complete, covered)
+
+    async def _remember_jan_listing(self, jan: str, pages: int, records: list, complete: bool,
+                                    covered: bool):
+        await asyncio.to_thread(super()._remember_jan_listing, jan, pages, records, complete, covered)
+
+    async def _remember_product(self, shop_code: str, item_id: str, product: dict):
+        await asyncio.to_thread(super()._remember_product, shop_code, item_id, product)
+
+    async def _extract_jan_full(self, item: dict, scrape_if_missing: bool = False) -> tuple[str, str]:
+        """4つの方法でJANコードを探す"""
+        jan, jan_source = self._extract_jan_offline(item)
+        if jan:
+            return (jan, jan_source)
+
+        item_url = item.get("itemUrl", "") or item.get("url", "")
+        if scrape_if_missing and item_url:
+            cached = await self.jan_cache.get_async(item_url)
+            if cached is not None:
+                return cached
+            scraped_jan = await self._scrape_jan_from_page(item_url)
+            await self._store_scraped_jan(item_url, scraped_jan)
+            if scraped_jan:
+                return (scraped_jan, "スクレイピング")
+
+        return ("", "")
+
+    @asynccontextmanager
+    async def _open_page(self, url: str, timeout: float):
+        """商品ページを開く（保存済みなら条件付きリクエストにし、304なら保存分を返す）
+
+        保存分の読み書き（SQLite・圧縮）はスレッドで行う
+        """
+        validators = await asyncio.to_thread(self.page_store.validators, url)
+        async with self.client.stream("GET", self._page_url(url), timeout=timeout,
+                                      headers=validators) as response:
+            if response.status_code == 304:
+                stored = await self._stored_page(url)
+                if stored is None:
+                    raise httpx.HTTPStatusError("保存済みのページがありません",
+                                                request=response.request, response=response)
+                yield stored
+                return
+            response.raise_for_status()
+            body = _PageBody(response.aiter_bytes(SCAN_CHUNK_SIZE), response.charset_encoding,
+                             self.page_store.max_page_bytes)
+            yield body
+        await self._record_page(url, body, response.headers)
+
+    async def _scrape_jan_from_page(self, url: str, timeout: float = 5) -> str | None:
+        """商品ページをスクレイピングしてJANコードを取得（取得失敗時は None）"""
+        start = time.perf_counter()
+        overloaded = False
+        try:
+            async with self._open_page(url, timeout) as body:
+                # ラベル付きJANが見つかった時点で受信を打ち切る
+                scanner = JanScanner()
+                async for chunk in body:
+                    if scanner.feed(chunk):
+                        break
+                jan = scanner.result(body.encoding)
+            SCRAPES.inc(result="found" if jan else "not_found")
+            return jan
+        except asyncio.CancelledError:
+            # 期限切れで打ち切った分は応答時間として数えない
+            overloaded = None
+            raise
+        except Exception as e:
+            overloaded = self._page_failed(e)
+        finally:
+            self._page_finished(start, overloaded)
+        return None
+
+    async def _fetch_seed_page(self, shop_code: str, item_id: str) -> SeedPage:
+        """自社商品ページを1回だけ取得し、タイトル（商品名・ショップ名）とJANを読み取る"""
+        url = ITEM_PAGE_URL.format(shop_code=shop_code, item_id=item_id)
+        page = SeedPage()
+        start = time.perf_counter()
+        overloaded = False
+        try:
+            async with self._open_page(url, 5) as body:
+                scan = _SeedScan()
+                async for chunk in body:
+                    # タイトルとラベル付きJANがそろえば残りは受信しない
+                    if scan.feed(chunk, body.encoding):
+                        break
+                page = scan.page(body.encoding)
+            SCRAPES.inc(result="found" if page.jan else "not_found")
+            await self._store_scraped_jan(url, page.jan)
+        except asyncio.CancelledError:
+            overloaded = None
+            raise
+        except Exception as e:
+            overloaded = self._page_failed(e)
+        finally:
+            self._page_finished(start, overloaded)
+        return page
+
+    async def _api_get(self, params: dict, sent: asyncio.Event | None = None) -> dict:
+        """レートリミッター経由で商品検索APIを呼び出す（429/5xxはリトライ）
+
+        sent を渡すと、最初の送信枠が取れた（リクエストを送る）時点でセットする。
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            await self.rate_limiter.acquire_async()
+            if sent is not None:
+                sent.set()
+            start = time.perf_counter()
+            try:
+                response = await self.client.get(self.search_url, params=params)
+            except httpx.HTTPError:
+                API_REQUESTS.inc(status="error")
+                raise
+            finally:
+                API_SECONDS.observe(time.perf_counter() - start)
+            API_REQUESTS.inc(status=response.status_code)
+            if response.status_code in RETRY_STATUS and attempt < MAX_RETRIES:
+                delay = await self.rate_limiter.retry_delay_async(
+                    response.status_code, response.headers.get("Retry-After"), attempt)
+                logger.warning(f"[API] {response.status_code} → {delay:.1f}秒後にリトライ")
+                await asyncio.sleep(delay)
+                continue
+            response.raise_for_status()
+            return response.json()
+
+    async def get_item(self, shop_code: str, item_id: str) -> dict | None:
+        """ショップコードと商品IDで商品を検索（結果は一定時間キャッシュ）"""
+        cached = await self.item_cache.get_async((shop_code, item_id))
+        if cached is not None:
+            logger.info(f"[キャッシュ] 商品情報: {cached['name'][:40]}")
+            return dict(cached)
+
+        product = await self._lookup_item(shop_code, item_id)
+        if product:
+            await self._remember_product(shop_code, item_id, product)
+        return product
+
+    async def _lookup_item(self, shop_code: str, item_id: str) -> dict | None:
+        """APIと商品ページから商品を探す
+
+        商品ページは1回だけ取得し、商品IDでのAPI検索と並行して進める
+        （タイトル・ショップ名・JANは同じ受信内容から読む）。
+        商品IDで見つからなければ、ページのJAN・商品名をキーにして同時に検索し直す。
+        段階ごとの所要時間はメトリクス（span）とログに出す。
+        """
+        stages: dict[str, float] = {}
+
+        async def timed(stage: str, awaitable):
+            start = time.perf_counter()
+            try:
+                with span(stage, shop=shop_code, item=item_id):
+                    return await awaitable
+            finally:
+                stages[stage] = round((time.perf_counter() - start) * 1000, 1)
+
+        async def search(keyword: str) -> list:
+            try:
+                data = await self._api_get(self._seed_params(shop_code, keyword))
+                return data.get("Items", [])
+            except httpx.HTTPError as e:
+                logger.warning(f"[API] エラー: {e}")
+                return []
+
+        page = SeedPage()
+        page_task: asyncio.Future | None = None
+        cached = await self.jan_cache.get_async(ITEM_PAGE_URL.format(shop_code=shop_code, item_id=item_id))
+        if cached is not None:
+            page.jan, page.scanned = cached[0], True
+        else:
+            # APIにJANがないことが多いので、APIの順番待ちの間にページを取得しておく
+            page_task = asyncio.ensure_future(timed("item_page_fetch", self._fetch_seed_page(shop_code, item_id)))
+
+        try:
+            # 方法1: ショップ + 商品ID でキーワード検索
+            items = await timed("item_api_search", search(item_id))
+            logger.info(f"[API検索1] ショップ:{shop_code} キーワード:{item_id} → {len(items)}件")
+            item, exact = self._pick_seed(shop_code, item_id, page, {"item_id": items})
+
+            if item is not None:
+                logger.info(f"[API] ✓ URLマッチ: {item.get('itemName', '')[:40]}...")
+            else:
+                # 方法2: ページのJAN・タイトルの商品名で同時に検索
+                logger.info("[フォールバック] 商品ページのJAN・タイトルで再検索...")
+                if page_task is None:
+                    page_task = asyncio.ensure_future(
+                        timed("item_page_fetch", self._fetch_seed_page(shop_code, item_id)))
+                page = await page_task
+                keys = self._seed_keys(page)
+                found = await asyncio.gather(*(timed(f"item_api_search_{key}", search(value))
+                                               for key, value in keys.items()))
+                item, exact = self._pick_seed_fallback(shop_code, item_id, page, keys, dict(zip(keys, found)))
+                if item is None:
+                    return None
+
+            product = self._seed_product(item, page, exact)
+            if product is None and exact and page_task is not None:
+                page = await page_task
+                # 取得に失敗していてもページは取り直さない
+                product = self._seed_product(item, page, exact) or self._build_product(item, "", "")
+            if product is None:
+                # 類似商品は別のページなので、その商品のJANを従来どおり探す
+                product = await timed("item_similar_jan", self._parse_item(item, scrape_jan=True))
+            return product
+        finally:
+            if page_task is not None and not page_task.done():
+                page_task.cancel()
+            self._log_seed_stages(shop_code, item_id, stages)
+
+    async def _parse_item(self, item: dict, scrape_jan: bool = False) -> dict:
+        """APIレスポンスから商品情報を抽出"""
+        with span("item_jan_extract"):
+            jan, jan_source = await self._extract_jan_full(item, scrape_if_missing=scrape_jan)
+        return self._build_product(item, jan, jan_source)
+
+    async def iter_scraped_jans(self, items_to_scrape: list,
+                                deadline: float | None = None) -> AsyncIterator[Competitor]:
+        """JANのない競合の商品ページを並列スクレイピングし、完了した順に返す
+
+        同時実行数はプロセス共有のプールで決まる。deadline（time.monotonic 基準、
+        省略時は SCRAPE_DEADLINE 秒後）を過ぎたら、残りは打ち切ってそこまでの結果で終える。
+        """
+        if deadline is None:
+            deadline = self.scrape_pool.deadline()
+
+        async def scrape(item: Competitor) -> Competitor:
+            async with self.scrape_pool.slot():
+                jan = await self._scrape_jan_from_page(
+                    item.url, timeout=self.scrape_pool.page_timeout(deadline))
+            await self._store_scraped_jan(item.url, jan)
+            self._apply_scraped_jan(item, jan)
+            return item
+
+        tasks = [asyncio.ensure_future(scrape(item)) for item in items_to_scrape]
+        try:
+            for future in asyncio.as_completed(tasks, timeout=max(0.0, deadline - time.monotonic())):
+                yield await future
+        except asyncio.TimeoutError:
+            skipped = sum(1 for task in tasks if not task.done())
+            SCRAPES.inc(skipped, result="deadline")
+            logger.warning(f"[スクレイピング] 期限切れ: {skipped}件は打ち切り",
+                           extra={"skipped": skipped, "total": len(tasks)})
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _iter_pages(self, params_for_page, pages: int, prefetch: int = 3,
+                          sent: asyncio.Event | None = None) -> AsyncIterator[dict]:
+        """検索結果（APIレスポンス）を1ページずつ返す
+
+        params_for_page(page) でそのページの検索パラメータを作る。
+        1ページ目で総ページ数を確認し、2ページ目以降は prefetch 件ずつ先行して
+        リクエストを出しておく（実際の送信間隔はレートリミッターが調整する）。
+        受け取ったページはその場で返すので、全ページ分のレスポンスは保持しない。
+        sent は1ページ目のリクエストを送る時点でセットする（_api_get）。
+        """
+        pages = max(1, min(pages, MAX_PAGES))
+        data = await self._api_get(params_for_page(1), sent)
+        yield data
+
+        last_page = min(pages, data.get("pageCount", 1))
+        if last_page < 2:
+            return
+
+        in_flight: list[asyncio.Task] = []
+        next_page = 2
+        try:
+            while next_page <= last_page or in_flight:
+                while next_page <= last_page and len(in_flight) < prefetch:
+                    in_flight.append(asyncio.ensure_future(self._api_get(params_for_page(next_page))))
+                    next_page += 1
+                task = in_flight.pop(0)
+                try:
+                    yield await task
+                except httpx.HTTPError as e:
+                    # 途中のページが失敗しても取得済みの結果は使う
+                    logger.warning(f"[API] ページ取得エラー: {e}")
+        finally:
+            for task in in_flight:
+                task.cancel()
+
+    async def iter_competitor_pages(self, category_id: str, price_min: int,
+                                    price_max: int, pages: int = 1,
+                                    prefetch: int = 3) -> AsyncIterator[dict]:
+        """同カテゴリ・価格帯の検索結果（APIレスポンス）を1ページずつ返す"""
+        async for data in self._iter_pages(
+                lambda page: self._competitor_params(category_id, price_min, price_max, page),
+                pages, prefetch):
+            yield data
+
+    async def _fetch_listing(self, params_for_page, pages: int,
+                             sent: asyncio.Event | None = None) -> tuple[list, int, bool, bool]:
+        """複数ページの検索結果を商品URLで重複を除いてレコードにする
+
+        Returns:
+            (レコードのリスト, 受け取った件数, 該当件数をすべて取得できたか, 全ページ揃ったか)
+        """
+        records = []
+        seen = set()
+        total = 0
+        count = 0
+        received = 0
+        expected = 1
+        async for data in self._iter_pages(params_for_page, pages, sent=sent):
+            items = data.get("Items", [])
+            total += len(items)
+            received += 1
+            if received == 1:
+                count = data.get("count", 0)
+                expected = max(1, min(pages, MAX_PAGES, data.get("pageCount", 1)))
+            records.extend(self._listing_records(items, seen))
+        return records, total, count <= total, received >= expected
+
+    async def _genre_listing(self, category_id: str, price_min: int, price_max: int,
+                             pages: int, sent: asyncio.Event | None = None,
+                             strict: bool = False) -> list | None:
+        """同カテゴリ・価格帯の検索結果（APIエラーなら None、strict ならエラーを送出）
+
+        sent は1ページ目のリクエストを送った時点（APIを呼ばない・失敗したときは終わった時点）でセットする。
+        """
+        try:
+            records, source = await self._known_listing(category_id, price_min, price_max, pages)
+            if records is not None:
+                logger.info(f"[競合検索] 検索結果: {len(records)}件（{source}）")
+                return records
+            try:
+                records, total, complete, covered = await self._fetch_listing(
+                    lambda page: self._competitor_params(category_id, price_min, price_max, page),
+                    pages, sent)
+            except httpx.HTTPError as e:
+                logger.error(f"[競合検索] APIエラー: {e}")
+                if strict:
+                    raise
+                return None
+        finally:
+            if sent is not None:
+                sent.set()
+        # 途中のページが欠けた結果は検索済みとして使い回さない（商品の蓄積だけ行う）
+        # 該当件数をすべて取得できていれば、内側の価格帯にも使い回せる
+        await self._remember_listing(category_id, price_min, price_max, pages, records,
+                                     complete=complete, covered=covered)
+        logger.info(f"[競合検索] 検索結果: {total}件（重複除外後 {len(records)}件）")
+        return records
+
+    async def _jan_listing(self, jan: str, pages: int, after: asyncio.Event | None = None,
+                           strict: bool = False) -> list:
+        """JANコードをキーワードに全ショップを検索する（同じJAN・JAN未確認の商品のみ、APIエラーなら空、
+        strict ならエラーを送出）
+
+        after を渡すと、キャッシュになかったときはそれがセットされるまでAPIを呼ばない
+        （ジャンル検索の1ページ目より先に送信枠を取らないため）。
+        """
+        records = await self.listing_cache.get_async(f"jan:{jan}", 0, 0, pages)
+        if records is not None:
+            JAN_SEARCHES.inc(result="cache")
+            logger.info(f"[JAN検索] {jan}: 検索結果 {len(records)}件（キャッシュ）")
+            return records
+        if after is not None:
+            await after.wait()
+        try:
+            with span("competitor_jan_search"):
+                records, total, complete, covered = await self._fetch_listing(
+                    lambda page: self._jan_params(jan, page), pages)
+        except httpx.HTTPError as e:
+            JAN_SEARCHES.inc(result="error")
+            logger.warning(f"[JAN検索] APIエラー: {e}")
+            if strict:
+                raise
+            return []
+        records = self._jan_matches(records, jan)
+        await self._remember_jan_listing(jan, pages, records, complete=complete, covered=covered)
+        JAN_SEARCHES.inc(result="api")
+        logger.info(f"[JAN検索] {jan}: 検索結果 {total}件（同じJAN・JAN未確認 {len(records)}件）")
+        return records
+
+    async def _wait_jan_listing(self, task: asyncio.Task, wait: float | None) -> list:
+        """ジャンル検索のあと、JAN検索を最大 wait 秒待つ（None なら終わるまで待つ）
+
+        wait が 0 でも、キャッシュから返せる分が終わるよう一度だけ順番を譲る。
+        """
+        if not task.done():
+            await asyncio.wait({task}, timeout=wait)
+        if task.done():
+            return task.result()
+        # 間に合わなかった分は止めずにキャッシュまで済ませる（次の検索・エクスポートで使う）
+        JAN_SEARCHES.inc(result="late")
+        logger.info(f"[JAN検索] ジャンル検索の時点で終わっていないため、今回はジャンル検索の結果のみ使います"
+                    f"（待ち時間 {wait}秒）")
         return []
+
+    async def find_competitors(self, category_id: str, price_min: int,
+                               price_max: int, exclude_shop: str,
+                               pages: int = 1, jan: str = "",
+                               wait_for_jan: bool = False, strict: bool = False) -> tuple[list, list]:
+        """API検索とキャッシュだけで競合一覧を作る
+
+        jan（自社商品のJAN）を渡すと、ジャンル検索と並行してJANコードでも全ショップを検索し、
+        別のジャンルで出品されている同じ商品も商品URLで重複を除いて加える。
+        JAN検索のAPI呼び出しはジャンル検索の1ページ目を送ってから並べるので、ジャンル検索を遅らせない。
+
+        Args:
+            pages: 取得するページ数（1ページ30件、2以上で複数ページを取得）
+            wait_for_jan: True ならJAN検索が終わるまで待つ
+                （False ならジャンル検索のあと最大 JAN_SEARCH_WAIT 秒まで。デフォルトは待たない）
+            strict: True ならAPIエラーを握りつぶさず送出する（欠けた結果を完了扱いにしない一括処理用）
+
+        Returns:
+            (同じJAN・JANあり優先で並べた競合一覧, スクレイピングが必要な競合)
+        """
+        self._log_competitor_query(category_id, price_min, price_max, exclude_shop, pages)
+
+        genre_sent = asyncio.Event()
+        genre_task = asyncio.ensure_future(
+            self._genre_listing(category_id, price_min, price_max, pages, sent=genre_sent, strict=strict))
+        jan_task = None
+        if jan and self._is_valid_jan(jan):
+            jan_task = asyncio.ensure_future(
+                self._jan_listing(jan, pages, after=genre_sent, strict=strict))
+            self._background.add(jan_task)
+            jan_task.add_done_callback(self._background.discard)
+
+        try:
+            records = await genre_task
+        except httpx.HTTPError:
+            if jan_task is not None:
+                jan_task.cancel()
+            raise
+        jan_records = await self._wait_jan_listing(
+            jan_task, None if wait_for_jan else self.jan_search_wait) if jan_task else []
+        if records is None and not jan_records:
+            return [], []
+        records = self._merge_listings(records or [], jan_records)
+
+        competitors, items_to_scrape = self._build_competitors(records, exclude_shop)
+        items_to_scrape = await self._apply_cached_jans(items_to_scrape)
+        competitors.sort(key=competitor_order(jan))
+        return competitors, items_to_scrape
+
+    async def warm_competitors(self, category_id: str, price_min: int, price_max: int,
+                               pages: int = 1, jan: str = ""):
+        """競合検索（ジャンル検索・JAN検索）のAPI結果だけを取得してキャッシュに入れる（先読み用）
+
+        競合一覧は組み立てないので、競合数・JANの取得元のメトリクスには数えない
+        （実際の検索でキャッシュから使われたときに数える）。
+        """
+        genre_sent = asyncio.Event()
+        listings = [self._genre_listing(category_id, price_min, price_max, pages, sent=genre_sent)]
+        if jan and self._is_valid_jan(jan):
+            listings.append(self._jan_listing(jan, pages, after=genre_sent))
+        await asyncio.gather(*listings)
+
+    async def find_by_jan(self, jan: str) -> list:
+        """JANコードで全ショップを検索し、同じJANの商品を価格の安い順に返す"""
+        data = await self._api_get(self._jan_params(jan))
+        records = [record for record in self._listing_records(data.get("Items", []))
+                   if record["jan"] == jan]
+        await asyncio.to_thread(self.product_index.add_listing, "", 0, 0, 1, records,
+                                complete=False, covered=False)
+        records.sort(key=lambda record: record["price"])
+        return records
+
+    async def search_competitors(self, category_id: str, price_min: int,
+                                 price_max: int, exclude_shop: str,
+                                 pages: int = 1, jan: str = "", strict: bool = False) -> list:
+        """同カテゴリ（と jan があれば同じJAN）の競合商品を検索
+
+        画面を待たせない一括処理・監視用なので、JAN検索は終わるまで待つ
+        strict なら検索APIのエラーを送出する（find_competitors）
+        """
+        competitors, items_to_scrape = await self.find_competitors(
+            category_id, price_min, price_max, exclude_shop, pages, jan=jan, wait_for_jan=True,
+            strict=strict)
+
+        if items_to_scrape:
+            logger.info(f"[スクレイピング] {len(items_to_scrape)}件のページをスキャン中...")
+            async for _ in self.iter_scraped_jans(items_to_scrape):
+                pass
+
+        return self._finish_competitors(competitors, jan)
@@ -0,0 +1,316 @@
+"""
+楽天API用レートリミッター
+
+IchibaItem Search API は1秒1リクエスト程度が上限のため、
+すべてのAPI呼び出しをアプリID単位で共有するトークンバケットに通す。
+
+- 待ち行列は利用者（リクエスト元）ごとに分け、ラウンドロビンで払い出す
+  → 1人が大量に検索しても他の人の検索が後回しにならない
+- 429 を受けたらバケットを空にして全体で待つ
+- 待ち行列の長さ・待ち時間を stats() で公開
+- SHARED_STATE を設定すると、払い出し枠を全ワーカー・全インスタンスで共有する（state.py）
+  待ち行列の公平さはプロセス内で、全体の回数は共有の枠で守る
+
+環境変数:
+- RAKUTEN_API_RATE: 1秒あたりのリクエスト数（デフォルト: 1.0）
+- RAKUTEN_API_BURST: 連続で出せるリクエスト数（デフォルト: 1）
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+
+from metrics import RATE_LIMIT_WAIT
+from state import SharedState, SharedStateError, get_shared_state
+
+logger = logging.getLogger(__name__)
+
+# 現在のリクエスト元（公平なキューイングのキー）
+current_requester: ContextVar[str] = ContextVar("current_requester", default="default")
+
+# リトライ対象のステータスコード
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_RETRIES = 3
+
+
+class _Ticket:
+    __slots__ = ("key", "enqueued_at", "granted")
+
+    def __init__(self, key: str, now: float):
+        self.key = key
+        self.enqueued_at = now
+        self.granted = False
+
+
+class RateLimiter:
+    def __init__(self, rate: float = 1.0, burst: int = 1, shared: SharedState | None = None,
+                 name: str = "ratelimit"):
+        self.rate = rate
+        self.burst = burst
+        # 払い出し枠の共有先（None ならプロセス内のトークンバケットだけで制限する）
+        self.shared = shared
+        self.name = name
+        self._shared_error_at = 0.0
+        # 共有先に問い合わせ中か・次に問い合わせる時刻・429 で止めている期限（time.monotonic 基準）
+        self._taking = False
+        self._shared_retry_at = 0.0
+        self._paused_until = 0.0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._queues: OrderedDict[str, deque[_Ticket]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.wait_seconds_total = 0.0
+        self.max_wait_seconds = 0.0
+        self.throttled = 0
+        self.retries = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated
+        self._updated = now
+        self._tokens = min(float(self.burst), self._tokens + elapsed * self.rate)
+
+    def _take(self, now: float) -> float:
+        """プロセス内のバケットから1つ取る。取れたら 0、取れなければ次の枠までの秒数を返す"""
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    def _grant(self, now: float):
+        """待ち行列の先頭のキーに1つ払い出す（ロック取得済みで呼ぶ）"""
+        key, queue = next(iter(self._queues.items()))
+        ticket = queue.popleft()
+        ticket.granted = True
+        wait = now - ticket.enqueued_at
+        self.requests += 1
+        self.wait_seconds_total += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        RATE_LIMIT_WAIT.observe(wait)
+        # 払い出したキーは末尾へ（ラウンドロビン）
+        del self._queues[key]
+        if queue:
+            self._queues[key] = queue
+
+    def _dispatch(self, now: float) -> float:
+        """プロセス内のバケットで取れる分だけ払い出し、次の枠までの秒数を返す（ロック取得済みで呼ぶ）"""
+        while self._queues:
+            wait = self._take(now)
+            if wait > 0:
+                return wait
+            self._grant(now)
+        return 0.0
+
+    def _enqueue(self, key: str | None) -> _Ticket:
+        ticket = _Ticket(key or current_requester.get(), time.monotonic())
+        with self._lock:
+            self._queues.setdefault(ticket.key, deque()).append(ticket)
+        return ticket
+
+    # --- 共有の払い出し枠 ---
+    # 共有先への問い合わせは通信を伴うので、ロックの外（非同期版はスレッド）で行う。
+    # 同時に問い合わせるのはプロセス内で1つだけにし、取れた枠は待ち行列の順に払い出す。
+
+    def _begin_shared(self, ticket: _Ticket) -> float:
+        """共有先に枠を取りに行くなら 0、行かない（他が問い合わせ中・次の枠待ち）なら待つ秒数"""
+        with self._lock:
+            if ticket.granted:
+                return 0.005
+            if self._taking:
+                return 0.01
+            now = time.monotonic()
+            # 429 で止めている間は共有先の枠も取りに行かない
+            wait = max(self._shared_retry_at, self._paused_until) - now
+            if wait > 0:
+                return wait
+            self._taking = True
+            return 0.0
+
+    def _take_shared(self) -> float | None:
+        """共有先の払い出し枠を1つ取る。取れたら 0、取れなければ次の枠までの秒数、届かなければ None"""
+        try:
+            return self.shared.take_slot(self.name, self.rate, self.burst)
+        except SharedStateError as e:
+            # 共有先が落ちていても止めずに、プロセス内のバケットで制限する
+            now = time.monotonic()
+            if now - self._shared_error_at > 60:
+                logger.warning(f"[レート制限] 共有状態に接続できないためプロセス内で制限します: {e}")
+            self._shared_error_at = now
+            return None
+
+    def _end_shared(self, wait: float | None) -> float:
+        """共有先で取れた枠を払い出し、次に問い合わせるまでの秒数を返す"""
+        with self._lock:
+            self._taking = False
+            now = time.monotonic()
+            if self._paused_until > now:
+                # 問い合わせ中に 429 で止まったら、共有の枠が取れていても払い出さない
+                wait = max(wait or 0.0, self._paused_until - now)
+                self._shared_retry_at = self._paused_until
+            elif wait is None:
+                wait = self._dispatch(now)
+            elif wait > 0:
+                self._shared_retry_at = now + wait
+            elif self._queues:
+                self._grant(now)
+        return max(wait, 0.005)
+
+    def _poll(self, ticket: _Ticket) -> float:
+        if self.shared is None:
+            with self._lock:
+                wait = self._dispatch(time.monotonic())
+            return max(wait, 0.005)
+        wait = self._begin_shared(ticket)
+        if wait > 0:
+            return wait
+        try:
+            slot_wait = self._take_shared()
+        except BaseException:
+            # 取り消されたときは問い合わせ中の印だけ外す
+            with self._lock:
+                self._taking = False
+            raise
+        return self._end_shared(slot_wait)
+
+    async def _poll_async(self, ticket: _Ticket) -> float:
+        if self.shared is None:
+            return self._poll(ticket)
+        wait = self._begin_shared(ticket)
+        if wait > 0:
+            return wait
+        try:
+            slot_wait = await asyncio.to_thread(self._take_shared)
+        except BaseException:
+            # 取り消されたときは問い合わせ中の印だけ外す
+            with self._lock:
+                self._taking = False
+            raise
+        return self._end_shared(slot_wait)
+
+    def _cancel(self, ticket: _Ticket):
+        with self._lock:
+            queue = self._queues.get(ticket.key)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del self._queues[ticket.key]
+
+    def acquire(self, key: str | None = None):
+        """トークンを1つ取得するまでブロックする（同期版）"""
+        ticket = self._enqueue(key)
+        try:
+            while True:
+                wait = self._poll(ticket)
+                if ticket.granted:
+                    return
+                time.sleep(wait)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    async def acquire_async(self, key: str | None = None):
+        """トークンを1つ取得するまで待つ（非同期版。共有先への問い合わせはスレッドで行う）"""
+        ticket = self._enqueue(key)
+        try:
+            while True:
+                wait = await self._poll_async(ticket)
+                if ticket.granted:
+                    return
+                await asyncio.sleep(wait)
+        except BaseException:
+            self._cancel(ticket)
+            raise
+
+    def _throttle(self, status_code: int, retry_after: str | None, attempt: int) -> float:
+        """リトライまでの待ち秒数を決め、429 ならプロセス内の払い出しを止める"""
+        try:
+            delay = float(retry_after) if retry_after else 0.0
+        except ValueError:
+            delay = 0.0
+        if delay <= 0:
+            delay = (2 ** attempt) * (1 + random.random())
+
+        with self._lock:
+            self.retries += 1
+            if status_code == 429:
+                self.throttled += 1
+                # 上限超過はアプリID全体の問題なので、全員の次の払い出しを遅らせる
+                now = time.monotonic()
+                self._refill(now)
+                self._tokens = min(self._tokens, -delay * self.rate)
+                self._paused_until = max(self._paused_until, now + delay)
+        return delay
+
+    def _share_pause(self, delay: float):
+        """429 での一時停止を共有先に伝える（通信するのでロックの外で呼ぶ）"""
+        try:
+            self.shared.pause(self.name, delay)
+        except SharedStateError as e:
+            logger.warning(f"[レート制限] 一時停止を共有できませんでした: {e}")
+
+    def retry_delay(self, status_code: int, retry_after: str | None, attempt: int) -> float:
+        """リトライまでの待ち秒数を決め、429 ならバケット全体を止める"""
+        delay = self._throttle(status_code, retry_after, attempt)
+        if status_code == 429 and self.shared is not None:
+            self._share_pause(delay)
+        return delay
+
+    async def retry_delay_async(self, status_code: int, retry_after: str | None, attempt: int) -> float:
+        """retry_delay の非同期版（共有先への一時停止の書き込みはスレッドで行う）"""
+        delay = self._throttle(status_code, retry_after, attempt)
+        if status_code == 429 and self.shared is not None:
+            await asyncio.to_thread(self._share_pause, delay)
+        return delay
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth = sum(len(q) for q in self._queues.values())
+            return {
+                "rate": self.rate,
+                "queue_depth": depth,
+                "waiting_requesters": len(self._queues),
+                "requests": self.requests,
+                "avg_wait_seconds": self.wait_seconds_total / self.requests if self.requests else 0.0,
+                "max_wait_seconds": self.max_wait_seconds,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "shared": self.shared is not None,
+            }
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(app_id: str | None) -> RateLimiter:
+    """アプリIDごとに共有されるレートリミッターを返す"""
+    key = app_id or ""
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter(
+                rate=float(os.environ.get("RAKUTEN_API_RATE", 1.0)),
+                burst=int(os.environ.get("RAKUTEN_API_BURST", 1)),
+                shared=get_shared_state(),
+                # 共有先のキーにアプリIDそのものは残さない
+                name=f"ratelimit:{hashlib.sha256(key.encode()).hexdigest()[:12]}",
+            )
+        return _limiters[key]
+
+
+def all_rate_limiter_stats() -> dict:
+    """全アプリIDのレートリミッター統計（アプリIDは末尾4文字のみ）"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {f"...{key[-4:]}" if key else "(none)": limiter.stats() for key, limiter in limiters.items()}
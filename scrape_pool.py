@@ -0,0 +1,236 @@
+"""
+商品ページのスクレイピング用の共有プール
+
+プロセス全体で1つの同時実行数の上限を共有し、商品ページの応答時間と
+エラー率に応じて上限を自動で調整する（AIMD）。
+- 応答が目標時間内なら、上限の数だけ完了するごとに上限を1増やす
+- タイムアウト・429・5xx・接続エラー、または目標時間の2倍を超える応答があれば上限を0.7倍にする
+  （連続で下げすぎないよう、下げた後は平均応答時間ぶん間を空ける）
+
+何人が同時に検索しても商品ページへの同時接続数はこの上限に収まり、
+空いていれば1人の検索でも多く並列に取得できる。
+
+環境変数:
+- SCRAPE_CONCURRENCY: 初期の上限（デフォルト: 8）
+- SCRAPE_MIN_CONCURRENCY / SCRAPE_MAX_CONCURRENCY: 上限の範囲（デフォルト: 2 / 32）
+- SCRAPE_TARGET_LATENCY: 1ページの目標応答時間（秒、デフォルト: 1.5）
+- SCRAPE_DEADLINE: 1回の検索でスクレイピングを待つ最大秒数（デフォルト: 20）
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 1ページあたりのタイムアウト（秒）の上限と下限
+PAGE_TIMEOUT = 5.0
+MIN_PAGE_TIMEOUT = 0.5
+
+
+class _Waiter:
+    __slots__ = ("wake", "granted")
+
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+
+
+class ScrapePool:
+    def __init__(self, initial: int | None = None, min_limit: int | None = None,
+                 max_limit: int | None = None, target_latency: float | None = None,
+                 deadline: float | None = None):
+        self.min_limit = min_limit if min_limit is not None else int(
+            os.environ.get("SCRAPE_MIN_CONCURRENCY", 2))
+        self.max_limit = max_limit if max_limit is not None else int(
+            os.environ.get("SCRAPE_MAX_CONCURRENCY", 32))
+        initial = initial if initial is not None else int(os.environ.get("SCRAPE_CONCURRENCY", 8))
+        self.limit = float(min(max(initial, self.min_limit, 1), self.max_limit))
+        self.target_latency = target_latency if target_latency is not None else float(
+            os.environ.get("SCRAPE_TARGET_LATENCY", 1.5))
+        self.default_deadline = deadline if deadline is not None else float(
+            os.environ.get("SCRAPE_DEADLINE", 20))
+
+        self._in_flight = 0
+        self._waiters: deque[_Waiter] = deque()
+        self._lock = threading.Lock()
+        self._latency_ewma: float | None = None
+        self._last_decrease = 0.0
+        self._executor: ThreadPoolExecutor | None = None
+        self._session: requests.Session | None = None
+
+        self.completed = 0
+        self.overloaded = 0
+        self.increases = 0
+        self.decreases = 0
+
+    # --- 同時実行数の枠 ---
+
+    def _grant_waiters(self):
+        """空いた枠を待ち行列の先頭から順に渡す（ロック内で呼ぶ）"""
+        while self._waiters and self._in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            waiter.granted = True
+            self._in_flight += 1
+            waiter.wake()
+
+    def _try_acquire(self, waiter: _Waiter) -> bool:
+        with self._lock:
+            if not self._waiters and self._in_flight < int(self.limit):
+                self._in_flight += 1
+                return True
+            self._waiters.append(waiter)
+            return False
+
+    def _abandon(self, waiter: _Waiter):
+        """待機をやめる。すでに枠を渡されていたら返す"""
+        with self._lock:
+            if not waiter.granted:
+                self._waiters.remove(waiter)
+                return
+        self.release()
+
+    def release(self):
+        with self._lock:
+            self._in_flight -= 1
+            self._grant_waiters()
+
+    async def acquire_async(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = _Waiter(wake)
+        if self._try_acquire(waiter):
+            return
+        try:
+            await future
+        except asyncio.CancelledError:
+            self._abandon(waiter)
+            raise
+
+    def acquire(self, timeout: float | None = None) -> bool:
+        event = threading.Event()
+        waiter = _Waiter(event.set)
+        if self._try_acquire(waiter):
+            return True
+        if event.wait(timeout):
+            return True
+        self._abandon(waiter)
+        return False
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire_async()
+        try:
+            yield
+        finally:
+            self.release()
+
+    @contextmanager
+    def slot_sync(self, timeout: float | None = None):
+        """同期版の枠。timeout までに空かなければ TimeoutError"""
+        if not self.acquire(timeout):
+            raise TimeoutError("スクレイピングの空き待ちがタイムアウトしました")
+        try:
+            yield
+        finally:
+            self.release()
+
+    # --- 上限の自動調整 ---
+
+    def record(self, latency: float, overloaded: bool):
+        """1ページの取得結果を記録して上限を調整する
+
+        overloaded: タイムアウト・429・5xx・接続エラーなど、相手側が詰まっている兆候
+        """
+        now = time.monotonic()
+        with self._lock:
+            self.completed += 1
+            if self._latency_ewma is None:
+                self._latency_ewma = latency
+            else:
+                self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * latency
+
+            if overloaded:
+                self.overloaded += 1
+            if overloaded or latency > self.target_latency * 2:
+                if now - self._last_decrease >= max(self._latency_ewma, 1.0):
+                    self.limit = max(float(self.min_limit), self.limit * 0.7)
+                    self._last_decrease = now
+                    self.decreases += 1
+            elif self._latency_ewma <= self.target_latency and self.limit < self.max_limit:
+                before = int(self.limit)
+                self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+                if int(self.limit) > before:
+                    self.increases += 1
+                    self._grant_waiters()
+
+    # --- 期限 ---
+
+    def deadline(self, seconds: float | None = None) -> float:
+        """今から seconds 秒後の期限（time.monotonic 基準）"""
+        return time.monotonic() + (seconds if seconds is not None else self.default_deadline)
+
+    @staticmethod
+    def page_timeout(deadline: float | None) -> float:
+        """期限までの残り時間に合わせた1ページのタイムアウト"""
+        if deadline is None:
+            return PAGE_TIMEOUT
+        return max(MIN_PAGE_TIMEOUT, min(PAGE_TIMEOUT, deadline - time.monotonic()))
+
+    # --- 同期版クライアント用 ---
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """同期版のスクレイピングで共有するスレッドプール"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_limit,
+                                                    thread_name_prefix="scrape")
+            return self._executor
+
+    @property
+    def session(self) -> requests.Session:
+        """商品ページ取得用の共有セッション（keep-aliveで接続を使い回す）"""
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_limit)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+            return self._session
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "latency_ewma_seconds": self._latency_ewma or 0.0,
+                "completed": self.completed,
+                "overloaded": self.overloaded,
+                "increases": self.increases,
+                "decreases": self.decreases,
+            }
+
+
+_pool: ScrapePool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_scrape_pool() -> ScrapePool:
+    """プロセス全体で共有するスクレイピングプール"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ScrapePool()
+        return _pool
@@ -0,0 +1,233 @@
+"""
+検索結果ストア
+
+/search の結果をサーバー側に保持し、検索IDで参照できるようにする。
+スクレイピングで後から見つかったJANは、イベントとして
+/search/{search_id}/events（SSE）に流す。
+
+shared（state.py の共有状態）を渡すと、検索結果とイベントを共有先にも書く。
+検索したのと別のワーカーにSSE・エクスポートが届いても、共有先から復元して応答する。
+共有先とのやりとりはイベントループを止めないようスレッドで行う（SearchStore の操作は async）。
+"""
+
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator
+
+from competitor import Competitor
+from state import SharedState, SharedStateError
+
+logger = logging.getLogger(__name__)
+
+# 別のワーカーの検索のイベントを確認する間隔（秒）
+REMOTE_POLL_INTERVAL = 0.5
+
+
+class SearchSession:
+    def __init__(self, product: dict, competitors: list, price_min: int,
+                 price_max: int, price_mode_label: str):
+        self.id = uuid.uuid4().hex
+        self.created_at = time.time()
+        self.product = product
+        self.competitors = competitors
+        self.price_min = price_min
+        self.price_max = price_max
+        self.price_mode_label = price_mode_label
+        self.events: list[tuple[str, dict]] = []
+        self.done = False
+        self.task: asyncio.Task | None = None
+        self._changed = asyncio.Condition()
+        self._index = {id(c): i for i, c in enumerate(competitors)}
+        # 共有先（SearchStore が設定する）
+        self.shared: SharedState | None = None
+        self.ttl = 0
+
+    def snapshot(self) -> dict:
+        """共有先に置く内容（event_offset 番目より前のイベントは competitors に反映済み）"""
+        return {
+            "created_at": self.created_at,
+            "product": self.product,
+            "competitors": [c.to_dict() for c in self.competitors],
+            "price_min": self.price_min,
+            "price_max": self.price_max,
+            "price_mode_label": self.price_mode_label,
+            "event_offset": len(self.events),
+        }
+
+    def _mirror(self, event: str, data: dict):
+        if self.shared is None:
+            return
+        try:
+            self.shared.push(f"search:{self.id}:events", json.dumps([event, data], ensure_ascii=False),
+                             ttl=self.ttl)
+        except SharedStateError as e:
+            logger.debug(f"[検索] イベントを共有できませんでした: {e}")
+
+    def index_of(self, competitor: Competitor) -> int:
+        """競合の表示上の行番号"""
+        return self._index[id(competitor)]
+
+    async def publish(self, event: str, data: dict):
+        """イベントを追加して購読者を起こす"""
+        async with self._changed:
+            self.events.append((event, data))
+            self._changed.notify_all()
+        if self.shared is not None:
+            await asyncio.to_thread(self._mirror, event, data)
+
+    async def finish(self):
+        """すべてのスクレイピングが終わったことを通知"""
+        jan_count = sum(1 for c in self.competitors if c.jan)
+        data = {"jan_count": jan_count, "total": len(self.competitors)}
+        async with self._changed:
+            self.events.append(("done", data))
+            self.done = True
+            self._changed.notify_all()
+        if self.shared is not None:
+            await asyncio.to_thread(self._mirror, "done", data)
+
+    async def subscribe(self) -> AsyncIterator[tuple[str, dict]]:
+        """これまでのイベントを再生し、その後は完了まで新着を流す"""
+        position = 0
+        while True:
+            async with self._changed:
+                while position >= len(self.events) and not self.done:
+                    await self._changed.wait()
+                pending = self.events[position:]
+                position = len(self.events)
+                finished = self.done
+            for event in pending:
+                yield event
+            if finished and position >= len(self.events):
+                return
+
+
+class RemoteSearchSession(SearchSession):
+    """別のワーカーで実行された検索（共有先から復元したもの）"""
+
+    def __init__(self, search_id: str, snapshot: dict, shared: SharedState):
+        super().__init__(
+            product=snapshot["product"],
+            competitors=[Competitor.from_record(c) for c in snapshot["competitors"]],
+            price_min=snapshot["price_min"],
+            price_max=snapshot["price_max"],
+            price_mode_label=snapshot["price_mode_label"],
+        )
+        self.id = search_id
+        self.created_at = snapshot["created_at"]
+        self.shared = shared
+        self._offset = snapshot["event_offset"]
+
+    def _fetch(self, start: int) -> list:
+        """共有先の start 番目以降のイベント（スレッドで呼ぶ）"""
+        try:
+            return self.shared.range(f"search:{self.id}:events", start)
+        except SharedStateError as e:
+            logger.debug(f"[検索] イベントを取得できませんでした: {e}")
+            return []
+
+    async def sync(self):
+        """共有先の新着イベントを取り込み、見つかったJANを競合に反映する"""
+        values = await asyncio.to_thread(self._fetch, len(self.events))
+        for value in values:
+            event, data = json.loads(value)
+            if event == "jan" and len(self.events) >= self._offset:
+                competitor = self.competitors[data["index"]]
+                competitor.jan = data["jan"]
+                competitor.jan_source = data["janSource"]
+            elif event == "done":
+                self.done = True
+            self.events.append((event, data))
+
+    async def subscribe(self) -> AsyncIterator[tuple[str, dict]]:
+        position = 0
+        while True:
+            pending = self.events[position:]
+            position = len(self.events)
+            for event in pending:
+                yield event
+            if self.done:
+                return
+            await asyncio.sleep(REMOTE_POLL_INTERVAL)
+            await self.sync()
+
+
+class SearchStore:
+    def __init__(self, ttl: int = 3600, max_sessions: int = 200, shared: SharedState | None = None):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.shared = shared
+        self._sessions: OrderedDict[str, SearchSession] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def create(self, **kwargs) -> SearchSession:
+        """新しい検索セッションを登録"""
+        self._expire()
+        session = SearchSession(**kwargs)
+        session.shared = self.shared
+        session.ttl = self.ttl
+        self._add(session)
+        await self.save(session)
+        return session
+
+    def _add(self, session: SearchSession):
+        self._sessions[session.id] = session
+        while len(self._sessions) > self.max_sessions:
+            _, old = self._sessions.popitem(last=False)
+            if old.task and not old.task.done():
+                old.task.cancel()
+
+    async def save(self, session: SearchSession):
+        """検索結果を共有先に置く（並べ替えた後などにも呼ぶ）"""
+        if self.shared is None:
+            return
+        await asyncio.to_thread(self._put_shared, session.id, session.snapshot())
+
+    def _put_shared(self, search_id: str, snapshot: dict):
+        try:
+            self.shared.set_json(f"search:{search_id}", snapshot, ttl=self.ttl)
+        except SharedStateError as e:
+            logger.debug(f"[検索] 検索結果を共有できませんでした: {e}")
+
+    def _get_shared(self, search_id: str) -> dict | None:
+        try:
+            return self.shared.get_json(f"search:{search_id}")
+        except SharedStateError as e:
+            logger.debug(f"[検索] 検索結果を取得できませんでした: {e}")
+            return None
+
+    async def get(self, search_id: str) -> SearchSession | None:
+        self._expire()
+        session = self._sessions.get(search_id)
+        if session is not None:
+            if isinstance(session, RemoteSearchSession) and not session.done:
+                await session.sync()
+            return session
+        if self.shared is None:
+            return None
+        snapshot = await asyncio.to_thread(self._get_shared, search_id)
+        if snapshot is None:
+            return None
+        session = RemoteSearchSession(search_id, snapshot, self.shared)
+        await session.sync()
+        # 取得を待つ間に同じ検索が復元されていればそちらを使う
+        if search_id in self._sessions:
+            return self._sessions[search_id]
+        self._add(session)
+        return session
+
+    def _expire(self):
+        now = time.time()
+        while self._sessions:
+            search_id, session = next(iter(self._sessions.items()))
+            if now - session.created_at < self.ttl:
+                break
+            del self._sessions[search_id]
+            if session.task and not session.task.done():
+                session.task.cancel()
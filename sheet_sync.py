@@ -0,0 +1,303 @@
+"""
+スプレッドシートへのバックグラウンド同期
+
+/search・バッチで見つかった競合（JANあり）をキューに入れておき、バックグラウンドで
+JANマスタのシートにまとめて追記する。検索の応答はシートへの書き込みを待たない。
+
+- キューと同期済みJANの集合はSQLiteに保存する（再起動しても未送信の行は残る）
+- 同期済み・キュー済みのJANは入れない（SQLiteの synced・queue で判定する。
+  シート上の既存JANは初回接続時に synced に取り込む）
+- push() はSQLiteに書き込むので、イベントループからはスレッドで呼ぶ
+- SHEET_SYNC_INTERVAL 秒ごと、または SHEET_SYNC_BATCH 件溜まった時点で、
+  SheetWriter の append_rows 1回にまとめて書き込む
+- 書き込みに失敗したら（429 の割り当て超過など）行はキューに残し、間隔を倍にしながら再試行する
+- 複数ワーカーで動かすときは、shared（state.py の共有状態）のリースを持つ1つだけが書き込む
+  （SHEET_SYNC_PATH は全ワーカーから同じファイルを指すこと）
+- ブラウザでのOAuth認証は行わない。サービスアカウントか保存済みトークン（token.json）が
+  なければエラーをログに出して同期を始めない（キューに入れた行は残る）
+
+環境変数:
+- SHEET_SYNC_SHEET: 追記先のシート名（デフォルト: 空＝同期しない）
+- SHEET_SYNC_PATH: SQLiteファイルのパス（デフォルト: data/sheet_sync.sqlite3）
+- SHEET_SYNC_INTERVAL: 書き込みの間隔（秒、デフォルト: 30）
+- SHEET_SYNC_BATCH: 1回に書き込む最大行数。これだけ溜まったら間隔を待たずに書く（デフォルト: 200）
+- SHEET_SYNC_MAX_BACKOFF: 失敗時の再試行間隔の上限（秒、デフォルト: 600）
+接続先は spreadsheet.py と同じ（SPREADSHEET_ID・SPREADSHEET_AUTH_TYPE・GOOGLE_CREDENTIALS_PATH）
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+
+from competitor import Competitor
+from metrics import Counter
+from state import SharedState, SharedStateError
+
+logger = logging.getLogger(__name__)
+
+SHEET_SYNC_ROWS = Counter("jancode_sheet_sync_rows_total", "スプレッドシート同期の行数",
+                          ("result",))  # queued / duplicate / written
+SHEET_SYNC_WRITES = Counter("jancode_sheet_sync_writes_total", "スプレッドシートへの書き込み",
+                            ("result",))  # ok / quota / error
+
+# 割り当て超過（1分あたりの書き込み回数）のあとは最低でもこれだけ待つ
+QUOTA_BACKOFF = 60
+
+
+class SheetSyncQueue:
+    def __init__(self, sheet_name: str | None = None, path: str | None = None,
+                 interval: float | None = None, batch_size: int | None = None,
+                 max_backoff: float | None = None, shared: SharedState | None = None,
+                 client_factory: Callable | None = None):
+        self.sheet_name = sheet_name if sheet_name is not None else os.environ.get("SHEET_SYNC_SHEET", "")
+        self.path = path or os.environ.get("SHEET_SYNC_PATH", "data/sheet_sync.sqlite3")
+        self.interval = interval if interval is not None else float(os.environ.get("SHEET_SYNC_INTERVAL", 30))
+        self.batch_size = batch_size if batch_size is not None else int(os.environ.get("SHEET_SYNC_BATCH", 200))
+        self.max_backoff = max_backoff if max_backoff is not None else float(
+            os.environ.get("SHEET_SYNC_MAX_BACKOFF", 600))
+        self.shared = shared
+        self.enabled = bool(self.sheet_name)
+        self.written = 0
+        self.failures = 0
+        self.last_error = ""
+        self.task: asyncio.Task | None = None
+        self._client_factory = client_factory
+        self._writer = None
+        self._retry_at = 0.0
+        self._leader = False
+        self._wakeup = asyncio.Event()
+        self._lock = threading.Lock()
+
+        if not self.enabled:
+            return
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS queue (
+                jan TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                shop TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                queued_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_queue_queued ON queue(queued_at);
+
+            CREATE TABLE IF NOT EXISTS synced (
+                jan TEXT PRIMARY KEY,
+                synced_at REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def push(self, items: list[Competitor | dict]) -> int:
+        """JANのある行をキューに入れ、入れた行数を返す（書き込みは待たない。スレッドで呼ぶ）"""
+        if not self.enabled:
+            return 0
+        now = time.time()
+        rows = []
+        for item in items:
+            if not isinstance(item, Competitor):
+                item = Competitor.from_record(item)
+            if item.jan:
+                rows.append((*item.as_row(), now, item.jan))
+        if not rows:
+            return 0
+        with self._lock:
+            # キュー済み（他のワーカーが先に入れた分も）は主キーで、同期済みは synced で弾く（入った行だけ数える）
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO queue (jan, name, shop, price, url, queued_at) "
+                "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (SELECT 1 FROM synced WHERE jan = ?)",
+                rows
+            )
+            self._conn.commit()
+            inserted = self._conn.total_changes - before
+            queued = self._conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+        SHEET_SYNC_ROWS.inc(inserted, result="queued")
+        SHEET_SYNC_ROWS.inc(len(rows) - inserted, result="duplicate")
+        if queued >= self.batch_size:
+            self._wakeup.set()
+        return inserted
+
+    def queued(self) -> int:
+        if not self.enabled:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0]
+
+    def _is_leader(self) -> bool:
+        """書き込みの担当（リース）を取る・延長する。共有しない・共有先に届かないときは自分が担当（スレッドで呼ぶ）"""
+        if self.shared is None:
+            return True
+        try:
+            self._leader = self.shared.acquire_lease("sheet_sync:writer", ttl=max(self.interval * 3, 120))
+        except SharedStateError as e:
+            logger.warning(f"[シート同期] 共有状態に接続できないため、このワーカーで書き込みます: {e}")
+            self._leader = True
+        return self._leader
+
+    def _connect(self):
+        """シートに接続し、シート上の既存JANを同期済みとして取り込む（スレッドで呼ぶ）"""
+        if self._client_factory is None:
+            from spreadsheet import SpreadsheetClient
+            # バックグラウンドのスレッドからブラウザ認証を始めると、誰も操作できず止まったままになる
+            self._client_factory = functools.partial(SpreadsheetClient, interactive=False)
+        client = self._client_factory()
+        if not client.connect():
+            raise ConnectionError("スプレッドシートに接続できません")
+        writer = client.writer(self.sheet_name)
+        existing = writer.existing_jans()
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR IGNORE INTO synced (jan, synced_at) VALUES (?, ?)",
+                                   [(jan, now) for jan in existing if jan])
+            self._conn.commit()
+        self._writer = writer
+        logger.info(f"[シート同期] 「{self.sheet_name}」に接続しました（既存JAN {len(existing)}件）")
+
+    def _write(self, rows: list[tuple]) -> int:
+        """1回分をシートに追記し、追記した行数を返す（スレッドで呼ぶ）"""
+        if self._writer is None:
+            self._connect()
+        try:
+            # シート上にすでにあるJANは SheetWriter が除く
+            added = self._writer.add([Competitor(name, price, "", jan, "", url, shop)
+                                      for jan, name, shop, price, url in rows])
+            return self._writer.flush(dedupe=True) if added else 0
+        except BaseException:
+            # 失敗した行はキューに残っているので、次の再試行で二重に送らないよう捨てる
+            self._writer.discard_pending()
+            raise
+
+    def _next_rows(self) -> list[tuple]:
+        """次に書き込む行（スレッドで呼ぶ）"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT jan, name, shop, price, url FROM queue ORDER BY queued_at LIMIT ?",
+                (self.batch_size,)
+            ).fetchall()
+
+    def _mark_synced(self, jans: list[str]):
+        """書き込んだ行を同期済みにしてキューから消す（スレッドで呼ぶ）"""
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO synced (jan, synced_at) VALUES (?, ?)",
+                                   [(jan, now) for jan in jans])
+            self._conn.executemany("DELETE FROM queue WHERE jan = ?", [(jan,) for jan in jans])
+            self._conn.commit()
+
+    def _backoff(self, error: Exception):
+        """失敗の種類に応じて次の再試行時刻を決める"""
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+        self.failures += 1
+        delay = min(self.max_backoff, self.interval * 2 ** (self.failures - 1))
+        if status == 429:
+            retry_after = getattr(response, "headers", {}).get("Retry-After")
+            try:
+                delay = max(delay, float(retry_after)) if retry_after else max(delay, QUOTA_BACKOFF)
+            except ValueError:
+                delay = max(delay, QUOTA_BACKOFF)
+            SHEET_SYNC_WRITES.inc(result="quota")
+        else:
+            # 認証切れ・接続エラーなどは次回つなぎ直す
+            self._writer = None
+            SHEET_SYNC_WRITES.inc(result="error")
+        self._retry_at = time.time() + delay
+        self.last_error = str(error)
+        logger.warning(f"[シート同期] 書き込み失敗（{delay:.0f}秒後に再試行）: {error}")
+
+    async def flush(self) -> int:
+        """キューの行を SHEET_SYNC_BATCH 件ずつ書き込み、追記した行数を返す（再試行待ちなら何もしない）"""
+        if not self.enabled or time.time() < self._retry_at:
+            return 0
+        if not await asyncio.to_thread(self._is_leader):
+            return 0
+        written = 0
+        while True:
+            rows = await asyncio.to_thread(self._next_rows)
+            if not rows:
+                break
+            try:
+                # gspread は同期APIなのでイベントループを止めないようスレッドで呼ぶ
+                count = await asyncio.to_thread(self._write, rows)
+            except Exception as e:
+                self._backoff(e)
+                break
+            await asyncio.to_thread(self._mark_synced, [row[0] for row in rows])
+            self.failures = 0
+            self.written += count
+            written += count
+            SHEET_SYNC_WRITES.inc(result="ok")
+            SHEET_SYNC_ROWS.inc(count, result="written")
+            if len(rows) < self.batch_size:
+                break
+        if written:
+            logger.info(f"[シート同期] 「{self.sheet_name}」に{written}件追記しました")
+        return written
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"[シート同期] エラー: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _auth_problem(self) -> str:
+        """ブラウザ操作なしでは接続できない設定なら理由を返す（問題なければ空）"""
+        if self._client_factory is not None:
+            return ""
+        from spreadsheet import TOKEN_PATH, SpreadsheetClient
+        if SpreadsheetClient(interactive=False).needs_browser_auth():
+            return (f"OAuth認証の保存済みトークン（{TOKEN_PATH}）がありません。"
+                    "SPREADSHEET_AUTH_TYPE=service_account を使うか、先にCLIで認証してください")
+        return ""
+
+    def start(self):
+        if self.enabled and (self.task is None or self.task.done()):
+            problem = self._auth_problem()
+            if problem:
+                self.last_error = problem
+                logger.error(f"[シート同期] 同期を開始できません: {problem}")
+                return
+            self.task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        """止める（未送信の行はキューに残り、次回の起動後に書き込まれる）"""
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        synced = 0
+        if self.enabled:
+            with self._lock:
+                synced = self._conn.execute("SELECT COUNT(*) FROM synced").fetchone()[0]
+        return {
+            "enabled": self.enabled,
+            "sheet": self.sheet_name,
+            "queued": self.queued(),
+            "synced": synced,
+            "written": self.written,
+            "failures": self.failures,
+            "retry_in_seconds": max(0.0, self._retry_at - time.time()),
+            "last_error": self.last_error,
+            "leader": self._leader,
+        }
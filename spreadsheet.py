@@ -11,32 +11,45 @@ Google スプレッドシート連携モジュール
 - GOOGLE_CREDENTIALS_PATH: 認証情報ファイルのパス
 """
 
+import logging
 import os
+import re
 from datetime import datetime
 from dotenv import load_dotenv
 
+from competitor import Competitor
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+HEADERS = ["JANコード", "商品名", "ショップ", "価格", "URL", "取得日時"]
+# OAuth認証の保存済みトークン
+TOKEN_PATH = "token.json"
+
 
 class SpreadsheetClient:
-    def __init__(self):
+    def __init__(self, interactive: bool = True):
         self.auth_type = os.environ.get("SPREADSHEET_AUTH_TYPE", "oauth")
+        # False ならブラウザでのOAuth認証を始めない（サーバーのバックグラウンド処理用）
+        self.interactive = interactive
         self.spreadsheet_id = os.environ.get("SPREADSHEET_ID")
         self.creds_path = os.environ.get("GOOGLE_CREDENTIALS_PATH", "credentials.json")
         self.client = None
         self.spreadsheet = None
+        self._writers: dict[str, SheetWriter] = {}
     
     def connect(self) -> bool:
         """スプレッドシートに接続"""
         try:
             import gspread
         except ImportError:
-            print("❌ gspread がインストールされていません")
-            print("   pip install gspread google-auth google-auth-oauthlib")
+            logger.error("[シート] gspread がインストールされていません"
+                         "（pip install gspread google-auth google-auth-oauthlib）")
             return False
         
         if not self.spreadsheet_id:
-            print("❌ SPREADSHEET_ID が設定されていません")
+            logger.error("[シート] SPREADSHEET_ID が設定されていません")
             return False
         
         try:
@@ -46,13 +59,17 @@ class SpreadsheetClient:
                 self.client = self._auth_oauth()
             
             self.spreadsheet = self.client.open_by_key(self.spreadsheet_id)
-            print(f"✅ スプレッドシート接続成功: {self.spreadsheet.title}")
+            logger.info(f"[シート] スプレッドシートに接続しました: {self.spreadsheet.title}")
             return True
             
         except Exception as e:
-            print(f"❌ 接続エラー: {e}")
+            logger.error(f"[シート] 接続エラー: {e}")
             return False
     
+    def needs_browser_auth(self) -> bool:
+        """接続にブラウザでのOAuth認証が必要か（サービスアカウントでも保存済みトークンでもない）"""
+        return self.auth_type != "service_account" and not os.path.exists(TOKEN_PATH)
+
     def _auth_service_account(self):
         """サービスアカウント認証"""
         import gspread
@@ -78,7 +95,7 @@ class SpreadsheetClient:
             'https://www.googleapis.com/auth/drive'
         ]
         
-        token_path = "token.json"
+        token_path = TOKEN_PATH
         creds = None
         
         # 保存済みトークンがあれば読み込み
@@ -90,13 +107,18 @@ class SpreadsheetClient:
             if creds and creds.expired and creds.refresh_token:
                 creds.refresh(Request())
             else:
+                if not self.interactive:
+                    raise PermissionError(
+                        f"OAuth認証にはブラウザ操作が必要です（{token_path} を用意するか "
+                        "SPREADSHEET_AUTH_TYPE=service_account を使ってください）")
                 # OAuth クライアント設定ファイルから認証
                 if not os.path.exists(self.creds_path):
-                    print(f"❌ OAuth設定ファイルが見つかりません: {self.creds_path}")
-                    print("\n📋 設定手順:")
-                    print("1. Google Cloud Console → 認証情報")
-                    print("2. 「OAuthクライアントIDを作成」→「デスクトップアプリ」")
-                    print("3. JSONをダウンロードして credentials.json として保存")
+                    logger.error(
+                        f"[シート] OAuth設定ファイルが見つかりません: {self.creds_path}\n"
+                        "設定手順:\n"
+                        "1. Google Cloud Console → 認証情報\n"
+                        "2. 「OAuthクライアントIDを作成」→「デスクトップアプリ」\n"
+                        "3. JSONをダウンロードして credentials.json として保存")
                     raise FileNotFoundError(self.creds_path)
                 
                 flow = InstalledAppFlow.from_client_secrets_file(self.creds_path, scopes)
@@ -105,7 +127,7 @@ class SpreadsheetClient:
             # トークンを保存
             with open(token_path, 'w') as token:
                 token.write(creds.to_json())
-            print("✅ 認証トークンを保存しました")
+            logger.info(f"[シート] 認証トークンを保存しました: {token_path}")
         
         return gspread.authorize(creds)
     
@@ -115,12 +137,19 @@ class SpreadsheetClient:
             return []
         return [sheet.title for sheet in self.spreadsheet.worksheets()]
     
-    def append_jan_data(self, sheet_name: str, data: list[dict]) -> int:
+    def writer(self, sheet_name: str) -> "SheetWriter":
+        """シートごとの追記用ライター（行数・既存JANのキャッシュを共有）"""
+        if sheet_name not in self._writers:
+            self._writers[sheet_name] = SheetWriter(self, sheet_name)
+        return self._writers[sheet_name]
+    
+    def append_jan_data(self, sheet_name: str, data: list[Competitor | dict]) -> int:
         """JANコードデータをシートに追記
         
         Args:
             sheet_name: シート名
-            data: [{"jan": "xxx", "name": "xxx", "shop": "xxx", "price": 123, "url": "xxx"}, ...]
+            data: 競合一覧の Competitor、または
+                [{"jan": "xxx", "name": "xxx", "shop": "xxx", "price": 123, "url": "xxx"}, ...]
         
         Returns:
             追加した行数
@@ -128,46 +157,9 @@ class SpreadsheetClient:
         if not self.spreadsheet:
             raise Exception("スプレッドシートに接続されていません")
         
-        try:
-            sheet = self.spreadsheet.worksheet(sheet_name)
-        except:
-            # シートがなければ作成
-            sheet = self.spreadsheet.add_worksheet(title=sheet_name, rows=1000, cols=10)
-            # ヘッダーを追加
-            headers = ["JANコード", "商品名", "ショップ", "価格", "URL", "取得日時"]
-            sheet.update('A1', [headers])
-            print(f"✅ 新しいシート「{sheet_name}」を作成しました")
-        
-        # 既存データを確認
-        existing = sheet.get_all_values()
-        
-        # ヘッダーがなければ追加
-        expected_headers = ["JANコード", "商品名", "ショップ", "価格", "URL", "取得日時"]
-        if not existing or existing[0] != expected_headers:
-            sheet.update('A1', [expected_headers])
-            existing = [expected_headers]
-        
-        # データを行形式に変換
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        rows = []
-        for item in data:
-            row = [
-                item.get("jan", ""),
-                item.get("name", ""),
-                item.get("shop", ""),
-                str(item.get("price", "")),
-                item.get("url", ""),
-                now
-            ]
-            rows.append(row)
-        
-        # 最終行の次に追加
-        next_row = len(existing) + 1
-        if rows:
-            sheet.update(f'A{next_row}', rows)
-            print(f"✅ {len(rows)}件のデータを追加しました（{next_row}行目〜）")
-        
-        return len(rows)
+        writer = self.writer(sheet_name)
+        writer.add(data, dedupe=False)
+        return writer.flush()
     
     def find_existing_jans(self, sheet_name: str) -> set[str]:
         """既存のJANコードを取得（重複チェック用）"""
@@ -175,24 +167,161 @@ class SpreadsheetClient:
             return set()
         
         try:
-            sheet = self.spreadsheet.worksheet(sheet_name)
-            values = sheet.col_values(1)  # A列（JANコード）
-            # ヘッダーを除外
-            return set(values[1:]) if len(values) > 1 else set()
+            return set(self.writer(sheet_name).existing_jans())
         except:
             return set()
 
 
+class SheetWriter:
+    """1シートへの追記をまとめて書き込む
+    
+    - シートの行数と既存JANの集合をローカルに保持し、毎回シート全体を読まない
+    - キャッシュの検証は「ヘッダー行」と「最終行・その次の行」を
+      batch_get 1回で確認するだけ。ずれていたときだけA列・F列を読み直す
+    - 行数はA列（JAN）とF列（取得日時）の長い方で数える（JANが空の行もあるため）
+    - add() した行は溜めておき、flush() で append_rows 1回にまとめて追記する
+    """
+    
+    def __init__(self, client: SpreadsheetClient, sheet_name: str, flush_size: int = 500):
+        self.client = client
+        self.sheet_name = sheet_name
+        self.flush_size = flush_size
+        self._sheet = None
+        self._row_count: int | None = None
+        self._jans: set[str] | None = None
+        self._pending: list[list[str]] = []
+    
+    def _worksheet(self):
+        if self._sheet is None:
+            try:
+                self._sheet = self.client.spreadsheet.worksheet(self.sheet_name)
+            except:
+                # シートがなければ作成
+                self._sheet = self.client.spreadsheet.add_worksheet(title=self.sheet_name, rows=1000, cols=10)
+                self._sheet.update(values=[HEADERS], range_name='A1')
+                self._row_count = 1
+                self._jans = set()
+                logger.info(f"[シート] 新しいシート「{self.sheet_name}」を作成しました")
+        return self._sheet
+    
+    def _reload(self):
+        """A列（JANコード）とF列（取得日時）を読み直して行数と既存JANを作り直す"""
+        sheet = self._worksheet()
+        jan_column, time_column = sheet.batch_get(["A:A", "F:F"])
+        self._row_count = max(len(jan_column), len(time_column))
+        self._jans = {row[0] for row in jan_column[1:] if row and row[0]}
+        logger.info(f"[シート] 「{self.sheet_name}」を読み込みました（{self._row_count}行）")
+    
+    def _validate(self):
+        """キャッシュがシートの現状と合っているか数セルだけ読んで確認"""
+        sheet = self._worksheet()
+        if self._row_count is None:
+            self._reload()
+        
+        n = self._row_count
+        if n == 0:
+            # 空のシート（確認する行はまだない）
+            header = sheet.batch_get(["A1:F1"])[0]
+            if not header or header[0] != HEADERS:
+                sheet.update(values=[HEADERS], range_name='A1')
+            self._row_count = 1
+            return
+        header, probe = sheet.batch_get(["A1:F1", f"A{n}:F{n + 1}"])
+        
+        # ヘッダーがなければ追加（行数の確認は続けて行う）
+        if not header or header[0] != HEADERS:
+            sheet.update(values=[HEADERS], range_name='A1')
+        
+        # 最終行のどこかに値があり、その次の行が空なら他から追記されていない
+        # （JANが空の行もあるので、A列だけでなく行全体で判定する）
+        last_filled = len(probe) >= 1 and any(cell != "" for cell in probe[0])
+        next_empty = len(probe) < 2 or all(cell == "" for cell in probe[1])
+        if not (last_filled and next_empty):
+            self._reload()
+    
+    def existing_jans(self) -> set[str]:
+        """シート上と送信待ちのJANコード"""
+        self._validate()
+        return self._jans | {row[0] for row in self._pending}
+    
+    def add(self, data: list[Competitor | dict], dedupe: bool = True) -> int:
+        """行を送信待ちに追加（溜まったら自動で flush）
+        
+        Returns:
+            送信待ちに追加した行数
+        """
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        pending_jans = {row[0] for row in self._pending}
+        added = 0
+        for item in data:
+            if not isinstance(item, Competitor):
+                item = Competitor.from_record(item)
+            jan = item.jan
+            if dedupe:
+                if not jan or jan in pending_jans or (self._jans is not None and jan in self._jans):
+                    continue
+                pending_jans.add(jan)
+            jan, name, shop, price, url = item.as_row()
+            self._pending.append([jan, name, shop, str(price), url, now])
+            added += 1
+        
+        if len(self._pending) >= self.flush_size:
+            self.flush(dedupe=dedupe)
+        return added
+    
+    def discard_pending(self):
+        """送信待ちの行を捨てる（呼び出し元が失敗した行を持っていて、あとで送り直す場合）"""
+        self._pending = []
+    
+    def flush(self, dedupe: bool = False) -> int:
+        """送信待ちの行をまとめて追記し、追記した行数を返す"""
+        if not self._pending:
+            return 0
+        
+        self._validate()
+        rows = self._pending
+        if dedupe:
+            rows = [row for row in rows if row[0] not in self._jans]
+        if not rows:
+            self._pending = []
+            return 0
+        
+        sheet = self._worksheet()
+        response = sheet.append_rows(rows, value_input_option="RAW", table_range="A1")
+        self._pending = []
+        
+        # 追記先の範囲（例: 'JANマスタ'!A101:F110）から最終行を更新
+        updated_range = response.get("updates", {}).get("updatedRange", "")
+        match = re.search(r"!A(\d+):[A-Z]+(\d+)$", updated_range)
+        if match:
+            start_row, end_row = int(match.group(1)), int(match.group(2))
+            if start_row != self._row_count + 1:
+                # 他から追記されていたので次回の検証で読み直す
+                self._row_count = None
+            else:
+                self._row_count = end_row
+            logger.info(f"[シート] 「{self.sheet_name}」に{len(rows)}件追加しました（{start_row}行目〜）")
+        else:
+            self._row_count = None
+            logger.info(f"[シート] 「{self.sheet_name}」に{len(rows)}件追加しました")
+        
+        if self._row_count is None:
+            self._reload()
+        else:
+            self._jans.update(row[0] for row in rows)
+        return len(rows)
+
+
 # テスト用
 if __name__ == "__main__":
-    print("=" * 50)
-    print("スプレッドシート接続テスト")
-    print("=" * 50)
+    from log import setup_logging
+    setup_logging()
+    logger.info("スプレッドシート接続テスト")
     
     client = SpreadsheetClient()
     
     if client.connect():
-        print(f"\n📊 シート一覧: {client.get_sheets()}")
+        logger.info(f"シート一覧: {client.get_sheets()}")
         
         response = input("\nテストデータを書き込みますか？ (y/n): ")
         if response.lower() == 'y':
@@ -204,6 +333,6 @@ if __name__ == "__main__":
             ]
             
             count = client.append_jan_data(sheet_name, test_data)
-            print(f"\n✅ {count}件追加完了！スプレッドシートを確認してください")
+            logger.info(f"{count}件追加しました。スプレッドシートを確認してください")
 
 
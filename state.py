@@ -0,0 +1,411 @@
+"""
+共有状態（複数ワーカー・複数インスタンスで共有するキャッシュ・APIの払い出し枠・バッチの進捗）
+
+uvicorn --workers や Cloud Run の複数インスタンスで動かすと、プロセスごとに
+キャッシュとレートリミッターを持つため、API呼び出しが台数分に増えてしまう。
+SHARED_STATE を設定すると、次のものをプロセス間で共有する。
+- APIの払い出し枠（アプリIDごとの時間枠。429 での一時停止も全体に伝わる）
+- JANキャッシュ・自社商品・競合検索結果（各プロセスのキャッシュの2段目として）
+- バッチの実行権（リース）と進捗
+- 検索結果とスクレイピングのイベント（どのワーカーでもSSE・エクスポートに応答できる）
+
+環境変数:
+- SHARED_STATE: 共有先（未設定なら共有しない）
+    sqlite:///data/shared_state.sqlite3  同じホスト上の複数ワーカー
+    redis://[:パスワード@]ホスト:6379/0   複数インスタンス（Redis互換サーバー。Memorystore・Valkey等）
+- SHARED_STATE_PREFIX: キーの接頭辞（デフォルト: jancode:）
+
+Redis へは RESP を直接話す小さなクライアントで接続する（追加の依存なし）。
+手元での確認には bench/fake_redis.py が使える。
+
+操作はどれも同期（ソケット・SQLiteのロック待ちでブロックする）なので、
+イベントループ上の処理からは asyncio.to_thread で呼ぶこと。
+"""
+
+import abc
+import json
+import logging
+import math
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from urllib.parse import unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+# このプロセスの識別子（リースの持ち主）
+INSTANCE_ID = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class SharedStateError(Exception):
+    """共有先に接続できない・応答が不正"""
+
+
+class SharedState(abc.ABC):
+    """共有状態のバックエンド共通部分
+
+    値は文字列。ttl は秒（None なら期限なし）。
+    """
+
+    def __init__(self, prefix: str = ""):
+        self.prefix = prefix
+
+    # --- バックエンドが実装する操作 ---
+
+    @abc.abstractmethod
+    def get_many(self, keys: list[str]) -> list[str | None]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, key: str, value: str, ttl: float | None = None):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add(self, key: str, value: str, ttl: float | None = None) -> bool:
+        """キーがなければ設定して True（リースの取得に使う）"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def incr(self, key: str, ttl: float) -> int:
+        """1増やした値を返す。新しく作ったキーには ttl を付ける"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def push(self, key: str, value: str, ttl: float):
+        """リストの末尾に追加する"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def range(self, key: str, start: int = 0) -> list[str]:
+        """リストの start 番目以降"""
+        raise NotImplementedError
+
+    # --- 共通の操作 ---
+
+    def get(self, key: str) -> str | None:
+        return self.get_many([key])[0]
+
+    def get_json(self, key: str):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key: str, value, ttl: float | None = None):
+        self.set(key, json.dumps(value, ensure_ascii=False), ttl)
+
+    def take_slot(self, bucket: str, rate: float, burst: int) -> float:
+        """APIの払い出し枠を1つ取り、取れたら 0、取れなければ次の枠までの秒数を返す
+
+        時間を burst / rate 秒ごとの枠に区切り、枠ごとに burst 回まで払い出す。
+        枠のカウンターは全プロセスで共有するので、台数が増えても全体で rate 回/秒に収まる。
+        """
+        now = time.time()
+        paused_until = self.get(f"{bucket}:pause")
+        if paused_until is not None and float(paused_until) > now:
+            return float(paused_until) - now
+        window = burst / rate
+        slot = math.floor(now / window)
+        if self.incr(f"{bucket}:{slot}", ttl=window * 2 + 1) <= burst:
+            return 0.0
+        return (slot + 1) * window - now
+
+    def pause(self, bucket: str, seconds: float):
+        """429 を受けたとき、全プロセスの払い出しを seconds 秒止める"""
+        until = time.time() + seconds
+        current = self.get(f"{bucket}:pause")
+        if current is None or float(current) < until:
+            self.set(f"{bucket}:pause", repr(until), ttl=seconds + 1)
+
+    def acquire_lease(self, key: str, ttl: float, owner: str = INSTANCE_ID) -> bool:
+        """リースを取る（自分が持っていれば延長する）"""
+        if self.add(key, owner, ttl):
+            return True
+        if self.get(key) == owner:
+            self.set(key, owner, ttl)
+            return True
+        return False
+
+    def release_lease(self, key: str, owner: str = INSTANCE_ID):
+        if self.get(key) == owner:
+            self.delete(key)
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class SQLiteState(SharedState):
+    """同じホスト上の複数プロセスで共有する（SQLiteファイル）"""
+
+    def __init__(self, path: str, prefix: str = ""):
+        super().__init__(prefix)
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS kv (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            );
+            CREATE TABLE IF NOT EXISTS lists (
+                key TEXT NOT NULL,
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                value TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_lists_key ON lists(key, seq);
+        """)
+
+    @staticmethod
+    def _expires(ttl: float | None) -> float | None:
+        return time.time() + ttl if ttl is not None else None
+
+    def _maybe_prune(self):
+        """期限切れの行をときどき削除（ロック取得済みで呼ぶ）"""
+        self._writes += 1
+        if self._writes % 500 == 1:
+            now = time.time()
+            self._conn.execute("DELETE FROM kv WHERE expires_at <= ?", (now,))
+            self._conn.execute("DELETE FROM lists WHERE expires_at <= ?", (now,))
+
+    def get_many(self, keys: list[str]) -> list[str | None]:
+        if not keys:
+            return []
+        now = time.time()
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = [self.prefix + key for key in keys[i:i + 500]]
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM kv WHERE key IN ({','.join('?' * len(chunk))}) "
+                    "AND (expires_at IS NULL OR expires_at > ?)",
+                    chunk + [now]
+                ).fetchall()
+                found.update(rows)
+        return [found.get(self.prefix + key) for key in keys]
+
+    def set(self, key: str, value: str, ttl: float | None = None):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                               (self.prefix + key, value, self._expires(ttl)))
+            self._maybe_prune()
+
+    def add(self, key: str, value: str, ttl: float | None = None) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at "
+                "WHERE kv.expires_at IS NOT NULL AND kv.expires_at <= ?",
+                (self.prefix + key, value, self._expires(ttl), time.time())
+            )
+            return cursor.rowcount > 0
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM kv WHERE key = ?", (self.prefix + key,))
+
+    def incr(self, key: str, ttl: float) -> int:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "INSERT INTO kv (key, value, expires_at) VALUES (?, '1', ?) "
+                "ON CONFLICT(key) DO UPDATE SET "
+                "value = CASE WHEN kv.expires_at <= ? THEN 1 ELSE CAST(kv.value AS INTEGER) + 1 END, "
+                "expires_at = CASE WHEN kv.expires_at <= ? THEN excluded.expires_at ELSE kv.expires_at END "
+                "RETURNING value",
+                (self.prefix + key, now + ttl, now, now)
+            ).fetchone()
+            self._maybe_prune()
+        return int(row[0])
+
+    def push(self, key: str, value: str, ttl: float):
+        with self._lock:
+            self._conn.execute("INSERT INTO lists (key, value, expires_at) VALUES (?, ?, ?)",
+                               (self.prefix + key, value, time.time() + ttl))
+            self._maybe_prune()
+
+    def range(self, key: str, start: int = 0) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT value FROM lists WHERE key = ? AND expires_at > ? ORDER BY seq LIMIT -1 OFFSET ?",
+                (self.prefix + key, time.time(), start)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class RedisState(SharedState):
+    """Redis互換サーバーで共有する（RESPを直接話す）"""
+
+    def __init__(self, url: str, prefix: str = "", timeout: float = 2.0):
+        super().__init__(prefix)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sock: socket.socket | None = None
+        self._file = None
+
+    # --- 接続とRESP ---
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._file = sock.makefile("rb")
+        if self.password:
+            auth = ("AUTH", self.username, self.password) if self.username else ("AUTH", self.password)
+            self._call([auth])
+        if self.db:
+            self._call([("SELECT", str(self.db))])
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    @staticmethod
+    def _encode(command: tuple) -> bytes:
+        parts = [f"*{len(command)}\r\n".encode()]
+        for arg in command:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line.endswith(b"\r\n"):
+            raise SharedStateError("Redisとの接続が切れました")
+        kind, body = line[:1], line[1:-2]
+        if kind == b"+":
+            return body.decode()
+        if kind == b"-":
+            raise SharedStateError(f"Redisエラー: {body.decode(errors='replace')}")
+        if kind == b":":
+            return int(body)
+        if kind == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2].decode("utf-8")
+        if kind == b"*":
+            count = int(body)
+            return None if count < 0 else [self._read_reply() for _ in range(count)]
+        raise SharedStateError(f"Redisの応答が不正です: {line[:40]!r}")
+
+    def _call(self, commands: list[tuple]) -> list:
+        """コマンドをまとめて送り（パイプライン）、応答を順に返す（ロック取得済みで呼ぶ）"""
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        return [self._read_reply() for _ in commands]
+
+    def _execute(self, *commands: tuple, idempotent: bool = True) -> list:
+        """コマンドを実行する（ソケットを使うのでイベントループからはスレッドで呼ぶ）
+
+        切断されていたら1回だけつなぎ直して送り直す。ただし INCR・RPUSH など
+        2回適用されると結果が変わるコマンド（idempotent=False）は、送信後に
+        失敗したら送り直さない（サーバー側では適用済みかもしれないため）。
+        """
+        with self._lock:
+            for attempt in range(2):
+                sent = False
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    sent = True
+                    return self._call(list(commands))
+                except (OSError, SharedStateError) as e:
+                    self._close()
+                    # エラー応答はそのまま返す
+                    if (attempt or (sent and not idempotent)
+                            or (isinstance(e, SharedStateError) and "Redisエラー" in str(e))):
+                        raise SharedStateError(str(e)) from e
+
+    @staticmethod
+    def _ms(ttl: float) -> str:
+        return str(max(1, int(ttl * 1000)))
+
+    # --- 操作 ---
+
+    def get_many(self, keys: list[str]) -> list[str | None]:
+        if not keys:
+            return []
+        return self._execute(("MGET", *(self.prefix + key for key in keys)))[0]
+
+    def set(self, key: str, value: str, ttl: float | None = None):
+        command = ("SET", self.prefix + key, value)
+        if ttl is not None:
+            command += ("PX", self._ms(ttl))
+        self._execute(command)
+
+    def add(self, key: str, value: str, ttl: float | None = None) -> bool:
+        command = ("SET", self.prefix + key, value, "NX")
+        if ttl is not None:
+            command += ("PX", self._ms(ttl))
+        # 送り直すと、1回目で設定できていても「すでにある」になる
+        return self._execute(command, idempotent=False)[0] is not None
+
+    def delete(self, key: str):
+        self._execute(("DEL", self.prefix + key))
+
+    def incr(self, key: str, ttl: float) -> int:
+        # 期限付きで0を作ってから増やす（すでにあれば SET NX は何もしない）
+        _, value = self._execute(("SET", self.prefix + key, "0", "NX", "PX", self._ms(ttl)),
+                                 ("INCR", self.prefix + key), idempotent=False)
+        return value
+
+    def push(self, key: str, value: str, ttl: float):
+        self._execute(("RPUSH", self.prefix + key, value), ("PEXPIRE", self.prefix + key, self._ms(ttl)),
+                      idempotent=False)
+
+    def range(self, key: str, start: int = 0) -> list[str]:
+        return self._execute(("LRANGE", self.prefix + key, str(start), "-1"))[0]
+
+    def stats(self) -> dict:
+        return {"backend": type(self).__name__, "host": f"{self.host}:{self.port}", "db": self.db}
+
+
+def open_shared_state(url: str, prefix: str = "") -> SharedState:
+    """SHARED_STATE の形式のURLから共有状態を作る"""
+    if url.startswith("sqlite:///"):
+        return SQLiteState(url[len("sqlite:///"):], prefix)
+    if url.startswith(("redis://", "rediss://")):
+        if url.startswith("rediss://"):
+            raise ValueError("rediss://（TLS）には未対応です")
+        return RedisState(url, prefix)
+    raise ValueError(f"SHARED_STATE の形式が不正です: {url}")
+
+
+_state: SharedState | None = None
+_state_loaded = False
+_state_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedState | None:
+    """環境変数 SHARED_STATE の共有状態（未設定なら None）"""
+    global _state, _state_loaded
+    with _state_lock:
+        if not _state_loaded:
+            url = os.environ.get("SHARED_STATE", "")
+            if url:
+                _state = open_shared_state(url, os.environ.get("SHARED_STATE_PREFIX", "jancode:"))
+                logger.info(f"[共有状態] {_state.stats()}")
+            _state_loaded = True
+        return _state
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# テストからリポジトリ直下のモジュールを import できるようにする
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
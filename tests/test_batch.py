@@ -0,0 +1,107 @@
+import asyncio
+import csv
+import json
+
+import httpx
+
+from batch import BatchJob, read_seeds
+from competitor import Competitor
+from state import SQLiteState
+
+SEED_A = "https://item.rakuten.co.jp/shop-a/item-1/"
+SEED_B = "https://item.rakuten.co.jp/shop-b/item-2/"
+
+
+class FakeAPI:
+    """商品取得・競合検索の呼び出しを記録するだけのAPI"""
+
+    def __init__(self, fail: set[str] = frozenset()):
+        self.searched = []
+        # 検索APIがエラーになるショップ
+        self.fail = set(fail)
+
+    async def get_item(self, shop_code, item_id):
+        return {"price": 1000, "categoryId": "100", "shopId": shop_code, "jan": ""}
+
+    async def search_competitors(self, category_id, price_min, price_max, exclude_shop, pages, jan,
+                                 strict=False):
+        self.searched.append(exclude_shop)
+        if exclude_shop in self.fail:
+            assert strict
+            raise httpx.ConnectError("refused")
+        return [Competitor(name="共通", price=900, jan="4901234567894", url="https://item/common", shop="X"),
+                Competitor(name=exclude_shop, price=950, url=f"https://item/{exclude_shop}", shop="Y")]
+
+
+def make_job(tmp_path, api, **kwargs) -> BatchJob:
+    return BatchJob(seeds=[SEED_A, SEED_B], state_path=str(tmp_path / "state.jsonl"),
+                    output_path=str(tmp_path / "result.csv"), api=api, **kwargs)
+
+
+def test_read_seeds_dedupes_and_keeps_order():
+    text = f"url\n{SEED_B}\n{SEED_A},memo\n{SEED_B}\nhttps://example.com/x\n"
+    assert read_seeds(text) == [SEED_B, SEED_A]
+
+
+def test_resume_skips_done_seeds_and_ignores_broken_lines(tmp_path):
+    state = tmp_path / "state.jsonl"
+    state.write_text(
+        json.dumps({"seed": SEED_A, "status": "done", "product": {}, "competitors": []}) + "\n"
+        + json.dumps({"seed": SEED_B, "status": "error", "message": "x"}) + "\n"
+        + '{"seed": "https://item.rakuten.co.jp/shop-b/', encoding="utf-8")
+    api = FakeAPI()
+    job = make_job(tmp_path, api)
+    assert job.done == {SEED_A}
+
+    asyncio.run(job.run())
+
+    assert api.searched == ["shop-b"]
+    assert job.finished
+    with open(tmp_path / "result.csv", encoding="utf-8-sig") as f:
+        rows = list(csv.reader(f))
+    assert [row[4] for row in rows[1:]] == ["https://item/common", "https://item/shop-b"]
+
+
+def test_search_error_is_recorded_and_retried_on_resume(tmp_path):
+    # APIエラーは競合0件の完了ではなくエラーとして記録し、次の実行で再検索する
+    job = make_job(tmp_path, FakeAPI(fail={"shop-b"}), concurrency=1)
+    asyncio.run(job.run())
+    assert job.done == {SEED_A}
+    assert job.progress()["errors"] == 1
+
+    api = FakeAPI()
+    resumed = make_job(tmp_path, api)
+    assert resumed.progress()["errors"] == 1
+    asyncio.run(resumed.run())
+    assert api.searched == ["shop-b"]
+    assert resumed.done == {SEED_A, SEED_B}
+    assert resumed.progress()["errors"] == 0
+
+
+def test_output_dedupes_competitors_across_seeds(tmp_path):
+    job = make_job(tmp_path, FakeAPI(), concurrency=1)
+    asyncio.run(job.run())
+    urls = [row[4] for row in job.iter_rows()]
+    assert urls == ["https://item/common", "https://item/shop-a", "https://item/shop-b"]
+
+
+def test_lease_held_elsewhere_blocks_run(tmp_path):
+    shared = SQLiteState(":memory:")
+    api = FakeAPI()
+    job = make_job(tmp_path, api, job_id="job1", shared=shared)
+    assert shared.acquire_lease("batch:job1:lease", ttl=60, owner="other-worker")
+    assert job.running_elsewhere()
+
+    asyncio.run(job.run())
+
+    assert api.searched == []
+    assert not job.finished
+
+
+def test_lease_released_after_run(tmp_path):
+    shared = SQLiteState(":memory:")
+    job = make_job(tmp_path, FakeAPI(), job_id="job2", shared=shared)
+    asyncio.run(job.run())
+    assert job.finished
+    assert shared.get("batch:job2:lease") is None
+    assert shared.get_json("batch:job2:progress")["done"] == 2
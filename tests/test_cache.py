@@ -0,0 +1,116 @@
+import time
+
+from cache import JanCache, ListingCache, TTLCache
+
+
+def make_cache(**kwargs) -> JanCache:
+    return JanCache(path=":memory:", **kwargs)
+
+
+def accessed_at(cache: JanCache, url: str) -> float:
+    return cache._conn.execute("SELECT accessed_at FROM jan_cache WHERE url = ?", (url,)).fetchone()[0]
+
+
+def test_jan_cache_hit_and_miss():
+    cache = make_cache()
+    cache.set("https://item/a", "4901234567894", "スクレイピング")
+    assert cache.get("https://item/a") == ("4901234567894", "スクレイピング")
+    assert cache.get("https://item/b") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_jan_cache_negative_entry_uses_shorter_ttl():
+    cache = make_cache(ttl=3600, negative_ttl=10)
+    cache.set("https://item/found", "4901234567894", "スクレイピング")
+    cache.set("https://item/missing", "")
+    stale = time.time() - 60
+    cache._conn.execute("UPDATE jan_cache SET fetched_at = ?", (stale,))
+    assert cache.get_many(["https://item/found", "https://item/missing"]) == {
+        "https://item/found": ("4901234567894", "スクレイピング"),
+    }
+
+
+def test_jan_cache_touches_only_rows_older_than_interval():
+    cache = make_cache(touch_interval=3600)
+    cache.set("https://item/recent", "4901234567894", "スクレイピング")
+    cache.set("https://item/old", "4901234567894", "スクレイピング")
+    recent = time.time() - 60
+    old = time.time() - 7200
+    cache._conn.execute("UPDATE jan_cache SET accessed_at = ? WHERE url = ?", (recent, "https://item/recent"))
+    cache._conn.execute("UPDATE jan_cache SET accessed_at = ? WHERE url = ?", (old, "https://item/old"))
+
+    cache.get_many(["https://item/recent", "https://item/old"])
+
+    assert accessed_at(cache, "https://item/recent") == recent
+    assert accessed_at(cache, "https://item/old") > old
+
+
+def test_jan_cache_evicts_least_recently_accessed():
+    cache = make_cache(max_entries=10)
+    for i in range(10):
+        cache.set(f"https://item/{i}", "")
+    cache._conn.execute("UPDATE jan_cache SET accessed_at = 0 WHERE url = 'https://item/0'")
+    cache._writes = 100  # 次の書き込みで件数を確認させる
+    cache.set("https://item/new", "")
+    assert cache.get("https://item/0") is None
+    assert cache.get("https://item/new") is not None
+    assert cache.stats()["size"] <= 10
+
+
+def records(*prices: int) -> list[dict]:
+    return [{"price": price, "url": f"https://item/{price}"} for price in prices]
+
+
+def test_listing_cache_exact_band():
+    cache = ListingCache(ttl=60)
+    cache.set("100", 700, 1300, pages=2, complete=False, records=records(*range(700, 1300, 10)))
+    assert len(cache.get("100", 700, 1300, pages=1)) == 30
+    assert len(cache.get("100", 700, 1300, pages=2)) == 60
+    # 未取得のページ数は使い回さない
+    assert cache.get("100", 700, 1300, pages=3) is None
+
+
+def test_listing_cache_reuses_complete_wider_band():
+    cache = ListingCache(ttl=60)
+    cache.set("100", 500, 1500, pages=1, complete=True, records=records(600, 900, 1100, 1400))
+    assert [r["price"] for r in cache.get("100", 800, 1200, pages=1)] == [900, 1100]
+    assert cache.stats()["band_hits"] == 1
+    # 範囲外・別ジャンルは使わない
+    assert cache.get("100", 400, 1200, pages=1) is None
+    assert cache.get("200", 800, 1200, pages=1) is None
+
+
+def test_listing_cache_ignores_incomplete_wider_band():
+    cache = ListingCache(ttl=60)
+    cache.set("100", 500, 1500, pages=1, complete=False, records=records(600, 900))
+    assert cache.get("100", 800, 1200, pages=1) is None
+
+
+def test_listing_cache_expires():
+    cache = ListingCache(ttl=60)
+    cache.set("100", 500, 1500, pages=1, complete=True, records=records(900))
+    cache._genres["100"][0].fetched_at -= 120
+    assert cache.get("100", 500, 1500, pages=1) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_listing_cache_evicts_oldest():
+    cache = ListingCache(ttl=60, max_entries=2)
+    for i, genre in enumerate(("a", "b", "c")):
+        cache.set(genre, 0, 100, pages=1, complete=True, records=records(50))
+        cache._genres[genre][0].fetched_at -= 10 - i
+    assert cache.get("a", 0, 100, pages=1) is None
+    assert cache.get("c", 0, 100, pages=1) is not None
+
+
+def test_ttl_cache_lru_and_expiry():
+    cache = TTLCache(ttl=60, max_entries=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache._data["a"] = (time.time() - 120, 1)
+    assert cache.get("a") is None
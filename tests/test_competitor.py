@@ -0,0 +1,33 @@
+import pytest
+
+from competitor import Competitor
+from jan_extract import is_valid_jan, valid_jans
+
+RECORD = {"name": "商品", "price": 980, "image": "https://img/1", "jan": "4901234567894",
+          "janSource": "API", "url": "https://item/1", "shop": "他店", "shopCode": "other"}
+
+
+def test_record_roundtrip_and_dict_access():
+    competitor = Competitor.from_record(RECORD)
+    assert competitor.to_dict() == {key: RECORD[key] for key in competitor.keys()}
+    assert competitor["janSource"] == competitor.jan_source == "API"
+    assert competitor.as_row() == ["4901234567894", "商品", "他店", 980, "https://item/1"]
+    competitor["janSource"] = "スクレイピング"
+    assert competitor.jan_source == "スクレイピング"
+    assert competitor.get("missing", "-") == "-"
+    with pytest.raises(KeyError):
+        competitor["missing"]
+
+
+def test_slots_reject_unknown_attributes():
+    competitor = Competitor()
+    with pytest.raises(AttributeError):
+        competitor.extra = 1
+
+
+def test_batched_checksum_matches_single_validation():
+    # 候補をまとめて検証しても1件ずつの検証と同じ結果になる
+    codes = ["4901234567894", "4901234567895", "4549123456784", "1001234567893",
+             "0000000000000", "9780201379624", "4512345678901"]
+    text = " / ".join(codes)
+    assert valid_jans(text) == [code for code in codes if is_valid_jan(code)]
@@ -0,0 +1,52 @@
+import csv
+import gzip
+import io
+
+import pytest
+
+import export
+from export import EXPORT_HEADERS, parse_selected, stream_export
+
+
+def rows(count: int) -> list[list]:
+    return [["4901234567894", f"商品{i}", "ショップ", 1000 + i, f"https://item/{i}"] for i in range(count)]
+
+
+def read_csv(data: bytes) -> list[list[str]]:
+    text = data.decode("utf-8")
+    assert text.startswith("\ufeff")
+    return list(csv.reader(io.StringIO(text[1:])))
+
+
+def test_csv_has_bom_header_and_all_rows(monkeypatch):
+    monkeypatch.setattr(export, "CHUNK_ROWS", 10)
+    chunks = list(stream_export(iter(rows(25)), EXPORT_HEADERS, "csv"))
+    assert len(chunks) == 3  # 10行ごと + 残り
+    parsed = read_csv(b"".join(chunks))
+    assert parsed[0] == EXPORT_HEADERS
+    assert len(parsed) == 26
+    assert parsed[-1] == ["4901234567894", "商品24", "ショップ", "1024", "https://item/24"]
+
+
+def test_csv_with_no_rows_is_header_only():
+    assert read_csv(b"".join(stream_export(iter(()), EXPORT_HEADERS, "csv"))) == [EXPORT_HEADERS]
+
+
+def test_csv_gz_decompresses_to_same_csv():
+    plain = b"".join(stream_export(iter(rows(1200)), EXPORT_HEADERS, "csv"))
+    compressed = b"".join(stream_export(iter(rows(1200)), EXPORT_HEADERS, "csv.gz"))
+    assert gzip.decompress(compressed) == plain
+
+
+def test_parquet_round_trip():
+    pq = pytest.importorskip("pyarrow.parquet")
+    data = b"".join(stream_export(iter(rows(1200)), EXPORT_HEADERS, "parquet"))
+    table = pq.read_table(io.BytesIO(data))
+    assert table.num_rows == 1200
+    assert table.column("価格").to_pylist()[:2] == [1000, 1001]
+
+
+def test_parse_selected_allows_pipes_in_name():
+    assert parse_selected("4901234567894|商品|A|B|ショップ|1980|https://item/x") == [
+        "4901234567894", "商品|A|B", "ショップ", "1980", "https://item/x"]
+    assert parse_selected("4901234567894|商品") is None
@@ -0,0 +1,81 @@
+import json
+import os
+
+import pytest
+
+from jan_extract import JanScanner, find_labeled_jan, is_valid_jan, valid_jans
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "bench", "fixtures", "pages")
+with open(os.path.join(FIXTURES, "expected.json"), encoding="utf-8") as f:
+    EXPECTED = json.load(f)
+
+PAGE = "<html><body><table><tr><th>JANコード</th><td>4901234567894</td></tr></table></body></html>"
+
+
+def scan(data: bytes, chunk_size: int, encoding: str | None = None) -> str:
+    scanner = JanScanner()
+    for i in range(0, len(data), chunk_size):
+        if scanner.feed(data[i:i + chunk_size]):
+            break
+    return scanner.result(encoding)
+
+
+def test_is_valid_jan():
+    assert is_valid_jan("4901234567894")
+    assert not is_valid_jan("4901234567895")
+    assert not is_valid_jan("1001234567893")  # 10 始まりは対象外
+    assert not is_valid_jan("490123456789")
+    assert not is_valid_jan("４９０１２３４５６７８９４")
+
+
+def test_valid_jans_keeps_order_and_drops_bad_checksums():
+    text = "4901234567895 4549123456784 / 4901234567894"
+    assert valid_jans(text) == ["4549123456784", "4901234567894"]
+
+
+@pytest.mark.parametrize("split", range(1, len(PAGE.encode("utf-8"))))
+def test_labeled_jan_found_at_every_chunk_boundary(split):
+    data = PAGE.encode("utf-8")
+    scanner = JanScanner()
+    scanner.feed(data[:split])
+    scanner.feed(data[split:])
+    assert scanner.result() == "4901234567894"
+
+
+def test_digits_cut_at_chunk_end_are_not_taken_early():
+    # 13桁で区切れていても、次のチャンクに数字が続けば14桁なのでJANではない
+    scanner = JanScanner()
+    assert not scanner.feed(b"JAN: 4901234567894")
+    assert not scanner.feed(b"1</td>")
+    assert find_labeled_jan(b"JAN: 4901234567894", partial=True) == ""
+    assert find_labeled_jan(b"JAN: 4901234567894") == "4901234567894"
+
+
+@pytest.mark.parametrize("text, expected", [
+    (b"<p>ocean 4901234567894</p>", ""),
+    (b"<p>Dejan 4901234567894</p>", ""),
+    (b"<p>EAN: 4901234567894</p>", "4901234567894"),
+    (b"<p>jan code: 4901234567894</p>", "4901234567894"),
+    (b"<th>JAN</th>" + b" " * 80 + b"<td>4901234567894</td>", ""),
+])
+def test_label_must_be_a_word_close_to_the_digits(text, expected):
+    assert find_labeled_jan(text) == expected
+
+
+def test_scanner_stops_reading_once_found():
+    data = PAGE.encode("utf-8") + b"<p>" + b"x" * 100000 + b"</p>"
+    scanner = JanScanner()
+    for i in range(0, len(data), 64):
+        if scanner.feed(data[i:i + 64]):
+            break
+    assert scanner.found == "4901234567894"
+    assert scanner.bytes_read < 1000
+
+
+@pytest.mark.parametrize("filename", sorted(EXPECTED))
+@pytest.mark.parametrize("chunk_size", [7, 1024, 16 * 1024])
+def test_fixture_pages(filename, chunk_size):
+    with open(os.path.join(FIXTURES, filename), "rb") as f:
+        data = f.read()
+    encoding = "shift_jis" if "shift_jis" in filename else "utf-8"
+    assert scan(data, chunk_size, encoding) == EXPECTED[filename]
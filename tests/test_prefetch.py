@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+
+from cache import JanCache
+from metrics import COMPETITORS, JAN_SOURCES
+from page_store import PageStore
+from prefetch import Prefetcher
+from product_index import ProductIndex
+from rakuten import AsyncRakutenAPI
+from rate_limiter import RateLimiter
+
+SEED = "https://item.rakuten.co.jp/self/item-1/"
+JAN = "4901234567894"
+PRODUCT = {"name": "自社商品", "price": 1000, "categoryId": "100", "shopId": "self", "shopName": "自社",
+           "jan": JAN, "janSource": "API", "url": SEED, "image": "", "categoryName": ""}
+
+
+def api_item(shop: str, caption: str = "") -> dict:
+    return {"Item": {"itemName": f"{shop}の商品", "itemPrice": 950, "itemUrl": f"https://item/{shop}",
+                     "shopName": shop, "shopCode": shop, "itemCaption": caption}}
+
+
+def test_prefetch_warms_cache_used_by_next_search():
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if "genreId" in request.url.params:
+            sent.append("genre")
+            items = [api_item("other", f"JAN:{JAN}"), api_item("nojan")]
+        else:
+            sent.append("jan")
+            items = [api_item("elsewhere", f"JAN:{JAN}")]
+        return httpx.Response(200, json={"Items": items, "count": len(items), "pageCount": 1})
+
+    async def run():
+        api = AsyncRakutenAPI(jan_cache=JanCache(":memory:"), product_index=ProductIndex(":memory:"),
+                              page_store=PageStore(path=""), rate_limiter=RateLimiter(50.0, 1))
+        api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        api.item_cache.set(("self", "item-1"), PRODUCT)
+        prefetcher = Prefetcher(api)
+        counted = (COMPETITORS.value(), JAN_SOURCES.value(source="caption"))
+
+        assert prefetcher.start(SEED) == "started"
+        await asyncio.gather(*(entry.listing for entry in list(prefetcher._in_flight.values())))
+        # 先読みだけでは競合数・JANの取得元を数えない
+        assert (COMPETITORS.value(), JAN_SOURCES.value(source="caption")) == counted
+        assert sorted(sent) == ["genre", "jan"]
+
+        product = await prefetcher.get_item("self", "item-1")
+        competitors, _ = await api.find_competitors(
+            product["categoryId"], 700, 1300, product["shopId"], pages=1, jan=product["jan"])
+        await api._client.aclose()
+        return competitors, counted
+
+    competitors, counted = asyncio.run(run())
+    # 検索はAPIを呼ばずに先読みの結果（JAN検索の分も）を使う
+    assert len(sent) == 2
+    assert [c.url for c in competitors] == ["https://item/elsewhere", "https://item/other", "https://item/nojan"]
+    assert COMPETITORS.value() == counted[0] + 3
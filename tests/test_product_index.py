@@ -0,0 +1,50 @@
+from product_index import ProductIndex
+
+
+def record(url: str, price: int, jan: str = "", shop_code: str = "shop") -> dict:
+    return {"url": url, "price": price, "jan": jan, "janSource": "API" if jan else "",
+            "name": url, "shop": shop_code, "shopCode": shop_code, "image": ""}
+
+
+def test_reuse_ttl_defaults_to_listing_cache_ttl(monkeypatch):
+    monkeypatch.delenv("PRODUCT_INDEX_REUSE_TTL", raising=False)
+    monkeypatch.setenv("LISTING_CACHE_TTL", "120")
+    assert ProductIndex(":memory:").reuse_ttl == 120
+    monkeypatch.delenv("LISTING_CACHE_TTL")
+    assert ProductIndex(":memory:").reuse_ttl == 900
+    monkeypatch.setenv("PRODUCT_INDEX_REUSE_TTL", "0")
+    assert ProductIndex(":memory:").reuse_ttl == 0
+
+
+def test_covered_listing_within_reuse_ttl():
+    index = ProductIndex(":memory:", reuse_ttl=60)
+    index.add_listing("100", 500, 1500, 1, [record("a", 600), record("b", 1000), record("c", 1400)],
+                      complete=True)
+    assert [r["url"] for r in index.covered_listing("100", 800, 1200, 1)] == ["b"]
+    # 範囲外・別ジャンルは検索済みではない
+    assert index.covered_listing("100", 400, 1200, 1) is None
+    assert index.covered_listing("200", 800, 1200, 1) is None
+
+
+def test_covered_listing_expires_with_reuse_ttl():
+    index = ProductIndex(":memory:", reuse_ttl=60)
+    index.add_listing("100", 500, 1500, 1, [record("a", 600)], complete=True)
+    index._conn.execute("UPDATE coverage SET covered_at = covered_at - 120")
+    assert index.covered_listing("100", 500, 1500, 1) is None
+
+
+def test_uncovered_listing_only_stores_products():
+    index = ProductIndex(":memory:", reuse_ttl=60)
+    index.add_listing("100", 500, 1500, 1, [record("a", 600)], complete=True, covered=False)
+    assert index.covered_listing("100", 500, 1500, 1) is None
+
+
+def test_by_jan_sorted_by_price_and_keeps_known_jan():
+    index = ProductIndex(":memory:")
+    index.add_listing("", 0, 0, 1, [record("a", 900, "4901234567894", "s1"),
+                                    record("b", 800, "4901234567894", "s2")], complete=False, covered=False)
+    # JANなしで再登録されても既知のJANは残る
+    index.add_listing("100", 0, 2000, 1, [record("a", 700)], complete=True)
+    offers = index.by_jan("4901234567894")
+    assert [(o["url"], o["price"]) for o in offers] == [("a", 700), ("b", 800)]
+    assert offers[0]["genreId"] == "100"
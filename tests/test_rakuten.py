@@ -0,0 +1,238 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+import requests
+
+from cache import JanCache
+from page_store import PageStore
+from product_index import ProductIndex
+from rakuten import AsyncRakutenAPI, _RakutenBase, _SeedScan
+
+PAGE = ("<html><head><title>【楽天市場】テスト 商品 500ml:テストショップ</title></head>"
+        "<body><table><tr><th>JANコード</th><td>4901234567894</td></tr></table></body></html>").encode("utf-8")
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, len(PAGE)])
+def test_seed_scan_reads_title_and_jan_at_any_chunk_size(chunk_size):
+    scan = _SeedScan()
+    for i in range(0, len(PAGE), chunk_size):
+        if scan.feed(PAGE[i:i + chunk_size], "utf-8"):
+            break
+    page = scan.page("utf-8")
+    assert (page.name, page.shop, page.jan, page.scanned) == (
+        "テスト 商品 500ml", "テストショップ", "4901234567894", True)
+
+
+def http_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://item.rakuten.co.jp/shop/item/")
+    return httpx.HTTPStatusError("error", request=request, response=httpx.Response(status, request=request))
+
+
+def requests_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError("error", response=response)
+
+
+@pytest.mark.parametrize("error, overloaded", [
+    (httpx.ReadTimeout("timeout"), True),
+    (httpx.ConnectError("refused"), True),
+    (http_error(503), True),
+    (http_error(404), False),
+    (requests.ConnectTimeout("timeout"), True),
+    (requests.ConnectionError("refused"), True),
+    (requests_error(429), True),
+    (requests_error(404), False),
+    (ValueError("broken page"), False),
+])
+def test_page_failures_are_classified_the_same_for_both_clients(error, overloaded):
+    # 同期版（requests）・非同期版（httpx）のどちらの例外も同じ基準で過負荷とみなす
+    assert _RakutenBase._page_failed(error) is overloaded
+
+
+def record(url: str, jan: str = "") -> dict:
+    return {"name": url, "price": 100, "image": "", "jan": jan, "janSource": "API" if jan else "",
+            "url": url, "shop": "他店", "shopCode": "other"}
+
+
+class StubListingAPI(AsyncRakutenAPI):
+    """ジャンル検索はすぐ、JAN検索は jan_delay 秒後に返す"""
+
+    jan_delay = 0.0
+    jan_finished = False
+
+    async def _genre_listing(self, category_id, price_min, price_max, pages, sent=None, strict=False):
+        await asyncio.sleep(0.01)
+        sent.set()
+        return [record("https://item/genre")]
+
+    async def _jan_listing(self, jan, pages, after=None, strict=False):
+        if self.jan_delay:
+            await asyncio.sleep(self.jan_delay)
+        self.jan_finished = True
+        return [record("https://item/jan", jan)]
+
+
+def find(api: StubListingAPI) -> tuple[list, float]:
+    async def run():
+        start = time.monotonic()
+        competitors, _ = await api.find_competitors("100", 0, 1000, "self", jan="4901234567894")
+        elapsed = time.monotonic() - start
+        # 待たなかったJAN検索も裏で最後まで進む
+        await asyncio.gather(*api._background)
+        return [c.url for c in competitors], elapsed
+
+    return asyncio.run(run())
+
+
+def make_api() -> StubListingAPI:
+    return StubListingAPI(jan_cache=JanCache(":memory:"), product_index=ProductIndex(":memory:"),
+                          page_store=PageStore(path=""))
+
+
+def test_jan_listing_merged_when_already_finished(monkeypatch):
+    monkeypatch.delenv("JAN_SEARCH_WAIT", raising=False)
+    urls, _ = find(make_api())
+    assert urls == ["https://item/jan", "https://item/genre"]
+
+
+def test_slow_jan_listing_does_not_delay_search_by_default(monkeypatch):
+    monkeypatch.delenv("JAN_SEARCH_WAIT", raising=False)
+    api = make_api()
+    api.jan_delay = 0.3
+    urls, elapsed = find(api)
+    assert urls == ["https://item/genre"]
+    assert elapsed < 0.2
+    assert api.jan_finished
+
+
+def test_genre_search_is_sent_before_jan_search(monkeypatch):
+    # 本物のリミッターで、ジャンル検索の1ページ目が先に送信枠を取る
+    monkeypatch.delenv("JAN_SEARCH_WAIT", raising=False)
+    from rate_limiter import RateLimiter
+    sent = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        sent.append("genre" if "genreId" in request.url.params else "jan")
+        return httpx.Response(200, json={"Items": [], "count": 0, "pageCount": 1})
+
+    async def run():
+        api = AsyncRakutenAPI(jan_cache=JanCache(":memory:"), product_index=ProductIndex(":memory:"),
+                              page_store=PageStore(path=""), rate_limiter=RateLimiter(20.0, 1))
+        api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        await api.find_competitors("100", 0, 1000, "self", jan="4901234567894")
+        await asyncio.gather(*api._background)
+        await api._client.aclose()
+
+    asyncio.run(run())
+    assert sent == ["genre", "jan"]
+
+
+def test_not_modified_page_reuses_stored_body():
+    # 2回目は保存時の ETag を付けて問い合わせ、304 なら保存分からJANとタイトルを読む
+    url = "https://item.rakuten.co.jp/shop/item/"
+    seen = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen.append(request.headers.get("if-none-match"))
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, content=PAGE, headers={"ETag": '"v1"', "Content-Type": "text/html; charset=utf-8"})
+
+    async def run():
+        store = PageStore(path=":memory:")
+        api = AsyncRakutenAPI(jan_cache=JanCache(":memory:"), product_index=ProductIndex(":memory:"),
+                              page_store=store)
+        api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        jans = [await api._scrape_jan_from_page(url), await api._scrape_jan_from_page(url)]
+        seed = await api._fetch_seed_page("shop", "item")
+        await api._client.aclose()
+        return jans, seed, store.stats()
+
+    jans, seed, stats = asyncio.run(run())
+    assert seen == [None, '"v1"', '"v1"']
+    assert jans == ["4901234567894", "4901234567894"]
+    assert (seed.name, seed.jan) == ("テスト 商品 500ml", "4901234567894")
+    assert (stats["fetched"], stats["not_modified"]) == (1, 2)
+
+
+def test_not_modified_without_stored_page_is_a_failure():
+    # 保存分が消えていれば 304 は使えないので取得失敗として扱う
+    store = PageStore(path=":memory:")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(304)
+
+    async def run():
+        api = AsyncRakutenAPI(jan_cache=JanCache(":memory:"), product_index=ProductIndex(":memory:"),
+                              page_store=store)
+        api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        jan = await api._scrape_jan_from_page("https://item.rakuten.co.jp/shop/gone/")
+        await api._client.aclose()
+        return jan
+
+    assert asyncio.run(run()) is None
+    assert store.stats()["not_modified"] == 0
+
+
+class CountingItemAPI(AsyncRakutenAPI):
+    """商品の検索（APIと商品ページ）を呼んだ回数を数える"""
+
+    lookups = 0
+
+    async def _lookup_item(self, shop_code, item_id):
+        self.lookups += 1
+        return {"name": "自社商品", "price": 1000, "categoryId": "100", "shopId": shop_code,
+                "shopName": "自社", "jan": "4901234567894", "janSource": "API",
+                "url": f"https://item.rakuten.co.jp/{shop_code}/{item_id}/", "image": "", "categoryName": ""}
+
+
+def test_get_item_is_cached_until_ttl_expires():
+    api = CountingItemAPI(jan_cache=JanCache(":memory:"), product_index=ProductIndex(":memory:"),
+                          page_store=PageStore(path=""))
+    api.item_cache.ttl = 0.05
+
+    async def run():
+        first = await api.get_item("shop", "item")
+        # 呼び出し側が書き換えてもキャッシュの中身は変わらない
+        first["price"] = 1
+        second = await api.get_item("shop", "item")
+        other = await api.get_item("shop", "other")
+        await asyncio.sleep(0.06)
+        expired = await api.get_item("shop", "item")
+        return second, other, expired
+
+    second, other, expired = asyncio.run(run())
+    assert second["price"] == 1000
+    assert other["url"].endswith("/other/")
+    assert api.lookups == 3
+    assert expired["price"] == 1000
+    assert api.item_cache.stats()["hits"] == 1
+
+
+def test_multi_page_search_dedupes_items_across_pages():
+    # ページの境目で同じ商品が2回返っても1件にし、総ページ数より先は取りに行かない
+    from rate_limiter import RateLimiter
+    pages = {1: ["a", "b"], 2: ["b", "c"], 3: ["c", "d"]}
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        page = int(request.url.params.get("page", 1))
+        requested.append(page)
+        items = [{"Item": {"itemName": name, "itemPrice": 100, "itemUrl": f"https://item/{name}",
+                           "shopName": "他店", "shopCode": "other"}} for name in pages[page]]
+        return httpx.Response(200, json={"Items": items, "count": 6, "pageCount": 3})
+
+    async def run():
+        api = AsyncRakutenAPI(jan_cache=JanCache(":memory:"), product_index=ProductIndex(":memory:"),
+                              page_store=PageStore(path=""), rate_limiter=RateLimiter(50.0, 3))
+        api._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        competitors, _ = await api.find_competitors("100", 0, 1000, "self", pages=5)
+        await api._client.aclose()
+        return competitors
+
+    competitors = asyncio.run(run())
+    assert sorted(requested) == [1, 2, 3]
+    assert sorted(c.url for c in competitors) == [f"https://item/{name}" for name in "abcd"]
@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+from rate_limiter import RateLimiter
+
+
+def grant_order(limiter: RateLimiter, tickets: dict, steps: int) -> list[str]:
+    """1秒ずつ時刻を進めて払い出し、払い出された順に名前を返す"""
+    start = limiter._updated
+    order = []
+    for step in range(steps):
+        limiter._dispatch(start + step)
+        for name, ticket in tickets.items():
+            if ticket.granted and name not in order:
+                order.append(name)
+    return order
+
+
+def test_round_robin_between_requesters():
+    limiter = RateLimiter(rate=1.0, burst=1)
+    tickets = {f"a{i}": limiter._enqueue("a") for i in range(3)}
+    tickets["b0"] = limiter._enqueue("b")
+    tickets["c0"] = limiter._enqueue("c")
+    # a が先に3件並べても、b・c は a の2件目より先に払い出される
+    assert grant_order(limiter, tickets, 5) == ["a0", "b0", "c0", "a1", "a2"]
+    assert limiter.queue_depth() == 0
+
+
+def test_dispatch_respects_rate():
+    limiter = RateLimiter(rate=1.0, burst=2)
+    tickets = {f"a{i}": limiter._enqueue("a") for i in range(3)}
+    wait = limiter._dispatch(limiter._updated)
+    assert [t.granted for t in tickets.values()] == [True, True, False]
+    assert 0 < wait <= 1.0
+
+
+def test_throttled_response_pauses_everyone():
+    limiter = RateLimiter(rate=1.0, burst=1)
+    delay = limiter.retry_delay(429, "5", attempt=0)
+    assert delay == 5.0
+    ticket = limiter._enqueue("a")
+    start = limiter._updated
+    assert limiter._dispatch(start + 4) > 0
+    assert not ticket.granted
+    limiter._dispatch(start + 7)
+    assert ticket.granted
+    assert limiter.stats()["throttled"] == 1
+
+
+def test_cancelled_acquire_leaves_queue():
+    async def run():
+        limiter = RateLimiter(rate=0.01, burst=1)
+        await limiter.acquire_async("a")
+        waiter = asyncio.create_task(limiter.acquire_async("b"))
+        await asyncio.sleep(0.01)
+        assert limiter.queue_depth() == 1
+        waiter.cancel()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            pass
+        return limiter.queue_depth()
+
+    assert asyncio.run(run()) == 0
+
+
+class SlowShared:
+    """共有先の代わり（応答に時間がかかる）"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.calls = 0
+
+    def take_slot(self, bucket: str, rate: float, burst: int) -> float:
+        time.sleep(self.delay)
+        self.calls += 1
+        return 0.0
+
+
+def test_shared_slot_does_not_block_event_loop():
+    async def run():
+        limiter = RateLimiter(rate=100.0, burst=1, shared=SlowShared(0.2))
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        await limiter.acquire_async("a")
+        task.cancel()
+        return ticks, limiter.shared.calls
+
+    ticks, calls = asyncio.run(run())
+    # 共有先を待つ間もイベントループは動き続ける
+    assert calls == 1
+    assert ticks >= 5
+
+
+class PausingShared:
+    """枠は払い出すが、問い合わせ中に別のリクエストが 429 を受ける共有先"""
+
+    def __init__(self):
+        self.limiter = None
+        self.calls = 0
+
+    def take_slot(self, bucket: str, rate: float, burst: int) -> float:
+        self.calls += 1
+        self.limiter._throttle(429, "5", attempt=0)
+        return 0.0
+
+
+def test_shared_slot_not_granted_while_paused():
+    shared = PausingShared()
+    limiter = RateLimiter(rate=100.0, burst=1, shared=shared)
+    shared.limiter = limiter
+    ticket = limiter._enqueue("a")
+    wait = limiter._poll(ticket)
+    assert not ticket.granted
+    assert 4.5 < wait <= 5.0
+    # 止めている間は共有先にも問い合わせない
+    assert limiter._poll(ticket) > 4.5
+    assert shared.calls == 1
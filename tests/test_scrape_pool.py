@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+from cache import JanCache
+from competitor import Competitor
+from page_store import PageStore
+from product_index import ProductIndex
+from rakuten import AsyncRakutenAPI
+from scrape_pool import MIN_PAGE_TIMEOUT, PAGE_TIMEOUT, ScrapePool
+
+
+def make_pool(**kwargs) -> ScrapePool:
+    options = dict(initial=4, min_limit=2, max_limit=8, target_latency=1.0, deadline=5)
+    options.update(kwargs)
+    return ScrapePool(**options)
+
+
+def test_additive_increase_after_a_window_of_fast_pages():
+    pool = make_pool()
+    # 1件ごとに 1/上限 ずつ増えるので、上限（4）と同じくらいの件数で1増える
+    for _ in range(3):
+        pool.record(0.2, overloaded=False)
+    assert pool.stats()["limit"] == 4
+    for _ in range(2):
+        pool.record(0.2, overloaded=False)
+    assert pool.stats()["limit"] == 5
+    for _ in range(100):
+        pool.record(0.2, overloaded=False)
+    assert pool.stats()["limit"] == 8  # 上限で止まる
+
+
+def test_multiplicative_decrease_is_spaced_out():
+    pool = make_pool(initial=8)
+    pool.record(0.5, overloaded=True)
+    assert pool.limit == 8 * 0.7
+    # 直後の失敗では続けて下げない
+    pool.record(0.5, overloaded=True)
+    assert pool.stats()["decreases"] == 1
+    pool._last_decrease -= 10
+    pool.record(0.5, overloaded=True)
+    assert pool.stats()["decreases"] == 2
+    for _ in range(10):
+        pool._last_decrease -= 10
+        pool.record(0.5, overloaded=True)
+    assert pool.stats()["limit"] == 2  # 下限で止まる
+
+
+def test_slow_page_counts_as_overload():
+    pool = make_pool(initial=8)
+    pool.record(2.5, overloaded=False)
+    assert pool.stats()["decreases"] == 1
+
+
+def test_waiters_are_granted_in_order_as_slots_free():
+    async def run():
+        pool = make_pool(initial=2)
+        order = []
+
+        async def worker(name):
+            async with pool.slot():
+                order.append(name)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(worker(i) for i in range(6)))
+        return order, pool.stats()
+
+    order, stats = asyncio.run(run())
+    assert order == list(range(6))
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_sync_acquire_times_out_and_leaves_queue():
+    pool = make_pool(initial=2)
+    assert pool.acquire() and pool.acquire()
+    assert not pool.acquire(timeout=0.01)
+    assert pool.stats()["waiting"] == 0
+    pool.release()
+    assert pool.acquire(timeout=0.01)
+
+
+def test_page_timeout_follows_deadline():
+    pool = make_pool()
+    assert ScrapePool.page_timeout(None) == PAGE_TIMEOUT
+    assert ScrapePool.page_timeout(pool.deadline(60)) == PAGE_TIMEOUT
+    assert abs(ScrapePool.page_timeout(pool.deadline(2)) - 2) < 0.1
+    assert ScrapePool.page_timeout(pool.deadline(0)) == MIN_PAGE_TIMEOUT
+
+
+class SlowScrapeAPI(AsyncRakutenAPI):
+    """URLの末尾の秒数だけ待ってJANなしを返す"""
+
+    async def _scrape_jan_from_page(self, url, timeout=5):
+        await asyncio.sleep(float(url.rsplit("/", 1)[1]))
+        return ""
+
+
+def test_iter_scraped_jans_stops_at_deadline(tmp_path):
+    async def run():
+        api = SlowScrapeAPI(jan_cache=JanCache(":memory:"), scrape_pool=make_pool(initial=4),
+                            product_index=ProductIndex(":memory:"), page_store=PageStore(path=""))
+        items = [Competitor(url=f"https://item/{delay}") for delay in ("0.01", "0.02", "5", "5")]
+        start = time.monotonic()
+        done = [item.url async for item in api.iter_scraped_jans(items, deadline=time.monotonic() + 0.3)]
+        elapsed = time.monotonic() - start
+        await asyncio.sleep(0)
+        return done, elapsed, api.scrape_pool.stats()
+
+    done, elapsed, stats = asyncio.run(run())
+    assert done == ["https://item/0.01", "https://item/0.02"]
+    assert elapsed < 1
+    assert stats["in_flight"] == 0
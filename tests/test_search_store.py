@@ -0,0 +1,59 @@
+import asyncio
+
+from competitor import Competitor
+from search_store import SearchStore
+
+
+async def make_session(store: SearchStore, count: int = 3):
+    competitors = [Competitor(name=f"商品{i}", url=f"https://item/{i}") for i in range(count)]
+    return await store.create(product={"jan": ""}, competitors=competitors, price_min=0,
+                        price_max=1000, price_mode_label="自動")
+
+
+def test_subscribe_replays_every_page_event_then_done():
+    async def run():
+        session = await make_session(SearchStore())
+        await session.publish("jan", {"index": 0, "jan": "4901234567894", "janSource": "スクレイピング"})
+        await session.publish("miss", {"index": 1})
+        received = []
+
+        async def consume():
+            async for event, data in session.subscribe():
+                received.append(event)
+
+        consumer = asyncio.create_task(consume())
+        await session.publish("miss", {"index": 2})
+        await session.finish()
+        await asyncio.wait_for(consumer, timeout=1)
+        return received
+
+    assert asyncio.run(run()) == ["jan", "miss", "miss", "done"]
+
+
+def test_store_expires_and_caps_sessions():
+    async def run():
+        store = SearchStore(ttl=3600, max_sessions=2)
+        first = await make_session(store)
+        await make_session(store)
+        await make_session(store)
+        assert len(store) == 2
+        return await store.get(first.id)
+
+    assert asyncio.run(run()) is None
+
+
+def test_other_worker_restores_session_from_shared_state(tmp_path):
+    from state import SQLiteState
+
+    async def run():
+        shared = SQLiteState(str(tmp_path / "shared.sqlite3"))
+        session = await make_session(SearchStore(shared=shared))
+        await session.publish("jan", {"index": 1, "jan": "4901234567894", "janSource": "スクレイピング"})
+        await session.finish()
+        # 別のワーカー（別の SearchStore）から検索IDで引く
+        remote = await SearchStore(shared=shared).get(session.id)
+        return remote, [event async for event, _ in remote.subscribe()]
+
+    remote, events = asyncio.run(run())
+    assert remote.competitors[1].jan == "4901234567894"
+    assert events == ["jan", "done"]
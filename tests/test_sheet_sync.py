@@ -0,0 +1,47 @@
+import asyncio
+
+from competitor import Competitor
+from sheet_sync import SheetSyncQueue
+
+
+def competitor(jan: str) -> Competitor:
+    return Competitor(name=f"商品{jan[-3:]}", price=100, jan=jan, url=f"https://item/{jan}", shop="他店")
+
+
+def test_push_counts_only_rows_actually_queued(tmp_path):
+    path = str(tmp_path / "sync.sqlite3")
+    first = SheetSyncQueue(sheet_name="JAN", path=path)
+    # 同じファイルを使う別のワーカー（プロセス内の重複チェックには載っていない）
+    second = SheetSyncQueue(sheet_name="JAN", path=path)
+    assert first.push([competitor("4901234567894"), Competitor(name="JANなし")]) == 1
+    # 先に入ったJANは主キーで弾かれるので、新しい1件だけ数える
+    assert second.push([competitor("4901234567894"), competitor("4549123456784")]) == 1
+    assert first.push([competitor("4901234567894")]) == 0
+    assert first.queued() == 2
+
+
+def test_push_skips_jans_already_synced(tmp_path):
+    path = str(tmp_path / "sync.sqlite3")
+    queue = SheetSyncQueue(sheet_name="JAN", path=path)
+    assert queue.push([competitor("4901234567894"), competitor("4901234567894")]) == 1
+    queue._mark_synced(["4901234567894"])
+    # 同期済みのJANは、キューから消えたあとも別のワーカーからも入らない
+    other = SheetSyncQueue(sheet_name="JAN", path=path)
+    assert other.push([competitor("4901234567894")]) == 0
+    assert queue.push([competitor("4901234567894")]) == 0
+    assert queue.queued() == 0
+
+
+def test_start_fails_fast_without_saved_oauth_token(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SPREADSHEET_AUTH_TYPE", "oauth")
+
+    async def run():
+        queue = SheetSyncQueue(sheet_name="JAN", path=str(tmp_path / "sync.sqlite3"))
+        queue.start()
+        return queue
+
+    queue = asyncio.run(run())
+    # ブラウザ認証を待つ書き込みタスクは始めない
+    assert queue.task is None
+    assert "token.json" in queue.last_error
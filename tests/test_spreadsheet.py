@@ -0,0 +1,106 @@
+import re
+
+from spreadsheet import HEADERS, SheetWriter
+
+
+class FakeSheet:
+    """gspread の Worksheet のうち SheetWriter が使う操作だけを持つシート（行のリスト）"""
+
+    def __init__(self, rows: list[list[str]] | None = None):
+        self.rows = [list(row) for row in rows or []]
+        self.reads: list[list[str]] = []
+
+    def _cells(self, a1: str) -> list[list[str]]:
+        match = re.fullmatch(r"([A-Z])(\d*):([A-Z])(\d*)", a1)
+        first_col, first_row, last_col, last_row = match.groups()
+        cols = slice(ord(first_col) - ord("A"), ord(last_col) - ord("A") + 1)
+        start = int(first_row or 1) - 1
+        end = int(last_row) if last_row else len(self.rows)
+        values = [[cell for cell in row[cols]] for row in self.rows[start:end]]
+        # Sheets API と同じく、末尾の空セル・空行は返さない
+        values = [row[:max((i + 1 for i, c in enumerate(row) if c != ""), default=0)] for row in values]
+        while values and not values[-1]:
+            values.pop()
+        return values
+
+    def batch_get(self, ranges: list[str]) -> list:
+        self.reads.append(ranges)
+        return [self._cells(a1) for a1 in ranges]
+
+    def update(self, values, range_name):
+        row = int(range_name[1:]) - 1
+        while len(self.rows) <= row:
+            self.rows.append([""] * 6)
+        self.rows[row] = list(values[0])
+
+    def append_rows(self, rows, value_input_option=None, table_range=None):
+        start = len(self.rows) + 1
+        self.rows.extend([list(row) for row in rows])
+        return {"updates": {"updatedRange": f"'シート'!A{start}:F{len(self.rows)}"}}
+
+
+class FakeClient:
+    def __init__(self, sheet: FakeSheet):
+        self.spreadsheet = self
+        self.sheet = sheet
+
+    def worksheet(self, name):
+        return self.sheet
+
+
+def reloads(sheet: FakeSheet) -> int:
+    return sum(1 for ranges in sheet.reads if ranges == ["A:A", "F:F"])
+
+
+def row(jan: str, name: str = "商品") -> list[str]:
+    return [jan, name, "ショップ", "1000", f"https://item/{name}", "2026-01-01 00:00:00"]
+
+
+def test_rows_without_jan_do_not_force_reload():
+    sheet = FakeSheet([HEADERS])
+    writer = SheetWriter(FakeClient(sheet), "シート")
+    writer.add([{"jan": "", "name": "JANなし", "price": 100, "url": "https://item/x"}], dedupe=False)
+    writer.flush()
+    assert reloads(sheet) == 1  # 初回の読み込みのみ
+
+    writer.add([{"jan": "4901234567894", "name": "次", "price": 100, "url": "https://item/y"}])
+    writer.flush()
+    assert reloads(sheet) == 1
+    assert len(sheet.rows) == 3
+
+
+def test_reload_counts_rows_with_empty_jan():
+    sheet = FakeSheet([HEADERS, row("4901234567894", "a"), row("", "b")])
+    writer = SheetWriter(FakeClient(sheet), "シート")
+    assert writer.existing_jans() == {"4901234567894"}
+    assert writer._row_count == 3
+
+
+def test_detects_rows_appended_elsewhere():
+    sheet = FakeSheet([HEADERS, row("4901234567894", "a")])
+    writer = SheetWriter(FakeClient(sheet), "シート")
+    writer.existing_jans()
+    sheet.rows.append(row("4549123456784", "b"))
+    assert writer.existing_jans() == {"4901234567894", "4549123456784"}
+    assert reloads(sheet) == 2
+
+
+def test_missing_header_is_restored_and_rows_still_checked():
+    sheet = FakeSheet([HEADERS, row("4901234567894", "a")])
+    writer = SheetWriter(FakeClient(sheet), "シート")
+    writer.existing_jans()
+    sheet.rows[0] = [""] * 6
+    sheet.rows.append(row("4549123456784", "b"))
+    assert "4549123456784" in writer.existing_jans()
+    assert sheet.rows[0] == HEADERS
+
+
+def test_dedupe_skips_jans_already_on_sheet():
+    sheet = FakeSheet([HEADERS, row("4901234567894", "a")])
+    writer = SheetWriter(FakeClient(sheet), "シート")
+    writer.existing_jans()
+    added = writer.add([{"jan": "4901234567894", "name": "a"}, {"jan": "4549123456784", "name": "b"},
+                        {"jan": "4549123456784", "name": "b2"}])
+    assert added == 1
+    assert writer.flush(dedupe=True) == 1
+    assert [r[0] for r in sheet.rows[1:]] == ["4901234567894", "4549123456784"]
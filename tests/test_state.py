@@ -0,0 +1,102 @@
+import asyncio
+import threading
+
+import pytest
+
+from bench.fake_redis import FakeRedis, serve
+from state import RedisState, SQLiteState, SharedState, SharedStateError
+
+
+@pytest.fixture
+def redis_url():
+    """bench/fake_redis.py をスレッドで動かし、(URL, 中身) を返す"""
+    store = FakeRedis()
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(serve("127.0.0.1", 0, store))
+    port = server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield f"redis://127.0.0.1:{port}/0", store
+
+    async def shutdown():
+        server.close()
+        handlers = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in handlers:
+            task.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+
+    asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=1)
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(timeout=1)
+    loop.close()
+
+
+def lose_reply_once(state: RedisState):
+    """次の1回だけ、コマンドは届いたが応答を受け取る前に切れたことにする"""
+    call = state._call
+    lost = []
+
+    def flaky(commands):
+        replies = call(commands)
+        if not lost:
+            lost.append(commands)
+            raise OSError("connection reset")
+        return replies
+
+    state._call = flaky
+    return lost
+
+
+def test_sqlite_lease_and_slots(tmp_path):
+    state = SQLiteState(str(tmp_path / "shared.sqlite3"))
+    assert state.acquire_lease("job", 60, owner="a")
+    assert not state.acquire_lease("job", 60, owner="b")
+    state.release_lease("job", owner="a")
+    assert state.acquire_lease("job", 60, owner="b")
+    # 同じ枠では burst 回まで
+    assert state.take_slot("api", rate=0.001, burst=2) == 0
+    assert state.take_slot("api", rate=0.001, burst=2) == 0
+    assert state.take_slot("api", rate=0.001, burst=2) > 0
+
+
+def test_redis_roundtrip(redis_url):
+    url, _ = redis_url
+    state = RedisState(url, prefix="t:")
+    state.set("a", "1")
+    state.push("events", "x", ttl=60)
+    state.push("events", "y", ttl=60)
+    assert state.get_many(["a", "missing"]) == ["1", None]
+    assert state.range("events", 1) == ["y"]
+    assert state.incr("n", ttl=60) == 1
+    assert state.add("lock", "me", ttl=60)
+    assert not state.add("lock", "you", ttl=60)
+
+
+def test_redis_does_not_resend_incr_after_lost_reply(redis_url):
+    url, store = redis_url
+    state = RedisState(url)
+    state.set("warmup", "1")
+    lose_reply_once(state)
+    with pytest.raises(SharedStateError):
+        state.incr("count", ttl=60)
+    # 1回目はサーバーに届いているので、送り直していれば 2 になる
+    assert store.data[b"count"] == b"1"
+
+
+def test_redis_resends_idempotent_commands(redis_url):
+    url, _ = redis_url
+    state = RedisState(url)
+    state.set("a", "1")
+    lost = lose_reply_once(state)
+    assert state.get("a") == "1"
+    assert lost
+
+
+def test_backend_must_implement_every_operation():
+    # 実装し忘れた操作は、呼んだ時ではなく作った時点でエラーになる
+    class Partial(SharedState):
+        def get_many(self, keys):
+            return [None for _ in keys]
+
+    with pytest.raises(TypeError):
+        Partial()
@@ -0,0 +1,78 @@
+import asyncio
+
+from watch import WatchScheduler, WatchStore
+
+URL_A = "https://item/a"
+URL_B = "https://item/b"
+
+
+def item(url: str, price: int, jan: str = "4901234567894") -> dict:
+    return {"name": url, "price": price, "jan": jan, "url": url, "shop": "他店"}
+
+
+def make_store() -> tuple[WatchStore, int]:
+    store = WatchStore(":memory:")
+    watch = store.add("jan", "4901234567894", interval_seconds=3600)
+    return store, watch["id"]
+
+
+def test_first_observation_reports_every_listing_as_new():
+    store, watch_id = make_store()
+    changes = store.record(watch_id, [item(URL_A, 1000), item(URL_B, 1200)], now=100.0)
+    assert [(c["kind"], c["url"], c["old_price"], c["new_price"]) for c in changes] == [
+        ("new", URL_A, None, 1000), ("new", URL_B, None, 1200)]
+    assert [row["url"] for row in store.latest(watch_id)] == [URL_A, URL_B]
+
+
+def test_unchanged_price_is_not_a_change_but_is_kept_in_history():
+    store, watch_id = make_store()
+    store.record(watch_id, [item(URL_A, 1000)], now=100.0)
+    assert store.record(watch_id, [item(URL_A, 1000)], now=200.0) == []
+    assert store.history(watch_id, URL_A) == [
+        {"observed_at": 100.0, "price": 1000}, {"observed_at": 200.0, "price": 1000}]
+    assert store.latest(watch_id)[0]["last_seen"] == 200.0
+
+
+def test_price_increase_and_decrease_are_reported_with_old_price():
+    store, watch_id = make_store()
+    store.record(watch_id, [item(URL_A, 1000), item(URL_B, 1200)], now=100.0)
+    changes = store.record(watch_id, [item(URL_A, 1100), item(URL_B, 900)], now=200.0)
+    assert [(c["kind"], c["url"], c["old_price"], c["new_price"]) for c in changes] == [
+        ("changed", URL_A, 1000, 1100), ("changed", URL_B, 1200, 900)]
+    # since_id で続きだけ取れる
+    first_round = store.changes(watch_id)[:2]
+    assert [c["new_price"] for c in store.changes(watch_id, since_id=first_round[-1]["id"])] == [1100, 900]
+    assert [row["price"] for row in store.latest(watch_id)] == [900, 1100]
+
+
+def test_disappeared_listing_keeps_last_price_until_seen_again():
+    store, watch_id = make_store()
+    store.record(watch_id, [item(URL_A, 1000), item(URL_B, 1200)], now=100.0)
+    # B が見つからなかった巡回は変化にしない（最後に見た価格・日時のまま残る）
+    assert store.record(watch_id, [item(URL_A, 1000)], now=200.0) == []
+    latest = {row["url"]: row for row in store.latest(watch_id)}
+    assert (latest[URL_B]["price"], latest[URL_B]["last_seen"]) == (1200, 100.0)
+    assert store.history(watch_id, URL_B) == [{"observed_at": 100.0, "price": 1200}]
+    # 再び見つかったときは前回の価格と比べる
+    changes = store.record(watch_id, [item(URL_A, 1000), item(URL_B, 1150)], now=300.0)
+    assert [(c["kind"], c["old_price"], c["new_price"]) for c in changes] == [("changed", 1200, 1150)]
+
+
+class FakeAPI:
+    def __init__(self, prices: list[int]):
+        self.prices = prices
+
+    async def find_by_jan(self, jan):
+        return [item(URL_A, self.prices.pop(0), jan)]
+
+
+def test_run_due_records_changes_and_reschedules():
+    store, watch_id = make_store()
+    scheduler = WatchScheduler(FakeAPI([1000, 900]), store, budget=100)
+    assert asyncio.run(scheduler.run_due()) == 1
+    # 次の巡回時刻まではもう対象にならない
+    assert asyncio.run(scheduler.run_due()) == 0
+    store.schedule(watch_id, next_run_at=0)
+    assert asyncio.run(scheduler.run_due()) == 1
+    assert [(c["kind"], c["new_price"]) for c in store.changes(watch_id)] == [("new", 1000), ("changed", 900)]
+    assert store.get(watch_id)["last_error"] is None
@@ -0,0 +1,417 @@
+"""
+価格ウォッチ（監視リスト・定期巡回・価格履歴）
+
+監視対象（自社商品URL または JANコード）を登録しておくと、バックグラウンドの
+スケジューラーが一定間隔で検索し直し、見つかった商品の価格を記録する。
+
+- observations: 巡回ごとの観測値（追記のみ）
+- latest_prices: 監視対象ごと・商品URLごとの最新価格
+- price_changes: 巡回のたびに latest_prices と比べて求めた差分（新規出品・価格変更）
+
+差分は巡回時に1件ずつ計算するので、変化を知るのに全件を取り直したり
+スプレッドシートを丸ごと読み直したりする必要はない。
+
+API呼び出しは1時間あたり WATCH_API_BUDGET 回までに抑え、画面からの検索と同じ
+レートリミッターを「watch」という別枠の利用者として使う。
+複数ワーカーで動かすときは、shared（state.py の共有状態）のリースを持つ1つだけが巡回する
+（WATCH_DB_PATH は全ワーカーから同じファイルを指すこと）。
+WatchStore の読み書きはSQLiteなので、イベントループからはスレッドで呼ぶ。
+
+環境変数:
+- WATCH_DB_PATH: SQLiteファイルのパス（デフォルト: data/watch.sqlite3）
+- WATCH_API_BUDGET: 巡回に使うAPI呼び出し回数の上限（1時間あたり、デフォルト: 600）
+- WATCH_MIN_INTERVAL: 巡回間隔の下限（分、デフォルト: 15）
+- WATCH_TICK: 期限の来た監視対象を確認する間隔（秒、デフォルト: 30）
+"""
+
+import asyncio
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from jan_extract import is_valid_jan
+from metrics import Counter
+from rakuten import AsyncRakutenAPI, extract_ids_from_url, decide_price_band
+from rate_limiter import current_requester
+from state import SharedState, SharedStateError
+
+logger = logging.getLogger(__name__)
+
+WATCH_RUNS = Counter("jancode_watch_runs_total", "価格ウォッチの巡回回数", ("result",))
+PRICE_CHANGES = Counter("jancode_price_changes_total", "検出した価格の変化", ("kind",))
+
+# 1時間あたりの予算の計算に使う窓（秒）
+BUDGET_WINDOW = 3600
+
+
+class WatchStore:
+    def __init__(self, path: str | None = None):
+        self.path = path or os.environ.get("WATCH_DB_PATH", "data/watch.sqlite3")
+        self._lock = threading.Lock()
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS watches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,               -- url / jan
+                target TEXT NOT NULL UNIQUE,
+                interval_seconds INTEGER NOT NULL,
+                pages INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                next_run_at REAL NOT NULL,
+                last_run_at REAL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_watches_next ON watches(next_run_at);
+
+            CREATE TABLE IF NOT EXISTS observations (
+                watch_id INTEGER NOT NULL,
+                observed_at REAL NOT NULL,
+                url TEXT NOT NULL,
+                jan TEXT NOT NULL,
+                shop TEXT NOT NULL,
+                name TEXT NOT NULL,
+                price INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_observations_watch ON observations(watch_id, url, observed_at);
+
+            CREATE TABLE IF NOT EXISTS latest_prices (
+                watch_id INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                jan TEXT NOT NULL,
+                shop TEXT NOT NULL,
+                name TEXT NOT NULL,
+                price INTEGER NOT NULL,
+                first_seen REAL NOT NULL,
+                last_seen REAL NOT NULL,
+                PRIMARY KEY (watch_id, url)
+            );
+
+            CREATE TABLE IF NOT EXISTS price_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                watch_id INTEGER NOT NULL,
+                observed_at REAL NOT NULL,
+                kind TEXT NOT NULL,               -- new / changed
+                url TEXT NOT NULL,
+                jan TEXT NOT NULL,
+                shop TEXT NOT NULL,
+                name TEXT NOT NULL,
+                old_price INTEGER,
+                new_price INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_price_changes_watch ON price_changes(watch_id, id);
+        """)
+        self._conn.commit()
+
+    # --- 監視リスト ---
+
+    def add(self, kind: str, target: str, interval_seconds: int, pages: int = 1) -> dict:
+        """監視対象を登録（同じ対象があれば間隔・ページ数を更新）して返す"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO watches (kind, target, interval_seconds, pages, created_at, next_run_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(target) DO UPDATE SET interval_seconds = excluded.interval_seconds, "
+                "pages = excluded.pages",
+                (kind, target, interval_seconds, pages, now, now)
+            )
+            self._conn.commit()
+            row = self._conn.execute("SELECT * FROM watches WHERE target = ?", (target,)).fetchone()
+        return dict(row)
+
+    def get(self, watch_id: int) -> dict | None:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM watches WHERE id = ?", (watch_id,)).fetchone()
+        return dict(row) if row else None
+
+    def watches(self) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute("""
+                SELECT w.*, COUNT(l.url) AS tracked, MIN(l.price) AS min_price
+                FROM watches w LEFT JOIN latest_prices l ON l.watch_id = w.id
+                GROUP BY w.id ORDER BY w.id
+            """).fetchall()
+        return [dict(row) for row in rows]
+
+    def remove(self, watch_id: int) -> bool:
+        """監視をやめる（観測履歴は残す）"""
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM watches WHERE id = ?", (watch_id,)).rowcount
+            self._conn.commit()
+        return bool(deleted)
+
+    def due(self, now: float, limit: int) -> list[dict]:
+        """巡回時刻を過ぎた監視対象（古い順）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM watches WHERE next_run_at <= ? ORDER BY next_run_at LIMIT ?",
+                (now, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def schedule(self, watch_id: int, next_run_at: float, ran_at: float | None = None,
+                 error: str | None = None):
+        with self._lock:
+            if ran_at is None:
+                self._conn.execute("UPDATE watches SET next_run_at = ? WHERE id = ?",
+                                   (next_run_at, watch_id))
+            else:
+                self._conn.execute(
+                    "UPDATE watches SET next_run_at = ?, last_run_at = ?, last_error = ? WHERE id = ?",
+                    (next_run_at, ran_at, error, watch_id)
+                )
+            self._conn.commit()
+
+    # --- 観測値と差分 ---
+
+    def record(self, watch_id: int, observed: list[dict], now: float | None = None) -> list[dict]:
+        """巡回結果を追記し、前回からの変化（新規・価格変更）を返す
+
+        observed は name / price / jan / url / shop を持つ辞書のリスト
+        """
+        now = now or time.time()
+        by_url = {}
+        for item in observed:
+            if item.get("url"):
+                by_url[item["url"]] = item
+
+        changes = []
+        with self._lock:
+            previous = {
+                row["url"]: row["price"]
+                for row in self._conn.execute(
+                    "SELECT url, price FROM latest_prices WHERE watch_id = ?", (watch_id,))
+            }
+            self._conn.executemany(
+                "INSERT INTO observations (watch_id, observed_at, url, jan, shop, name, price) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(watch_id, now, url, item.get("jan", ""), item.get("shop", ""), item.get("name", ""),
+                  int(item.get("price", 0))) for url, item in by_url.items()]
+            )
+            for url, item in by_url.items():
+                price = int(item.get("price", 0))
+                old_price = previous.get(url)
+                if old_price == price:
+                    continue
+                changes.append({
+                    "watch_id": watch_id,
+                    "observed_at": now,
+                    "kind": "new" if old_price is None else "changed",
+                    "url": url,
+                    "jan": item.get("jan", ""),
+                    "shop": item.get("shop", ""),
+                    "name": item.get("name", ""),
+                    "old_price": old_price,
+                    "new_price": price,
+                })
+            self._conn.executemany(
+                "INSERT INTO price_changes (watch_id, observed_at, kind, url, jan, shop, name, "
+                "old_price, new_price) VALUES (:watch_id, :observed_at, :kind, :url, :jan, :shop, "
+                ":name, :old_price, :new_price)",
+                changes
+            )
+            self._conn.executemany(
+                "INSERT INTO latest_prices (watch_id, url, jan, shop, name, price, first_seen, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(watch_id, url) DO UPDATE SET price = excluded.price, "
+                "jan = CASE WHEN excluded.jan != '' THEN excluded.jan ELSE latest_prices.jan END, "
+                "shop = excluded.shop, name = excluded.name, last_seen = excluded.last_seen",
+                [(watch_id, url, item.get("jan", ""), item.get("shop", ""), item.get("name", ""),
+                  int(item.get("price", 0)), now, now) for url, item in by_url.items()]
+            )
+            self._conn.commit()
+        return changes
+
+    def changes(self, watch_id: int | None = None, since_id: int = 0, limit: int = 500) -> list[dict]:
+        """since_id より後の価格変化（id順）。続きは最後の id を since_id に渡して取る"""
+        query = "SELECT * FROM price_changes WHERE id > ?"
+        params: list = [since_id]
+        if watch_id is not None:
+            query += " AND watch_id = ?"
+            params.append(watch_id)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def history(self, watch_id: int, url: str) -> list[dict]:
+        """1商品の価格の推移"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT observed_at, price FROM observations WHERE watch_id = ? AND url = ? "
+                "ORDER BY observed_at",
+                (watch_id, url)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest(self, watch_id: int) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT url, jan, shop, name, price, first_seen, last_seen FROM latest_prices "
+                "WHERE watch_id = ? ORDER BY price",
+                (watch_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+def parse_target(target: str) -> tuple[str, str] | None:
+    """監視対象の文字列を (種類, 正規化した値) にする。不正なら None"""
+    target = target.strip()
+    digits = re.sub(r"[\s-]", "", target)
+    if digits.isdigit():
+        return ("jan", digits) if is_valid_jan(digits) else None
+    if extract_ids_from_url(target):
+        return ("url", target)
+    return None
+
+
+class WatchScheduler:
+    """期限の来た監視対象を順に巡回するバックグラウンド処理"""
+
+    def __init__(self, api: AsyncRakutenAPI, store: WatchStore, budget: int | None = None,
+                 tick: float | None = None, shared: SharedState | None = None):
+        self.api = api
+        self.store = store
+        self.shared = shared
+        # 直近の確認で巡回の担当だったか
+        self._leader = shared is None
+        self.budget = budget if budget is not None else int(os.environ.get("WATCH_API_BUDGET", 600))
+        self.tick = tick if tick is not None else float(os.environ.get("WATCH_TICK", 30))
+        # 直近1時間のAPI呼び出し（時刻, 回数）
+        self._spent: deque[tuple[float, int]] = deque()
+        self.task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+    @staticmethod
+    def estimated_calls(watch: dict) -> int:
+        """1回の巡回で使うAPI呼び出し回数の見積もり"""
+        if watch["kind"] == "jan":
+            return 1
+        # 自社商品の取得 + 競合検索のページ数 + JANでの検索（同じJANの出品は通常1ページに収まる）
+        return 1 + watch["pages"] + 1
+
+    def _remaining_budget(self, now: float) -> int:
+        while self._spent and now - self._spent[0][0] >= BUDGET_WINDOW:
+            self._spent.popleft()
+        return self.budget - sum(calls for _, calls in self._spent)
+
+    async def observe(self, watch: dict) -> list[dict]:
+        """監視対象を1回検索して、見つかった商品を返す"""
+        if watch["kind"] == "jan":
+            return await self.api.find_by_jan(watch["target"])
+
+        shop_code, item_id = extract_ids_from_url(watch["target"])
+        product = await self.api.get_item(shop_code, item_id)
+        if not product:
+            raise RuntimeError("商品が見つかりません")
+        price_min, price_max, _ = decide_price_band(product["price"])
+        competitors = await self.api.search_competitors(
+            category_id=product["categoryId"],
+            price_min=price_min,
+            price_max=price_max,
+            exclude_shop=product["shopId"],
+            pages=watch["pages"],
+            jan=product["jan"],
+            # APIエラーで欠けた結果を観測として記録しない（巡回失敗として次回に回す）
+            strict=True
+        )
+        seed = {"name": product["name"], "price": product["price"], "jan": product["jan"],
+                "url": product["url"], "shop": product["shopName"]}
+        return [seed] + competitors
+
+    async def run_once(self, watch: dict) -> list[dict]:
+        """1件巡回して記録し、価格の変化を返す"""
+        now = time.time()
+        self._spent.append((now, self.estimated_calls(watch)))
+        try:
+            observed = await self.observe(watch)
+        except Exception as e:
+            WATCH_RUNS.inc(result="error")
+            logger.warning(f"[ウォッチ] 巡回失敗 {watch['target']}: {e}")
+            await asyncio.to_thread(self.store.schedule, watch["id"], now + watch["interval_seconds"],
+                                    ran_at=now, error=str(e))
+            return []
+
+        changes = await asyncio.to_thread(self.store.record, watch["id"], observed, now)
+        for change in changes:
+            PRICE_CHANGES.inc(kind=change["kind"])
+        await asyncio.to_thread(self.store.schedule, watch["id"], now + watch["interval_seconds"], ran_at=now)
+        WATCH_RUNS.inc(result="ok")
+        logger.info(f"[ウォッチ] {watch['target']}: {len(observed)}件 観測、変化 {len(changes)}件",
+                    extra={"watch_id": watch["id"], "observed": len(observed), "changes": len(changes)})
+        return changes
+
+    def _is_leader(self) -> bool:
+        """巡回の担当（リース）を取る・延長する。共有しない・共有先に届かないときは自分が担当（スレッドで呼ぶ）"""
+        if self.shared is None:
+            return True
+        try:
+            self._leader = self.shared.acquire_lease("watch:scheduler", ttl=max(self.tick * 3, 120))
+        except SharedStateError as e:
+            logger.warning(f"[ウォッチ] 共有状態に接続できないため、このワーカーで巡回します: {e}")
+            self._leader = True
+        return self._leader
+
+    async def run_due(self) -> int:
+        """期限の来た監視対象を予算の範囲で巡回し、巡回した件数を返す"""
+        # 他のワーカーが担当していれば巡回しない（担当中は1件ごとにリースを延長する）
+        if not await asyncio.to_thread(self._is_leader):
+            return 0
+        count = 0
+        for watch in await asyncio.to_thread(self.store.due, time.time(), 100):
+            if count and not await asyncio.to_thread(self._is_leader):
+                break
+            if self._remaining_budget(time.time()) < self.estimated_calls(watch):
+                logger.info("[ウォッチ] API予算の上限に達したため残りは次回に回します")
+                break
+            await self.run_once(watch)
+            count += 1
+        return count
+
+    def wake(self):
+        """次の確認を待たずに巡回させる（登録・手動実行時）"""
+        self._wakeup.set()
+
+    async def run_forever(self):
+        # 画面からの検索と別枠でAPIの順番待ちをする
+        current_requester.set("watch")
+        while True:
+            try:
+                await self.run_due()
+            except Exception as e:
+                logger.error(f"[ウォッチ] スケジューラーエラー: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.tick)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "budget_per_hour": self.budget,
+            "remaining_budget": self._remaining_budget(time.time()),
+            "running": bool(self.task and not self.task.done()),
+            "leader": self._leader,
+        }